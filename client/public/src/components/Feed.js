@@ -3,21 +3,33 @@ import React, { useState, useEffect } from 'react';
 
 function Feed() {
     const [posts, setPosts] = useState([]);
+    const [nextCursor, setNextCursor] = useState(null);
 
-    useEffect(() => {
-        fetch('/posts')
+    const loadPosts = (cursor) => {
+        const url = cursor ? `/posts?cursor=${encodeURIComponent(cursor)}` : '/posts';
+        fetch(url)
             .then(res => res.json())
-            .then(data => setPosts(data));
+            .then(data => {
+                setPosts(prev => cursor ? [...prev, ...data.posts] : data.posts);
+                setNextCursor(data.next_cursor);
+            });
+    };
+
+    useEffect(() => {
+        loadPosts(null);
     }, []);
 
     return (
         <div>
-            {posts.map((post, index) => (
-                <div key={index}>
-                    <h3>{post.user}</h3>
+            {posts.map((post) => (
+                <div key={post.id}>
+                    <h3>{post.author.username}</h3>
                     <p>{post.content}</p>
                 </div>
             ))}
+            {nextCursor && (
+                <button onClick={() => loadPosts(nextCursor)}>Load more</button>
+            )}
         </div>
     );
 }
@@ -0,0 +1,383 @@
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, jsonify, request, session
+
+# Admission control: per-client rate limits and adaptive concurrency limits.
+#
+# Every request is put in an endpoint class (ENDPOINT_CLASSES, else 'read'
+# for GET and HEAD and 'write' for the rest), and then has to get past two
+# checks before its view runs:
+#
+# 1. A token bucket per client per class, from RATE_LIMITS[class] = (tokens
+#    per second, burst). Logged-in clients are keyed by user id and others
+#    by address (the client's, as forwarded by TRUSTED_PROXY_HOPS proxies;
+#    see app.py). Failed logins at /login and /token also spend from a
+#    bucket for the username and address together (RATE_LIMIT_LOGIN), so
+#    guessing one account's password is slowed without anyone else being
+#    able to lock its owner out. An empty bucket answers 429 with
+#    Retry-After set to when the next token arrives. Buckets live in this process
+#    (RATE_LIMIT_BACKEND = 'memory', so each gunicorn worker counts on its
+#    own) or in Redis, shared by every process. If Redis fails, requests are
+#    let through rather than failing.
+#
+# 2. A concurrency limit per class in this process, adjusted to observed
+#    latency. Each limiter keeps a slow average of its latency as the
+#    baseline and a fast one over the last ADMISSION_SAMPLE_SIZE requests.
+#    While the fast one stays within ADMISSION_TOLERANCE times the baseline
+#    the limit grows by about its square root per sample, so a class that
+#    is busy can use more concurrency. Once latency climbs past that, the
+#    limit shrinks in proportion to how far past it is. Requests past
+#    the limit wait up to ADMISSION_QUEUE_TIMEOUT in a queue of
+#    ADMISSION_QUEUE_SIZE. If the queue is full or the wait times out they
+#    get 503, with Retry-After estimated from the latency and the queue
+#    length. Slow classes (bcrypt, uploads, exports) have their own limits,
+#    so overloading one doesn't starve the others of workers and database
+#    connections.
+#
+# Rejections, queueing and each limiter's state are exported on /metrics.
+
+logger = logging.getLogger(__name__)
+
+ENDPOINT_CLASSES = {
+    'auth.signup': 'auth',
+    'auth.login': 'auth',
+    'auth.create_token': 'auth',
+    'auth.refresh_token': 'auth',
+    'auth.upload_avatar': 'upload',
+    'auth.export_data': 'export',
+    'auth.search': 'search',
+}
+# Endpoints whose failures (401) spend from the username and address bucket
+LOGIN_ENDPOINTS = {'auth.login', 'auth.create_token'}
+EXEMPT_ENDPOINTS = {'metrics', 'static'}
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class MemoryBucketStore:
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        # key -> [tokens, last refill], least recently used first
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Returns the tokens left after taking `cost`, or a negative shortfall
+    # if there weren't enough (and nothing was taken)
+    def take(self, key, rate, burst, cost=1):
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [burst, now]
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            # Forgetting a bucket only refills it early, so evicting is safe
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            if bucket[0] < cost:
+                return bucket[0] - cost
+            bucket[0] -= cost
+            return bucket[0]
+
+
+# Refill and take in one round trip, on the Redis server's clock so every
+# process agrees; keys expire once they would be full again anyway
+TAKE_SCRIPT = """
+local rate, burst, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local left = tokens - cost
+if left >= 0 then
+    tokens = left
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(left)
+"""
+
+
+class RedisBucketStore:
+    def __init__(self, client, prefix='ratelimit'):
+        self.client = client
+        self.prefix = prefix
+        self._take = client.register_script(TAKE_SCRIPT)
+
+    def take(self, key, rate, burst, cost=1):
+        return float(self._take(keys=[f"{self.prefix}:{key}"], args=[rate, burst, cost]))
+
+
+def create_bucket_store(config):
+    backend = config.get('RATE_LIMIT_BACKEND', 'memory')
+    if backend == 'memory':
+        return MemoryBucketStore(config.get('RATE_LIMIT_MAX_KEYS', 100000))
+    if backend == 'redis':
+        import redis  # Only needed when the redis backend is configured
+        return RedisBucketStore(redis.Redis.from_url(config['RATE_LIMIT_REDIS_URL']))
+    raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {backend}")
+
+
+class AdaptiveLimiter:
+    def __init__(self, initial_limit=20, min_limit=2, max_limit=200, queue_size=50, queue_timeout=0.5,
+                 tolerance=2.0, sample_size=20, smoothing=0.2, baseline_weight=0.02):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.tolerance = tolerance
+        self.sample_size = sample_size
+        self.smoothing = smoothing
+        self.baseline_weight = baseline_weight
+        self.in_flight = 0
+        self.waiting = 0
+        # Most requests in flight at once during the current sample
+        self.peak = 0
+        self.baseline = None
+        self.latency = None
+        self._sample = []
+        self._cond = threading.Condition()
+
+    def _has_room(self):
+        return self.in_flight < max(1, int(self.limit))
+
+    # Returns (admitted, seconds spent queued)
+    def acquire(self):
+        with self._cond:
+            if self._has_room():
+                self.in_flight += 1
+                self.peak = max(self.peak, self.in_flight)
+                return True, 0.0
+            if self.waiting >= self.queue_size:
+                return False, 0.0
+            started = time.monotonic()
+            deadline = started + self.queue_timeout
+            self.waiting += 1
+            try:
+                while not self._has_room():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False, time.monotonic() - started
+                    self._cond.wait(remaining)
+                self.in_flight += 1
+                self.peak = max(self.peak, self.in_flight)
+                return True, time.monotonic() - started
+            finally:
+                self.waiting -= 1
+
+    def release(self, latency):
+        with self._cond:
+            self.in_flight -= 1
+            self._observe(latency)
+            self._cond.notify()
+
+    def _observe(self, latency):
+        self._sample.append(latency)
+        if len(self._sample) < self.sample_size:
+            return
+        self.latency = sum(self._sample) / len(self._sample)
+        busy, self.peak = self.peak, self.in_flight
+        self._sample = []
+        if self.baseline is None:
+            self.baseline = self.latency
+        else:
+            self.baseline += (self.latency - self.baseline) * self.baseline_weight
+            # Follow a drop in latency quickly, or the next rise would go unnoticed
+            self.baseline = min(self.baseline, self.latency * self.tolerance)
+        gradient = max(0.5, min(1.0, self.tolerance * self.baseline / max(self.latency, 1e-6)))
+        if gradient < 1.0:
+            target = self.limit * gradient
+        elif busy >= self.limit / 2:
+            # Probe upwards, but only a limit that is being used
+            target = self.limit + math.sqrt(self.limit)
+        else:
+            return
+        self.limit = max(self.min_limit, min(self.max_limit, self.limit + (target - self.limit) * self.smoothing))
+
+    # Seconds until a rejected client is likely to get in: the current
+    # queue drained at the current limit and latency
+    def retry_after(self):
+        latency = self.latency or self.baseline or 1.0
+        return max(1, math.ceil(latency * (self.waiting + 1) / max(self.limit, 1)))
+
+    def stats(self):
+        return {"limit": self.limit, "in_flight": self.in_flight, "waiting": self.waiting,
+                "latency": self.latency or 0.0}
+
+
+class Admission:
+    def __init__(self, config, metrics=None):
+        self.config = config
+        self.metrics = metrics
+        self._store = None
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    # Built on first use, in the worker rather than gunicorn's preloading master
+    @property
+    def store(self):
+        if self._store is None:
+            with self._lock:
+                if self._store is None:
+                    self._store = create_bucket_store(self.config)
+        return self._store
+
+    def limiter(self, endpoint_class):
+        limiter = self._limiters.get(endpoint_class)
+        if limiter is None:
+            with self._lock:
+                limiter = self._limiters.get(endpoint_class)
+                if limiter is None:
+                    config = self.config
+                    settings = {
+                        "initial_limit": config.get('ADMISSION_INITIAL_LIMIT', 20),
+                        "min_limit": config.get('ADMISSION_MIN_LIMIT', 2),
+                        "max_limit": config.get('ADMISSION_MAX_LIMIT', 200),
+                        "queue_size": config.get('ADMISSION_QUEUE_SIZE', 50),
+                        "queue_timeout": config.get('ADMISSION_QUEUE_TIMEOUT', 0.5),
+                        "tolerance": config.get('ADMISSION_TOLERANCE', 2.0),
+                        "sample_size": config.get('ADMISSION_SAMPLE_SIZE', 20),
+                    }
+                    settings.update(config.get('ADMISSION_CLASS_SETTINGS', {}).get(endpoint_class, {}))
+                    limiter = self._limiters[endpoint_class] = AdaptiveLimiter(**settings)
+        return limiter
+
+    def count(self, name, labels):
+        if self.metrics is not None:
+            self.metrics.inc(name, labels)
+
+    # Seconds to wait if any of the buckets is short of `cost` tokens, else
+    # None. cost=0 only looks: the buckets are charged later with charge()
+    def check_rate(self, endpoint_class, keys, rate, burst, cost=1):
+        wait = None
+        for key_type, key in keys:
+            try:
+                left = self.store.take(f"{endpoint_class}:{key_type}:{key}", rate, burst, cost)
+            except Exception:
+                logger.warning("Rate limit store unavailable; letting the request through", exc_info=True)
+                self.count('rate_limit_errors_total', (('class', endpoint_class),))
+                return None
+            shortfall = -left if cost else 1 - left
+            if shortfall > 0:
+                self.count('rate_limited_total', (('class', endpoint_class), ('key', key_type)))
+                wait = max(wait or 0, shortfall / rate)
+        return wait
+
+    def charge(self, endpoint_class, keys, rate, burst):
+        for key_type, key in keys:
+            try:
+                self.store.take(f"{endpoint_class}:{key_type}:{key}", rate, burst)
+            except Exception:
+                logger.warning("Rate limit store unavailable; not charging", exc_info=True)
+                self.count('rate_limit_errors_total', (('class', endpoint_class),))
+
+    def gauges(self):
+        for endpoint_class, limiter in list(self._limiters.items()):
+            labels = (('class', endpoint_class),)
+            stats = limiter.stats()
+            yield 'admission_limit', labels, stats['limit']
+            yield 'admission_in_flight', labels, stats['in_flight']
+            yield 'admission_waiting', labels, stats['waiting']
+            yield 'admission_latency_seconds', labels, stats['latency']
+
+
+def get_admission():
+    return current_app.extensions['admission']
+
+
+def endpoint_class(endpoint, method):
+    if endpoint in ENDPOINT_CLASSES:
+        return ENDPOINT_CLASSES[endpoint]
+    return 'read' if method in ('GET', 'HEAD') else 'write'
+
+
+def _reject(status, message, retry_after):
+    response = jsonify({"error": message})
+    response.status_code = status
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def _client_address():
+    return request.remote_addr or 'unknown'
+
+
+def _rate_limit_keys():
+    if 'user_id' in session:
+        return [('user', session['user_id'])]
+    return [('client', _client_address())]
+
+
+# The username and address bucket a login attempt is checked against, if any
+def _login_keys():
+    username = (request.get_json(silent=True) or {}).get('username')
+    if not isinstance(username, str) or not username:
+        return None
+    return [('username', f"{username.lower()}:{_client_address()}")]
+
+
+def _before_request():
+    endpoint = request.endpoint
+    if endpoint is None or endpoint in EXEMPT_ENDPOINTS:
+        return None
+    admission = get_admission()
+    config = current_app.config
+    name = endpoint_class(endpoint, request.method)
+
+    limits = config.get('RATE_LIMITS', {}).get(name)
+    if limits:
+        wait = admission.check_rate(name, _rate_limit_keys(), *limits)
+        login_keys = _login_keys() if endpoint in LOGIN_ENDPOINTS else None
+        if wait is None and login_keys:
+            wait = admission.check_rate('login', login_keys, *config.get('RATE_LIMIT_LOGIN', (0.05, 5)), cost=0)
+            g.admission_login_keys = login_keys
+        if wait is not None:
+            return _reject(429, "Too many requests, please slow down", wait)
+
+    limiter = admission.limiter(name)
+    admitted, waited = limiter.acquire()
+    labels = (('class', name),)
+    if waited and admission.metrics is not None:
+        admission.metrics.inc('admission_queued_total', labels)
+        admission.metrics.observe('admission_queue_wait_seconds', labels, waited, WAIT_BUCKETS)
+    if not admitted:
+        admission.count('admission_rejected_total', labels + (('reason', 'timeout' if waited else 'queue_full'),))
+        return _reject(503, "Server is busy, please try again shortly", limiter.retry_after())
+    g.admission_slot = (limiter, time.monotonic())
+    return None
+
+
+# Only failed logins spend from the login bucket
+def _after_request(response):
+    login_keys = g.pop('admission_login_keys', None)
+    if login_keys and response.status_code == 401:
+        get_admission().charge('login', login_keys, *current_app.config.get('RATE_LIMIT_LOGIN', (0.05, 5)))
+    return response
+
+
+# Runs after the response is sent (or the stream closed), whatever happened
+def _teardown_request(exc):
+    slot = g.pop('admission_slot', None)
+    if slot is not None:
+        limiter, started = slot
+        limiter.release(time.monotonic() - started)
+
+
+def init_admission(app):
+    if not app.config.get('ADMISSION_ENABLED', True):
+        return
+    metrics = app.extensions.get('metrics')
+    admission = app.extensions['admission'] = Admission(app.config, metrics)
+    if metrics is not None:
+        metrics.add_gauges(admission.gauges)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
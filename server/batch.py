@@ -0,0 +1,104 @@
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import select
+
+from counters import adjust_counters, count_post, is_hot
+from dbutil import insert_ignore, insert_many_returning_ids
+from models import db, User, Post, Friendship
+from search import index_hashtags
+
+# Batch write paths behind POST /posts/batch and POST /follow/batch.
+#
+# Each batch is validated item by item, then written with a handful of
+# set-based statements (multi-row INSERTs, one counter update per touched
+# user) in the caller's transaction, so a batch costs one commit however
+# many items it holds. Items that fail validation are reported back and
+# skipped; they never abort the rest of the batch.
+
+TITLE_MAX_LENGTH = Post.__table__.c.title.type.length
+
+
+def batch_max_items():
+    return current_app.config.get('BATCH_MAX_ITEMS', 1000)
+
+
+# The list under `key` in a batch request body, or an error message
+def batch_items(data, key):
+    items = data.get(key) if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return None, f"{key} must be a non-empty list"
+    if len(items) > batch_max_items():
+        return None, f"At most {batch_max_items()} {key} per batch"
+    return items, None
+
+
+def post_item_error(item):
+    if not isinstance(item, dict) or not item.get('title') or not item.get('content'):
+        return "Title and content are required"
+    if not isinstance(item['title'], str) or not isinstance(item['content'], str):
+        return "Title and content must be strings"
+    if len(item['title']) > TITLE_MAX_LENGTH:
+        return f"Title is longer than {TITLE_MAX_LENGTH} characters"
+    return None
+
+
+# Insert validated {"title", "content"} items for one author; returns the
+# new ids in item order
+def create_posts(user_id, items):
+    now = datetime.utcnow()
+    values = [{"title": item['title'], "content": item['content'], "user_id": user_id, "created_at": now}
+              for item in items]
+    connection = db.session.connection()
+    post_ids = insert_many_returning_ids(connection, Post.__table__, values)
+    index_hashtags(connection, [(post_id, f"{item['title']} {item['content']}")
+                                for post_id, item in zip(post_ids, items)])
+    count_post(user_id, len(post_ids))
+    return post_ids
+
+
+# Follow every account in followed_ids (distinct, not the follower).
+# Returns ({followed_id: status}, {followed_id: new friendship id}) where
+# status is "followed", "already_following" or "not_found".
+def follow_users(follower, followed_ids):
+    targets = {row.id: row for row in db.session.query(User.id, User.follower_count)
+               .filter(User.id.in_(followed_ids))}
+    already = {row.followed_id for row in db.session.query(Friendship.followed_id)
+               .filter(Friendship.follower_id == follower.id, Friendship.followed_id.in_(list(targets)))}
+
+    values = [{"follower_id": follower.id, "followed_id": followed_id}
+              for followed_id in targets if followed_id not in already]
+    created = {}
+    if values:
+        connection = db.session.connection()
+        table = Friendship.__table__
+        # ON CONFLICT DO NOTHING settles follows that raced in since the check
+        statement = insert_ignore(connection, table)
+        if connection.dialect.insert_executemany_returning:
+            rows = connection.execute(statement.returning(table.c.followed_id, table.c.id), values).all()
+        else:
+            rows = []
+            for row in values:
+                result = connection.execute(statement, row)
+                if result.rowcount:
+                    rows.append((row["followed_id"], connection.execute(
+                        select(table.c.id).where(table.c.follower_id == follower.id,
+                                                 table.c.followed_id == row["followed_id"])).scalar()))
+        created = dict(rows)
+
+    if created:
+        deltas = {(follower.id, 'following_count'): len(created)}
+        deltas.update({(followed_id, 'follower_count'): 1 for followed_id in created})
+        sharded = {(followed_id, 'follower_count') for followed_id in created
+                   if is_hot(targets[followed_id].follower_count)}
+        adjust_counters(deltas, sharded)
+
+    statuses = {}
+    for followed_id in followed_ids:
+        if followed_id not in targets:
+            statuses[followed_id] = "not_found"
+        elif followed_id in created:
+            statuses[followed_id] = "followed"
+        else:
+            statuses[followed_id] = "already_following"
+    return statuses, created
@@ -0,0 +1,106 @@
+import argparse
+import threading
+import time
+from collections import Counter
+
+from common import make_app, login_as
+import seed as seeder
+from models import db
+
+# Login flood against admission control.
+#
+# Seeds a database with seed.py, then has --flood-threads threads post
+# wrong passwords for the demo users to /login (bcrypt at the production
+# cost) from --flood-clients addresses, while one logged-in client keeps
+# polling /check_session. Runs three ways: admission off, concurrency
+# limits only (no rate limits) and both, and reports the status codes the
+# flood got and the poller's latency:
+#
+#   python benchmarks/admission.py --seconds 10 --flood-threads 32
+
+USERNAMES = ['john_doe', 'jane_smith', 'mike_lee']
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] if ordered else 0.0
+
+
+def flood(app, stop, statuses, lock, thread, clients):
+    client = app.test_client()
+    sent = 0
+    while not stop.is_set():
+        response = client.post('/login', json={"username": USERNAMES[sent % len(USERNAMES)], "password": "wrong"},
+                               environ_base={'REMOTE_ADDR': f"10.0.{thread % clients // 256}.{thread % clients % 256}"})
+        with lock:
+            statuses[response.status_code] += 1
+        sent += 1
+        # A real client would back off; this one just keeps coming
+        if response.status_code in (429, 503):
+            time.sleep(0.01)
+
+
+def probe(app, stop, latencies, errors):
+    client = app.test_client()
+    login_as(client, 1)
+    while not stop.is_set():
+        started = time.perf_counter()
+        response = client.get('/check_session', environ_base={'REMOTE_ADDR': '10.1.0.1'})
+        latencies.append(time.perf_counter() - started)
+        if response.status_code != 200:
+            errors[response.status_code] += 1
+        time.sleep(0.005)
+
+
+def run(app, args):
+    stop = threading.Event()
+    statuses, errors, latencies = Counter(), Counter(), []
+    lock = threading.Lock()
+    threads = [threading.Thread(target=flood, args=(app, stop, statuses, lock, i, args.flood_clients))
+               for i in range(args.flood_threads)]
+    threads.append(threading.Thread(target=probe, args=(app, stop, latencies, errors)))
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return statuses, errors, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database-url', default='sqlite:////tmp/buzznexus_admission.db')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--flood-threads', type=int, default=32)
+    parser.add_argument('--flood-clients', type=int, default=4, help="distinct addresses the flood comes from")
+    parser.add_argument('--skip-seed', action='store_true')
+    args = parser.parse_args()
+
+    if not args.skip_seed:
+        seeder.seed(seeder.parse_args([
+            '--database-url', args.database_url,
+            '--users', str(args.users),
+            '--posts-per-user', '1',
+        ]))
+
+    modes = [
+        ('off', {"ADMISSION_ENABLED": False}),
+        ('concurrency only', {"ADMISSION_ENABLED": True, "RATE_LIMITS": {}}),
+        ('rate + concurrency', {"ADMISSION_ENABLED": True}),
+    ]
+    print(f"\n{'mode':20} {'logins/s':>9} {'401':>7} {'429':>7} {'503':>7} "
+          f"{'probe p50 ms':>13} {'probe p99 ms':>13} {'probe errors':>13}")
+    for name, overrides in modes:
+        app = make_app(args.database_url, **overrides)
+        statuses, errors, latencies = run(app, args)
+        with app.app_context():
+            db.engine.dispose()
+        print(f"{name:20} {statuses[401] / args.seconds:>9.1f} {statuses[401]:>7} {statuses[429]:>7} "
+              f"{statuses[503]:>7} {percentile(latencies, 50) * 1000:>13.3f} "
+              f"{percentile(latencies, 99) * 1000:>13.3f} {sum(errors.values()):>13}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+import argparse
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from common import make_app, login_as
+from models import db, User
+
+# Avatar upload benchmark.
+#
+# Uploads --uploads distinct --width x --height JPEGs from --threads client
+# threads while a "cheap endpoint" thread keeps doing small units of work,
+# for thumbnailing inline (MEDIA_WORKERS = 0) and in pools of increasing
+# size. Reports uploads per second, the cheap endpoint's latency, and the
+# peak memory Python allocated in this process per upload, which stays
+# around one chunk because bodies are streamed to disk. Then re-uploads an
+# image already stored, which only hashes it:
+#
+#   python benchmarks/avatars.py --uploads 32 --width 4000 --height 3000
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def cheap_endpoint(stop, samples):
+    while not stop.is_set():
+        start = time.perf_counter()
+        sum(range(2000))
+        samples.append(time.perf_counter() - start)
+        time.sleep(0.001)
+
+
+def make_images(count, width, height):
+    images = []
+    for i in range(count):
+        image = Image.merge('RGB', [Image.effect_noise((width, height), 64)] * 3)
+        image.putpixel((i % width, 0), (i % 256, 0, 0))  # distinct content, distinct hash
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=90)
+        images.append(buffer.getvalue())
+    return images
+
+
+def run(app, images, threads):
+    local = threading.local()
+
+    def upload(item):
+        body, length = item
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app.test_client()
+            login_as(client, 1)
+        response = client.post('/profile/avatar', input_stream=body, content_type='image/jpeg',
+                               headers={'Content-Length': str(length)})
+        return response.status_code
+
+    # Built before tracing, so the client's copies of the bodies don't count
+    bodies = [(io.BytesIO(image), len(image)) for image in images]
+
+    stop = threading.Event()
+    samples = []
+    probe = threading.Thread(target=cheap_endpoint, args=(stop, samples))
+    probe.start()
+    tracemalloc.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        statuses = list(pool.map(upload, bodies))
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stop.set()
+    probe.join()
+    assert all(status == 200 for status in statuses), statuses
+    return len(images) / elapsed, percentile(samples, 50), percentile(samples, 99), peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--uploads', type=int, default=32)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--width', type=int, default=4000)
+    parser.add_argument('--height', type=int, default=3000)
+    args = parser.parse_args()
+
+    images = make_images(args.uploads, args.width, args.height)
+    size_mb = sum(map(len, images)) / len(images) / 1e6
+    print(f"\n{args.uploads} uploads of {args.width}x{args.height} JPEGs, {size_mb:.1f} MB each")
+    print(f"{'workers':>8} {'uploads/s':>10} {'cheap p50 ms':>13} {'cheap p99 ms':>13} {'peak MB':>8}")
+    for workers in [0] + sorted({1, 2, os.cpu_count() or 1}):
+        root = tempfile.mkdtemp(prefix='avatars-')
+        app = make_app('sqlite:////tmp/buzznexus_avatars.db', MEDIA_ROOT=root, MEDIA_WORKERS=workers,
+                       MEDIA_QUEUE_SIZE=args.uploads, MEDIA_TIMEOUT=300)
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            db.session.add(User(username='user1', _password_hash='x'))
+            db.session.commit()
+        run(app, images[:1], 1)  # start the pool
+
+        throughput, p50, p99, peak = run(app, images[1:], args.threads)
+        print(f"{workers:>8} {throughput:>10.2f} {p50 * 1000:>13.3f} {p99 * 1000:>13.3f} {peak / 1e6:>8.2f}")
+
+        started = time.perf_counter()
+        run(app, images[1:2], 1)
+        repeat_ms = (time.perf_counter() - started) * 1000
+        app.extensions['thumbnail_pool'].shutdown()
+        shutil.rmtree(root)
+    print(f"re-uploading a stored image: {repeat_ms:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import argparse
+import time
+
+from common import make_app, login_as
+import seed as seeder
+from models import db
+
+# Per-item vs batch write endpoints on an N-item import.
+#
+# Seeds users only, then imports --items posts through POST /posts one at a
+# time and through POST /posts/batch, and follows --items accounts through
+# POST /follow/<id> and POST /follow/batch, each as a different user so
+# neither path sees the other's rows:
+#
+#   python benchmarks/batch_writes.py --items 10000
+#   python benchmarks/batch_writes.py --database-url postgresql://localhost/connectsphere_bench
+
+
+def timed(label, calls, items):
+    started = time.perf_counter()
+    for call in calls:
+        response = call()
+        assert response.status_code in (200, 201), (label, response.status_code, response.get_data(as_text=True))
+    elapsed = time.perf_counter() - started
+    print(f"{label:24} {items:>7} items {elapsed:>8.2f}s {items / elapsed:>10.1f} items/s")
+    return elapsed
+
+
+def chunks(items, size):
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database-url', default='sqlite:////tmp/buzznexus_batch.db')
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    seeder.seed(seeder.parse_args([
+        '--database-url', args.database_url,
+        '--users', str(args.items + 4),
+        '--posts-per-user', '0',
+        '--follows-per-user', '0',
+        '--notifications-per-user', '0',
+    ]))
+    app = make_app(args.database_url, BATCH_MAX_ITEMS=args.batch_size)
+    client = app.test_client()
+    posts = [{'title': f'import {i}', 'content': f'imported post {i} #import'} for i in range(args.items)]
+
+    print()
+    login_as(client, 1)
+    single = timed('POST /posts', [lambda post=post: client.post('/posts', json=post) for post in posts], args.items)
+    login_as(client, 2)
+    batch = timed('POST /posts/batch', [lambda chunk=chunk: client.post('/posts/batch', json={'posts': chunk})
+                                        for chunk in chunks(posts, args.batch_size)], args.items)
+    print(f"{'':24} batch is {single / batch:.1f}x faster\n")
+
+    targets = list(range(5, args.items + 5))
+    login_as(client, 3)
+    single = timed('POST /follow/<id>', [lambda target=target: client.post(f'/follow/{target}')
+                                         for target in targets], args.items)
+    login_as(client, 4)
+    batch = timed('POST /follow/batch', [lambda chunk=chunk: client.post('/follow/batch', json={'user_ids': chunk})
+                                         for chunk in chunks(targets, args.batch_size)], args.items)
+    print(f"{'':24} batch is {single / batch:.1f}x faster")
+
+    with app.app_context():
+        db.engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
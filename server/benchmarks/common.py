@@ -0,0 +1,43 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event  # noqa: E402
+
+from app import create_app  # noqa: E402
+from models import db  # noqa: E402
+
+# Shared helpers for the scripts in this directory.
+
+
+# The production app under config.TestingConfig, against the given database
+# URL, with its schema created
+def make_app(database_url, **overrides):
+    app = create_app(config_object='config.TestingConfig', SQLALCHEMY_DATABASE_URI=database_url, **overrides)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+# Log in through the session cookie without paying for bcrypt
+def login_as(client, user_id):
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+
+
+# Records (statement, parameters) for every statement the engine runs
+class StatementRecorder:
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append((statement, parameters))
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, 'before_cursor_execute', self._record)
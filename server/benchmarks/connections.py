@@ -0,0 +1,207 @@
+from gevent import monkey
+monkey.patch_all()
+
+import argparse  # noqa: E402
+import os  # noqa: E402
+import resource  # noqa: E402
+import signal  # noqa: E402
+import socket  # noqa: E402
+import subprocess  # noqa: E402
+import sys  # noqa: E402
+import time  # noqa: E402
+import urllib.request  # noqa: E402
+
+import gevent  # noqa: E402
+import gevent.pool  # noqa: E402
+from wsproto import ConnectionType, WSConnection  # noqa: E402
+from wsproto.events import CloseConnection, Message, RejectConnection, Request, TextMessage  # noqa: E402
+
+from common import make_app  # noqa: E402
+import seed as seeder  # noqa: E402
+
+# Idle Socket.IO connections one node can hold.
+#
+# Starts the production server (gunicorn with gevent workers, gunicorn.conf.py)
+# on a seeded database, opens --connections WebSocket connections to the
+# /live namespace as logged-in users and keeps them idle for --hold
+# seconds, answering Engine.IO pings like a browser would. Reports how many
+# connected and survived, the server's memory per connection (PSS counts
+# pages shared copy-on-write with the preloading master once), and HTTP
+# latency while the sockets are open:
+#
+#   python benchmarks/connections.py --connections 15000 --workers 2
+#
+# The client side runs on gevent too, in this process, so raise
+# `ulimit -n` above --connections first.
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SECRET_KEY = 'connections-benchmark-secret-key'
+SOCKETIO_PATH = '/socket.io/?EIO=4&transport=websocket'
+
+
+def memory_kb(pid):
+    totals = {'Rss': 0, 'Pss': 0}
+    children = f'/proc/{pid}/task/{pid}/children'
+    pids = [pid] + [int(child) for child in open(children).read().split()] if os.path.exists(children) else [pid]
+    for process in pids:
+        with open(f'/proc/{process}/smaps_rollup') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in totals:
+                    totals[key] += int(value.split()[0])
+    return totals
+
+
+def start_server(args):
+    env = dict(
+        os.environ,
+        APP_CONFIG='config.Config',
+        SECRET_KEY=SECRET_KEY,
+        DATABASE_URL=args.database_url,
+        FEED_BACKEND='memory',
+        SOCKETIO_MESSAGE_QUEUE='',
+        JOB_WORKERS='1',
+        # Every probe comes from 127.0.0.1; per-client rate limits would 429 them
+        ADMISSION_ENABLED='0',
+        WEB_CONCURRENCY=str(args.workers),
+        GUNICORN_BIND=f'127.0.0.1:{args.port}',
+        GUNICORN_WORKER_CONNECTIONS=str(args.connections + 1000),
+    )
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py', 'wsgi:app'],
+                              cwd=SERVER_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{args.port}/metrics', timeout=1)
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise SystemExit("server did not start")
+
+
+class Connection:
+    def __init__(self, host, port, cookie):
+        self.host = host
+        self.port = port
+        self.cookie = cookie
+        self.ready = False
+        self.closed = False
+        self.sock = None
+
+    def run(self):
+        try:
+            sock = self.sock = socket.create_connection((self.host, self.port))
+            ws = WSConnection(ConnectionType.CLIENT)
+            sock.sendall(ws.send(Request(host=f'{self.host}:{self.port}', target=SOCKETIO_PATH,
+                                         extra_headers=[(b'cookie', self.cookie.encode())])))
+            while True:
+                data = sock.recv(65536)
+                if not data:
+                    break
+                ws.receive_data(data)
+                for event in ws.events():
+                    if isinstance(event, TextMessage):
+                        if event.data.startswith('0'):  # Engine.IO open
+                            sock.sendall(ws.send(Message(data='40/live,')))
+                        elif event.data == '2':  # Engine.IO ping
+                            sock.sendall(ws.send(Message(data='3')))
+                        elif event.data.startswith('42/live,["ready"'):
+                            self.ready = True
+                    elif isinstance(event, (CloseConnection, RejectConnection)):
+                        return
+        except OSError:
+            pass
+        finally:
+            self.closed = True
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+
+
+def http_latencies(port, cookie, requests):
+    latencies = []
+    for _ in range(requests):
+        request = urllib.request.Request(f'http://127.0.0.1:{port}/check_session', headers={'Cookie': cookie})
+        started = time.perf_counter()
+        urllib.request.urlopen(request, timeout=10).read()
+        latencies.append(time.perf_counter() - started)
+    ordered = sorted(latencies)
+    return ordered[len(ordered) // 2] * 1000, ordered[int(len(ordered) * 0.99)] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database-url', default='sqlite:////tmp/buzznexus_connections.db')
+    parser.add_argument('--connections', type=int, default=10000)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--hold', type=float, default=30, help="seconds to stay idle; past 25 exercises pings")
+    parser.add_argument('--concurrency', type=int, default=200, help="handshakes in flight at once")
+    parser.add_argument('--port', type=int, default=5099)
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard != resource.RLIM_INFINITY and soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    seeder.seed(seeder.parse_args([
+        '--database-url', args.database_url,
+        '--users', str(args.users),
+        '--posts-per-user', '1',
+        '--follows-per-user', '5',
+        '--notifications-per-user', '0',
+    ]))
+    app = make_app(args.database_url, SECRET_KEY=SECRET_KEY)
+    serializer = app.session_interface.get_signing_serializer(app)
+    cookie_name = app.config['SESSION_COOKIE_NAME']
+    cookies = [f"{cookie_name}={serializer.dumps({'user_id': user_id})}" for user_id in range(1, args.users + 1)]
+
+    server = start_server(args)
+    connections = []
+    try:
+        baseline = memory_kb(server.pid)
+        idle_p50, idle_p99 = http_latencies(args.port, cookies[0], 200)
+
+        connections = [Connection('127.0.0.1', args.port, cookies[i % len(cookies)]) for i in range(args.connections)]
+        pool = gevent.pool.Pool(args.concurrency)
+        started = time.perf_counter()
+        for connection in connections:
+            gevent.spawn(connection.run)
+            # Holds a pool slot until the namespace says ready, bounding handshakes in flight
+            pool.spawn(_wait_ready, connection)
+        pool.join()
+        connect_seconds = time.perf_counter() - started
+        connected = sum(c.ready for c in connections)
+
+        loaded = memory_kb(server.pid)
+        busy_p50, busy_p99 = http_latencies(args.port, cookies[0], 200)
+        gevent.sleep(args.hold)
+        alive = sum(c.ready and not c.closed for c in connections)
+
+        per_connection = (loaded['Pss'] - baseline['Pss']) / max(connected, 1)
+        print(f"\nworkers {args.workers}, gevent, {args.connections} connections requested")
+        print(f"connected               {connected:>8} in {connect_seconds:.1f}s "
+              f"({connected / connect_seconds:.0f}/s)")
+        print(f"still open after {args.hold:.0f}s    {alive:>8}")
+        print(f"server PSS              {baseline['Pss'] / 1024:>8.1f} MB idle, {loaded['Pss'] / 1024:.1f} MB loaded "
+              f"({per_connection:.1f} KB/connection)")
+        print(f"server RSS              {baseline['Rss'] / 1024:>8.1f} MB idle, {loaded['Rss'] / 1024:.1f} MB loaded")
+        print(f"GET /check_session      p50 {idle_p50:.2f} ms, p99 {idle_p99:.2f} ms with no sockets; "
+              f"p50 {busy_p50:.2f} ms, p99 {busy_p99:.2f} ms with {connected} open")
+    finally:
+        for connection in connections:
+            connection.close()
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=60)
+
+
+def _wait_ready(connection, timeout=30):
+    deadline = time.time() + timeout
+    while not connection.ready and not connection.closed and time.time() < deadline:
+        gevent.sleep(0.01)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from werkzeug.serving import make_server
+
+from common import make_app, login_as, StatementRecorder
+import seed as seeder
+from models import db
+
+# Endpoint benchmark and load test.
+#
+# For every scale point the database is re-seeded with seed.py and each
+# auth_bp endpoint is driven in-process through the Flask test client
+# (latency, throughput, SQL statements per request). With --concurrency the
+# read endpoints are then hit over real HTTP by concurrent clients against a
+# threaded server. Results are written as JSON; given --baseline the run
+# fails when p95 latency regresses past --tolerance or any endpoint issues
+# more statements per request than the baseline recorded.
+#
+#   python benchmarks/endpoints.py --scales 1000,100000 --output bench.json
+#   python benchmarks/endpoints.py --scales 1000 --baseline bench.json
+
+DEMO_USERNAME, DEMO_PASSWORD = seeder.DEMO_USERS[0][:2]
+
+
+def scenarios(users):
+    targets = list(range(2, min(users, 202)))
+    return [
+        ('check_session', [('GET', '/check_session', None)]),
+        ('profile', [('GET', '/profile', None)]),
+        ('update_profile', [('PUT', '/profile', {'bio': 'benchmarking'})]),
+        ('posts', [('GET', '/posts?limit=20', None)]),
+        ('feed', [('GET', '/feed?limit=20', None)]),
+        ('create_post', [('POST', '/posts', {'title': 'bench', 'content': 'load test #bench'})]),
+        ('notifications', [('GET', '/notifications?limit=20', None)]),
+        ('unread_count', [('GET', '/notifications/unread_count', None)]),
+        ('mark_read', [('POST', '/notifications/read', {'ids': [1, 2, 3]})]),
+        ('search', [('GET', '/search?q=coffee&limit=20', None)]),
+        ('autocomplete', [('GET', '/search/autocomplete?q=user1', None)]),
+        ('hashtag_posts', [('GET', '/hashtags/coffee/posts?limit=20', None)]),
+        # Follow then unfollow the same accounts so the graph is left as seeded
+        ('follow', [('POST', f'/follow/{target}', None) for target in targets]),
+        ('unfollow', [('DELETE', f'/unfollow/{target}', None) for target in targets]),
+        # The seeded hash is full-cost bcrypt, so keep the sample small
+        ('login', [('POST', '/login', {'username': DEMO_USERNAME, 'password': DEMO_PASSWORD})] * 20),
+        ('signup', [('POST', '/signup', {'username': f'bench{i}', 'password': 'bench-password'})
+                    for i in range(20)]),
+        ('logout', [('DELETE', '/logout', None)]),
+    ]
+
+
+HTTP_SCENARIOS = [
+    ('posts', 'GET', '/posts?limit=20'),
+    ('feed', 'GET', '/feed?limit=20'),
+    ('check_session', 'GET', '/check_session'),
+    ('notifications', 'GET', '/notifications?limit=20'),
+]
+
+
+def summarize(latencies, elapsed, statements=None):
+    ordered = sorted(latencies)
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] * 1000
+
+    result = {
+        'requests': len(ordered),
+        'throughput': len(ordered) / elapsed if elapsed else 0,
+        'p50_ms': pct(50),
+        'p95_ms': pct(95),
+        'p99_ms': pct(99),
+        'mean_ms': statistics.fmean(ordered) * 1000,
+    }
+    if statements is not None:
+        result['statements_per_request'] = statements / len(ordered)
+    return result
+
+
+def run_test_client(app, users, iterations):
+    results = {}
+    client = app.test_client()
+    for name, calls in scenarios(users):
+        login_as(client, 1)
+        calls = calls if len(calls) > 1 else calls * iterations
+        latencies, statements, statuses = [], 0, set()
+        started = time.perf_counter()
+        for method, path, body in calls:
+            if name == 'logout':
+                login_as(client, 1)
+            with StatementRecorder(db.engine) as recorder:
+                request_started = time.perf_counter()
+                response = client.open(path, method=method, json=body)
+                latencies.append(time.perf_counter() - request_started)
+            statements += len(recorder.statements)
+            statuses.add(response.status_code)
+        results[name] = summarize(latencies, time.perf_counter() - started, statements)
+        results[name]['statuses'] = sorted(statuses)
+    return results
+
+
+def run_http(app, concurrency, duration):
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+
+    sessions = []
+    for _ in range(concurrency):
+        http = requests.Session()
+        http.post(f'{base_url}/login', json={'username': DEMO_USERNAME, 'password': DEMO_PASSWORD})
+        sessions.append(http)
+
+    results = {}
+    try:
+        for name, method, path in HTTP_SCENARIOS:
+            deadline = time.perf_counter() + duration
+            per_client = [[] for _ in range(concurrency)]
+
+            def worker(index):
+                http = sessions[index]
+                while time.perf_counter() < deadline:
+                    started = time.perf_counter()
+                    http.request(method, base_url + path)
+                    per_client[index].append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                list(pool.map(worker, range(concurrency)))
+            latencies = [sample for samples in per_client for sample in samples]
+            results[name] = summarize(latencies, time.perf_counter() - started)
+    finally:
+        server.shutdown()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for scale, modes in results.items():
+        for mode, endpoints in modes.items():
+            for name, current in endpoints.items():
+                previous = baseline.get(scale, {}).get(mode, {}).get(name)
+                if not previous:
+                    continue
+                if current['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+                    regressions.append(f"{scale}/{mode}/{name}: p95 {previous['p95_ms']:.2f}ms -> {current['p95_ms']:.2f}ms")
+                # Averages wobble with cache hits, so only a whole extra statement counts
+                if current.get('statements_per_request', 0) > previous.get('statements_per_request', float('inf')) + 0.5:
+                    regressions.append(f"{scale}/{mode}/{name}: statements/request "
+                                       f"{previous['statements_per_request']:.1f} -> {current['statements_per_request']:.1f}")
+    return regressions
+
+
+def print_table(scale, mode, endpoints):
+    print(f"\n== {scale} users, {mode} ==")
+    print(f"{'endpoint':16} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'sql/req':>8}")
+    for name, r in endpoints.items():
+        sql = f"{r['statements_per_request']:.1f}" if 'statements_per_request' in r else '-'
+        print(f"{name:16} {r['throughput']:>9.1f} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f} {sql:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database-url', default='sqlite:////tmp/buzznexus_bench.db')
+    parser.add_argument('--scales', default='1000,10000', help="comma-separated user counts")
+    parser.add_argument('--posts-per-user', type=float, default=10)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=0, help="HTTP clients; 0 skips the HTTP load test")
+    parser.add_argument('--duration', type=float, default=5, help="seconds per HTTP scenario")
+    parser.add_argument('--output', default='bench_output.json')
+    parser.add_argument('--baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    results = {}
+    for users in [int(scale) for scale in args.scales.split(',')]:
+        seeder.seed(seeder.parse_args([
+            '--database-url', args.database_url,
+            '--users', str(users),
+            '--posts-per-user', str(args.posts_per_user),
+        ]))
+        app = make_app(args.database_url)
+        with app.app_context():
+            results[str(users)] = {'test_client': run_test_client(app, users, args.iterations)}
+            if args.concurrency:
+                results[str(users)]['http'] = run_http(app, args.concurrency, args.duration)
+            db.engine.dispose()
+        for mode, endpoints in results[str(users)].items():
+            print_table(users, mode, endpoints)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print(f"\nResults written to {os.path.abspath(args.output)}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
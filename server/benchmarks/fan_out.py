@@ -0,0 +1,76 @@
+import argparse
+import time
+
+from sqlalchemy import func, insert, select
+
+from common import make_app, login_as
+from jobs import RUNNABLE
+from models import db, User, Friendship, Job
+from partitions import notification_tables
+
+# POST /posts latency against the author's follower count.
+#
+# Gives user 1 --followers followers, then creates --posts posts twice: with
+# JOB_WORKERS = 0, where the fan-out job (timelines, live pushes, one
+# notification per follower) runs in the request right after its commit,
+# which is what doing it inline would cost; and with --workers background
+# threads, where the request only queues the job. The second run also
+# reports how long the queue took to deliver every notification.
+#
+#   python benchmarks/fan_out.py --followers 10000
+#   python benchmarks/fan_out.py --database-url postgresql://localhost/connectsphere_bench --workers 4
+
+
+def seed(followers):
+    db.drop_all()
+    db.create_all()
+    db.session.execute(insert(User.__table__), [{'username': f'user{i}', '_password_hash': 'x'}
+                                                for i in range(1, followers + 2)])
+    db.session.execute(insert(Friendship.__table__), [{'follower_id': i, 'followed_id': 1}
+                                                      for i in range(2, followers + 2)])
+    db.session.commit()
+
+
+def create_posts(client, count):
+    latencies = []
+    for i in range(count):
+        started = time.perf_counter()
+        response = client.post('/posts', json={'title': f'post {i}', 'content': 'fan-out benchmark'})
+        latencies.append(time.perf_counter() - started)
+        assert response.status_code == 201, response.status_code
+    ordered = sorted(latencies)
+    return ordered[len(ordered) // 2] * 1000, ordered[int(len(ordered) * 0.95)] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database-url', default='sqlite:////tmp/buzznexus_fan_out.db')
+    parser.add_argument('--followers', type=int, default=10000)
+    parser.add_argument('--posts', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=2)
+    args = parser.parse_args()
+
+    print(f"\n{'mode':18} {'followers':>9} {'p50 ms':>9} {'p95 ms':>9} {'delivered in':>13}")
+    for mode, workers in (('inline', 0), ('queued', args.workers)):
+        app = make_app(args.database_url, JOB_WORKERS=workers, JOB_POLL_INTERVAL=0.1,
+                       FEED_CELEBRITY_THRESHOLD=args.followers + 1)
+        with app.app_context():
+            seed(args.followers)
+        client = app.test_client()
+        login_as(client, 1)
+
+        started = time.perf_counter()
+        p50, p95 = create_posts(client, args.posts)
+        with app.app_context():
+            while db.session.query(Job).filter(RUNNABLE).count():
+                db.session.rollback()
+                time.sleep(0.05)
+            delivered = sum(db.session.execute(select(func.count()).select_from(table)).scalar()
+                            for table in notification_tables(db.session.connection()))
+            db.engine.dispose()
+        assert delivered == args.posts * args.followers, delivered
+        print(f"{mode:18} {args.followers:>9} {p50:>9.2f} {p95:>9.2f} {time.perf_counter() - started:>12.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+import argparse
+import os
+import random
+import statistics
+import time
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import aliased
+
+import common  # noqa: F401
+import seed as seeder
+from follow_graph import FollowGraph
+from models import Friendship
+
+# Follow graph vs SQL for relationship and suggestion queries.
+#
+# Seeds a database with seed.py, builds the CSR graph from it, times a
+# snapshot save and mmap reload, then runs the same lookups against the
+# graph and as friendship self-joins:
+#
+#   python benchmarks/follow_graph.py --users 100000 --follows-per-user 50
+
+
+def friend_of_friend_sql(connection, user_id, limit):
+    first, second = aliased(Friendship), aliased(Friendship)
+    already = select(Friendship.followed_id).where(Friendship.follower_id == user_id)
+    return connection.execute(
+        select(second.followed_id, func.count().label('mutual'))
+        .join(first, first.followed_id == second.follower_id)
+        .where(first.follower_id == user_id, second.followed_id != user_id, second.followed_id.not_in(already))
+        .group_by(second.followed_id).order_by(func.count().desc(), second.followed_id).limit(limit)
+    ).all()
+
+
+def mutuals_sql(connection, user_id):
+    back = aliased(Friendship)
+    return connection.execute(
+        select(Friendship.followed_id)
+        .join(back, (back.follower_id == Friendship.followed_id) & (back.followed_id == Friendship.follower_id))
+        .where(Friendship.follower_id == user_id)
+    ).all()
+
+
+def relationship_sql(connection, user_id, other_id):
+    return connection.execute(
+        select(Friendship.follower_id).where(
+            ((Friendship.follower_id == user_id) & (Friendship.followed_id == other_id))
+            | ((Friendship.follower_id == other_id) & (Friendship.followed_id == user_id))
+        )
+    ).all()
+
+
+def timed(label, calls):
+    latencies = []
+    for call in calls:
+        started = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - started)
+    ordered = sorted(latencies)
+    p95 = ordered[int(len(ordered) * 0.95)] * 1e6
+    print(f"{label:28} mean {statistics.fmean(ordered) * 1e6:10.1f}us   p95 {p95:10.1f}us")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database-url', default='sqlite:////tmp/buzznexus_graph.db')
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--follows-per-user', type=float, default=20)
+    parser.add_argument('--samples', type=int, default=200)
+    parser.add_argument('--snapshot', default='/tmp/buzznexus_graph.snapshot')
+    parser.add_argument('--skip-seed', action='store_true')
+    args = parser.parse_args()
+
+    if not args.skip_seed:
+        seeder.seed(seeder.parse_args([
+            '--database-url', args.database_url,
+            '--users', str(args.users),
+            '--posts-per-user', '0',
+            '--notifications-per-user', '0',
+            '--follows-per-user', str(args.follows_per_user),
+        ]))
+    engine = create_engine(args.database_url)
+
+    started = time.perf_counter()
+    with engine.connect() as connection:
+        graph = FollowGraph.from_database(connection)
+    print(f"\nbuilt graph: {graph.edge_count} edges in {time.perf_counter() - started:.2f}s")
+    started = time.perf_counter()
+    graph.save(args.snapshot)
+    print(f"snapshot: {os.path.getsize(args.snapshot) / 1e6:.1f}MB written in {time.perf_counter() - started:.2f}s")
+    started = time.perf_counter()
+    graph = FollowGraph.load(args.snapshot)
+    print(f"mmap reload: {(time.perf_counter() - started) * 1000:.2f}ms\n")
+
+    rng = random.Random(7)
+    users = [rng.randint(1, args.users) for _ in range(args.samples)]
+    pairs = [(user_id, rng.randint(1, args.users)) for user_id in users]
+    timed('graph relationship', [lambda a=a, b=b: graph.relationship(a, b) for a, b in pairs])
+    timed('graph mutuals', [lambda u=u: graph.mutuals(u) for u in users])
+    timed('graph suggestions', [lambda u=u: graph.suggestions(u, 10) for u in users])
+    with engine.connect() as connection:
+        timed('sql relationship', [lambda a=a, b=b: relationship_sql(connection, a, b) for a, b in pairs])
+        timed('sql mutuals', [lambda u=u: mutuals_sql(connection, u) for u in users])
+        timed('sql friend-of-friend', [lambda u=u: friend_of_friend_sql(connection, u, 10) for u in users])
+
+
+if __name__ == '__main__':
+    main()
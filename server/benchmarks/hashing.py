@@ -0,0 +1,97 @@
+import argparse
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from common import make_app, login_as
+from hashing import _hash_password
+from models import db, User
+
+# Login-storm benchmark for the password hashing pool.
+#
+# Request threads POST correct passwords to /login (bcrypt at --rounds)
+# while a logged-in client keeps requesting GET /check_session, a cheap
+# route that never touches bcrypt. Reports login throughput, how many
+# logins got 503, and the cheap route's latency percentiles, for the
+# inline path and for pools of increasing size:
+#
+#   python benchmarks/hashing.py --requests 64 --rounds 12
+
+USERNAME = 'storm'
+PASSWORD = 'benchmark-password'
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] if ordered else 0.0
+
+
+def cheap_endpoint(app, stop, samples, errors):
+    client = app.test_client()
+    login_as(client, 1)
+    while not stop.is_set():
+        start = time.perf_counter()
+        response = client.get('/check_session')
+        samples.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            errors[response.status_code] += 1
+        time.sleep(0.001)
+
+
+def login(app):
+    return app.test_client().post('/login', json={"username": USERNAME, "password": PASSWORD}).status_code
+
+
+def run(app, requests, threads):
+    stop = threading.Event()
+    samples, errors = [], Counter()
+    probe = threading.Thread(target=cheap_endpoint, args=(app, stop, samples, errors))
+    probe.start()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        statuses = Counter(pool.map(lambda _: login(app), range(requests)))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    probe.join()
+    return statuses, elapsed, samples, errors
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database-url', default='sqlite:////tmp/buzznexus_hashing.db')
+    parser.add_argument('--requests', type=int, default=64)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--rounds', type=int, default=12)
+    args = parser.parse_args()
+
+    app = make_app(args.database_url)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.add(User(id=1, username=USERNAME, _password_hash=_hash_password(PASSWORD, args.rounds)))
+        db.session.commit()
+        db.engine.dispose()
+    worker_counts = [0] + sorted({1, 2, os.cpu_count() or 1})
+
+    print(f"{'workers':>8} {'logins/s':>10} {'503':>6} {'cheap p50 ms':>13} {'cheap p99 ms':>13} "
+          f"{'cheap errors':>13}")
+    for workers in worker_counts:
+        app = make_app(args.database_url, BCRYPT_LOG_ROUNDS=args.rounds, PASSWORD_HASH_WORKERS=workers,
+                       PASSWORD_HASH_QUEUE_SIZE=args.requests)
+        # Start the hashing pool before timing
+        login(app)
+        statuses, elapsed, samples, errors = run(app, args.requests, args.threads)
+        with app.app_context():
+            app.extensions['password_hasher'].shutdown()
+            db.engine.dispose()
+        print(f"{workers:>8} {statuses[200] / elapsed:>10.1f} {statuses[503]:>6} "
+              f"{percentile(samples, 50) * 1000:>13.3f} {percentile(samples, 99) * 1000:>13.3f} "
+              f"{sum(errors.values()):>13}")
+
+
+if __name__ == '__main__':
+    main()
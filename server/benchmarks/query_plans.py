@@ -0,0 +1,202 @@
+import argparse
+import json
+import math
+import random
+import sys
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from common import make_app, login_as, StatementRecorder
+from models import db, User, Post, Friendship, Like, TrendingPost
+from likes import like_weight
+from partitions import PARTITION_NAME, insert_notifications
+from search import index_hashtags
+
+# Query-plan regression check for the hot endpoints.
+#
+# Seeds a database, drives each endpoint through the test client, captures
+# every SELECT/UPDATE/DELETE it issues and EXPLAINs it. Any sequential scan of
+# an application table fails the run (exit status 1):
+#
+#   python benchmarks/query_plans.py --database-url sqlite:////tmp/plans.db
+#   python benchmarks/query_plans.py --database-url postgresql://localhost/plans --users 200000
+
+TAGS = ('coffee', 'code', 'travel', 'music', 'photo')
+HOT_TABLES = {'user', 'post', 'friendship', 'notification', 'hashtag', 'post_hashtag', 'job',
+              'like', 'post_like_shard', 'trending_post'}
+
+
+# Notification partitions count as the notification table
+def is_hot(table_name):
+    return table_name in HOT_TABLES or PARTITION_NAME.fullmatch(table_name) is not None
+
+SCENARIOS = [
+    ('check_session', 'GET', '/check_session', None),
+    ('posts', 'GET', '/posts?limit=20', None),
+    ('posts_next_page', 'GET', '/posts?limit=20&cursor={posts_cursor}', None),
+    ('feed', 'GET', '/feed?limit=20', None),
+    ('create_post', 'POST', '/posts', {'title': 'plan', 'content': 'check'}),
+    ('follow', 'POST', '/follow/{target_id}', None),
+    ('unfollow', 'DELETE', '/unfollow/{target_id}', None),
+    ('notifications', 'GET', '/notifications?limit=20', None),
+    ('notifications_all', 'GET', '/notifications?limit=20&status=all', None),
+    ('notifications_next_page', 'GET', '/notifications?limit=5&status=all&cursor={notifications_cursor}', None),
+    ('unread_count', 'GET', '/notifications/unread_count', None),
+    ('mark_read_ids', 'POST', '/notifications/read', {'ids': [1, 2, 3]}),
+    ('mark_read_up_to', 'POST', '/notifications/read', {'up_to_id': 50}),
+    ('search_posts', 'GET', '/search?q=coffee&type=posts', None),
+    ('search_users', 'GET', '/search?q=user1&type=users', None),
+    ('autocomplete', 'GET', '/search/autocomplete?q=use', None),
+    ('autocomplete_tags', 'GET', '/search/autocomplete?q=cof&type=hashtags', None),
+    ('hashtag_posts', 'GET', '/hashtags/coffee/posts?limit=20', None),
+    ('trending', 'GET', '/posts/trending?limit=20', None),
+    ('like', 'POST', '/like/{target_post_id}', None),
+    ('unlike', 'DELETE', '/like/{target_post_id}', None),
+]
+
+
+def seed(users, posts_per_user, follows_per_user, notifications_per_user, likes_per_user, chunk=5000):
+    rng = random.Random(42)
+    now = datetime.utcnow()
+
+    def chunks(rows):
+        for start in range(0, len(rows), chunk):
+            yield rows[start:start + chunk]
+
+    user_rows = [{'username': f'user{i}', '_password_hash': 'x', 'image_url': None, 'bio': ''}
+                 for i in range(1, users + 1)]
+    for rows in chunks(user_rows):
+        db.session.execute(insert(User.__table__), rows)
+
+    post_rows = [{'title': 't', 'content': f'c #{rng.choice(TAGS)}', 'user_id': rng.randint(1, users),
+                  'created_at': now - timedelta(seconds=i)}
+                 for i in range(users * posts_per_user)]
+    for rows in chunks(post_rows):
+        db.session.execute(insert(Post.__table__), rows)
+    connection = db.session.connection()
+    for start in range(0, len(post_rows), chunk):
+        index_hashtags(connection, [(start + i + 1, row['content']) for i, row in enumerate(post_rows[start:start + chunk])])
+
+    pairs = {(rng.randint(1, users), rng.randint(1, users)) for _ in range(users * follows_per_user)}
+    follow_rows = [{'follower_id': a, 'followed_id': b, 'created_at': now} for a, b in pairs if a != b]
+    for rows in chunks(follow_rows):
+        db.session.execute(insert(Friendship.__table__), rows)
+
+    notification_rows = [{'user_id': rng.randint(1, users), 'message': 'm', 'read': rng.random() < 0.8,
+                          'created_at': now - timedelta(minutes=i)}
+                         for i in range(users * notifications_per_user)]
+    for rows in chunks(notification_rows):
+        insert_notifications(connection, rows)
+
+    # Likes land on the newest posts; the ones from the last day are scored
+    likes = {(rng.randint(1, users), min(int(rng.expovariate(1 / 1000)) + 1, len(post_rows)))
+             for _ in range(users * likes_per_user)}
+    for rows in chunks([{'user_id': u, 'post_id': p, 'created_at': now} for u, p in likes]):
+        db.session.execute(insert(Like.__table__), rows)
+    liked = {}
+    for _, post_id in likes:
+        liked[post_id] = liked.get(post_id, 0) + 1
+    trending_rows = [{'post_id': post_id, 'score': like_weight(now) + math.log2(count),
+                      'created_at': post_rows[post_id - 1]['created_at']}
+                     for post_id, count in liked.items()
+                     if post_rows[post_id - 1]['created_at'] > now - timedelta(days=1)]
+    for rows in chunks(trending_rows):
+        db.session.execute(insert(TrendingPost.__table__), rows)
+
+    db.session.commit()
+
+
+def explain(connection, statement, parameters):
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+        details = [row[-1] for row in rows]
+        scans = [d for d in details
+                 if d.startswith('SCAN ') and 'USING' not in d
+                 and is_hot(d.split()[1].strip('"'))]
+        return details, scans
+    if dialect == 'postgresql':
+        plan = connection.exec_driver_sql('EXPLAIN (FORMAT JSON) ' + statement, parameters).scalar()
+        plan = plan if isinstance(plan, list) else json.loads(plan)
+        nodes, scans = [plan[0]['Plan']], []
+        details = []
+        while nodes:
+            node = nodes.pop()
+            details.append(f"{node['Node Type']} {node.get('Relation Name', '')} {node.get('Index Name', '')}".strip())
+            if node['Node Type'] == 'Seq Scan' and is_hot(node.get('Relation Name', '')):
+                scans.append(details[-1])
+            nodes.extend(node.get('Plans', []))
+        return details, scans
+    raise SystemExit(f"Unsupported dialect: {dialect}")
+
+
+# Values for the {placeholders} in SCENARIOS: cursors come from the logged-in
+# client's first pages, the follow/like targets from the seeded data
+def scenario_placeholders(client, users):
+    return {
+        'posts_cursor': client.get('/posts?limit=20').get_json()['next_cursor'],
+        'notifications_cursor': client.get('/notifications?limit=5&status=all').get_json()['next_cursor'],
+        'target_id': users,
+        'target_post_id': 2,
+    }
+
+
+# Drives one request and EXPLAINs every SELECT/UPDATE/DELETE it issued.
+# Returns the response and (statement, plan details, hot-table scans) per
+# statement
+def run_scenario(client, method, url, body):
+    with StatementRecorder(db.engine) as recorder:
+        response = client.open(url, method=method, json=body)
+
+    plans = []
+    with db.engine.connect() as connection:
+        for statement, parameters in recorder.statements:
+            if not statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+                continue
+            details, scans = explain(connection, statement, parameters)
+            plans.append((statement, details, scans))
+    return response, plans
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database-url', default='sqlite:////tmp/buzznexus_plans.db')
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--posts-per-user', type=int, default=10)
+    parser.add_argument('--follows-per-user', type=int, default=20)
+    parser.add_argument('--notifications-per-user', type=int, default=10)
+    parser.add_argument('--likes-per-user', type=int, default=5)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    app = make_app(args.database_url)
+    failures = 0
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed(args.users, args.posts_per_user, args.follows_per_user, args.notifications_per_user,
+             args.likes_per_user)
+        if db.engine.dialect.name == 'postgresql':
+            db.session.execute(db.text('ANALYZE'))
+            db.session.commit()
+
+        client = app.test_client()
+        login_as(client, 1)
+        placeholders = scenario_placeholders(client, args.users)
+
+        for name, method, path, body in SCENARIOS:
+            response, plans = run_scenario(client, method, path.format(**placeholders), body)
+            for statement, details, scans in plans:
+                status = 'FAIL' if scans else 'ok'
+                failures += bool(scans)
+                print(f"{status:4} {name:18} {response.status_code} {' '.join(statement.split())[:90]}")
+                for line in (details if args.verbose or scans else []):
+                    print(f"       {line}")
+
+    print(f"\n{failures} statement(s) with sequential scans")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+import argparse
+import time
+import uuid
+
+from common import make_app, login_as, StatementRecorder
+import seed as seeder
+from identity import get_identity_cache, get_user_snapshot
+from models import db
+from token_auth import get_denylist, issue_tokens
+
+# Session cookie vs bearer token authentication.
+#
+# Seeds a database with seed.py and drives a few authenticated read
+# endpoints through the Flask test client as the same user, four ways: the
+# signed session cookie with the identity cache warm, the same with the
+# cache emptied before every request (a miss, as after a TTL expiry or on a
+# fresh worker), an access token, and an access token with --revoked other
+# tokens on the denylist so the bloom filter is doing real work.
+#
+#   python benchmarks/token_auth.py --users 10000 --iterations 2000
+
+ENDPOINTS = ['/check_session', '/relationship/2', '/notifications/unread_count']
+
+
+def run(engine, client, path, iterations, headers=None, before=None):
+    latencies, statements = [], 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        if before:
+            before()
+        with StatementRecorder(engine) as recorder:
+            request_started = time.perf_counter()
+            response = client.get(path, headers=headers)
+            latencies.append(time.perf_counter() - request_started)
+        assert response.status_code == 200, (path, response.status_code)
+        statements += len(recorder.statements)
+    elapsed = time.perf_counter() - started
+    ordered = sorted(latencies)
+    return {
+        'throughput': iterations / elapsed,
+        'p50_ms': ordered[len(ordered) // 2] * 1000,
+        'p95_ms': ordered[int(len(ordered) * 0.95)] * 1000,
+        'statements_per_request': statements / iterations,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database-url', default='sqlite:////tmp/buzznexus_token.db')
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--iterations', type=int, default=1000)
+    parser.add_argument('--revoked', type=int, default=100000, help="denylist size for the last mode")
+    parser.add_argument('--skip-seed', action='store_true')
+    args = parser.parse_args()
+
+    if not args.skip_seed:
+        seeder.seed(seeder.parse_args([
+            '--database-url', args.database_url,
+            '--users', str(args.users),
+            '--posts-per-user', '1',
+        ]))
+    app = make_app(args.database_url, TOKEN_AUTH_ENABLED=True, TOKEN_DENYLIST_BACKEND='memory',
+                   JWT_SECRET_KEY='benchmark-jwt-secret-key-32-bytes')
+
+    # Requests run outside this context, so each gets its own flask.g
+    with app.app_context():
+        engine = db.engine
+        tokens = issue_tokens(get_user_snapshot(1))
+        cache = get_identity_cache()
+        denylist = get_denylist()
+    cookie_client = app.test_client()
+    login_as(cookie_client, 1)
+    token_client = app.test_client()
+    bearer = {'Authorization': f"Bearer {tokens['access_token']}"}
+
+    def fill_denylist():
+        expires_at = time.time() + 3600
+        for _ in range(args.revoked):
+            denylist.revoke(uuid.uuid4().hex, expires_at)
+
+    modes = [
+        ('session', lambda path: run(engine, cookie_client, path, args.iterations)),
+        ('session, cold cache', lambda path: run(engine, cookie_client, path, args.iterations, before=cache.clear)),
+        ('token', lambda path: run(engine, token_client, path, args.iterations, headers=bearer)),
+        (f'token, {args.revoked} revoked', lambda path: run(engine, token_client, path, args.iterations, headers=bearer)),
+    ]
+
+    print(f"\n{'endpoint':28} {'mode':28} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'sql/req':>8}")
+    for name, measure in modes:
+        if 'revoked' in name:
+            fill_denylist()
+        lookups_before = denylist.lookups
+        for path in ENDPOINTS:
+            measure(path)  # warm up
+            r = measure(path)
+            print(f"{path:28} {name:28} {r['throughput']:>9.1f} {r['p50_ms']:>8.3f} {r['p95_ms']:>8.3f} "
+                  f"{r['statements_per_request']:>8.1f}")
+        if name.startswith('token'):
+            print(f"{'':28} denylist lookups past the bloom filter: {denylist.lookups - lookups_before}")
+    engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+import hashlib
+from datetime import timezone
+
+from flask import Response, request
+from sqlalchemy import func, select
+
+from models import db, User, Post
+
+# Conditional GET for the polled read endpoints.
+#
+# Each endpoint derives a validator from something far cheaper than its
+# response: the newest post id and timestamp (two index lookups), the
+# cached identity snapshot (no query), or the per-user notification version
+# counter (one primary-key read). When the client's If-None-Match or
+# If-Modified-Since still matches, a bodyless 304 goes back before any rows
+# are loaded or serialized.
+#
+# Per-user responses are marked `private, no-cache`. Public data is marked
+# `public, no-cache`, so a shared cache may keep it but has to revalidate
+# each use with the client's own credentials, which still get checked.
+
+
+def make_etag(*parts):
+    # The query string is part of the representation (limit, cursor, status)
+    key = repr(parts + (request.query_string,)).encode()
+    return hashlib.blake2b(key, digest_size=12).hexdigest()
+
+
+def _cache_headers(response, etag, last_modified, public):
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified.replace(tzinfo=timezone.utc)
+    response.cache_control.no_cache = True
+    if public:
+        response.cache_control.public = True
+    else:
+        response.cache_control.private = True
+        response.vary.add('Cookie')
+        response.vary.add('Authorization')
+    return response
+
+
+# A 304 response when the client's copy is current, else None
+def not_modified(etag, last_modified=None, public=False):
+    if request.if_none_match:
+        # If-None-Match wins over If-Modified-Since when both are sent
+        fresh = request.if_none_match.contains_weak(etag)
+    elif last_modified is not None and request.if_modified_since is not None:
+        fresh = last_modified.replace(microsecond=0, tzinfo=timezone.utc) <= request.if_modified_since
+    else:
+        fresh = False
+    if not fresh:
+        return None
+    return _cache_headers(Response(status=304), etag, last_modified, public)
+
+
+def with_validators(response, etag, last_modified=None, public=False):
+    return _cache_headers(response, etag, last_modified, public)
+
+
+# Newest post id and timestamp; posts are never edited, so these move
+# exactly when the global listing changes
+def posts_version():
+    return db.session.execute(select(
+        select(func.max(Post.id)).scalar_subquery(),
+        # A separate subquery so each max() is answered from its own index
+        select(func.max(Post.created_at)).scalar_subquery()
+    )).one()
+
+
+def notifications_version(user_id):
+    return db.session.query(User.notifications_version).filter(User.id == user_id).scalar()
@@ -1,14 +1,121 @@
 import os
+import tempfile
+from datetime import timedelta
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY', 'your_secret_key_here')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'postgresql://localhost/connectsphere')
+    DATABASE_POOL = {
+        'pool_size': int(os.environ.get('DATABASE_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DATABASE_MAX_OVERFLOW', 20)),
+        'pool_recycle': 1800,
+        'pool_timeout': 10,
+    }
+    # Comma-separated; each becomes a replica_<n> bind
+    DATABASE_REPLICA_URLS = [url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url]
+    DATABASE_REPLICA_POOL = {
+        'pool_size': int(os.environ.get('DATABASE_REPLICA_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DATABASE_REPLICA_MAX_OVERFLOW', 20)),
+        'pool_recycle': 1800,
+        'pool_timeout': 5,
+    }
+    REPLICA_MAX_LAG = 5
+    REPLICA_CHECK_INTERVAL = 5
+    READ_YOUR_WRITES_WINDOW = 5
     BCRYPT_LOG_ROUNDS = 12
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+    PASSWORD_HASH_QUEUE_SIZE = int(os.environ.get('PASSWORD_HASH_QUEUE_SIZE', 64))
+    PASSWORD_HASH_TIMEOUT = 10
+    IDENTITY_CACHE_SIZE = 10000
+    IDENTITY_CACHE_TTL = 60
+    METRICS_ENABLED = True
+    N_PLUS_ONE_THRESHOLD = 10
     SESSION_COOKIE_NAME = 'connectsphere_session'
     SESSION_PERMANENT = False
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'your_jwt_secret_key_here')
+    JWT_ACCESS_TOKEN_EXPIRES = timedelta(minutes=15)
+    JWT_REFRESH_TOKEN_EXPIRES = timedelta(days=30)
+    TOKEN_AUTH_ENABLED = os.environ.get('TOKEN_AUTH_ENABLED', '0') == '1'
+    TOKEN_DENYLIST_BACKEND = os.environ.get('TOKEN_DENYLIST_BACKEND', 'redis')
+    TOKEN_DENYLIST_REDIS_URL = os.environ.get('TOKEN_DENYLIST_REDIS_URL', 'redis://localhost:6379/2')
+    TOKEN_DENYLIST_SYNC_INTERVAL = 1
+    TOKEN_DENYLIST_REBUILD_INTERVAL = 300
+    TOKEN_DENYLIST_BLOOM_ERROR_RATE = 0.01
+    TOKEN_CLAIMS_CACHE_SIZE = 10000
     SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE', 'redis://localhost:6379/0')
+    SOCKETIO_CORS_ALLOWED_ORIGINS = os.environ.get('SOCKETIO_CORS_ALLOWED_ORIGINS', 'http://localhost:3000')
+    SOCKETIO_ASYNC_MODE = os.environ.get('SOCKETIO_ASYNC_MODE')
+    SOCKETIO_TRANSPORTS = os.environ.get('SOCKETIO_TRANSPORTS', 'polling,websocket').split(',')
+    REALTIME_FLUSH_INTERVAL = 0.05
+    FEED_BACKEND = os.environ.get('FEED_BACKEND', 'redis')
+    FEED_REDIS_URL = os.environ.get('FEED_REDIS_URL', 'redis://localhost:6379/1')
+    FEED_MAX_LENGTH = 800
+    FEED_CELEBRITY_THRESHOLD = int(os.environ.get('FEED_CELEBRITY_THRESHOLD', 10000))
+    COUNTER_SHARD_THRESHOLD = 10000
+    BATCH_MAX_ITEMS = 1000
+    BULK_NOTIFY_CHUNK_SIZE = 1000
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+    JOB_BATCH_SIZE = 10
+    JOB_POLL_INTERVAL = 1
+    JOB_VISIBILITY_TIMEOUT = 300
+    JOB_MAX_ATTEMPTS = 5
+    JOB_RETRY_BACKOFF = 10
+    JOB_RETENTION = 86400
+    COUNTER_SHARDS = 16
+    LIKE_SHARD_THRESHOLD = 1000
+    TRENDING_WINDOW = 86400
+    # Changing it rescales every like already scored; rebuild trending_post after
+    TRENDING_HALF_LIFE = 21600
+    TRENDING_REFRESH_INTERVAL = 60
+    NOTIFICATION_RETENTION_DAYS = 365
+    NOTIFICATION_READ_RETENTION_DAYS = 90
+    NOTIFICATION_RETENTION_INTERVAL = 3600
+    NOTIFICATION_PURGE_BATCH_SIZE = 1000
+    MEDIA_BACKEND = os.environ.get('MEDIA_BACKEND', 'local')
+    MEDIA_ROOT = os.environ.get('MEDIA_ROOT', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'media'))
+    MEDIA_S3_BUCKET = os.environ.get('MEDIA_S3_BUCKET')
+    MEDIA_PUBLIC_URL = os.environ.get('MEDIA_PUBLIC_URL')
+    MEDIA_MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+    MEDIA_THUMBNAIL_SIZES = (64, 256)
+    MEDIA_WORKERS = int(os.environ.get('MEDIA_WORKERS', os.cpu_count() or 1))
+    MEDIA_QUEUE_SIZE = 16
+    MEDIA_TIMEOUT = 30
+    # Proxies in front of the app whose X-Forwarded-* headers are trusted.
+    # Off unless set: with no proxy in front, trusting the header would let
+    # clients pick their own address (the Procfile sets 1 for Heroku's router)
+    TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', 0))
+    ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', '1') == '1'
+    RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+    RATE_LIMIT_REDIS_URL = os.environ.get('RATE_LIMIT_REDIS_URL', 'redis://localhost:6379/3')
+    RATE_LIMIT_MAX_KEYS = 100000
+    # (tokens per second, burst) per user or client address, by endpoint class
+    RATE_LIMITS = {
+        'auth': (0.2, 10),
+        'upload': (0.1, 5),
+        'export': (0.05, 3),
+        'search': (2, 20),
+        'write': (5, 50),
+        'read': (20, 100),
+    }
+    # Failed logins at /login and /token per username and address
+    RATE_LIMIT_LOGIN = (0.05, 5)
+    ADMISSION_INITIAL_LIMIT = 20
+    ADMISSION_MIN_LIMIT = 2
+    ADMISSION_MAX_LIMIT = 200
+    ADMISSION_QUEUE_SIZE = 50
+    ADMISSION_QUEUE_TIMEOUT = 0.5
+    ADMISSION_TOLERANCE = 2.0
+    ADMISSION_SAMPLE_SIZE = 20
+    # Overrides of the settings above for one endpoint class
+    ADMISSION_CLASS_SETTINGS = {
+        'export': {'initial_limit': 4, 'max_limit': 16},
+        'upload': {'initial_limit': 4, 'max_limit': 32},
+    }
+    FOLLOW_GRAPH_SNAPSHOT = os.environ.get('FOLLOW_GRAPH_SNAPSHOT')
+    FOLLOW_GRAPH_REFRESH_INTERVAL = 30
+    FOLLOW_GRAPH_DELETION_RETENTION = 7 * 86400
+    FOLLOW_GRAPH_PRUNE_INTERVAL = 3600
 
 class DevelopmentConfig(Config):
     DEBUG = True
@@ -20,4 +127,18 @@ class ProductionConfig(Config):
 
 class TestingConfig(Config):
     TESTING = True
+    BCRYPT_LOG_ROUNDS = 4
+    PASSWORD_HASH_WORKERS = 0
+    FEED_BACKEND = 'memory'
+    TOKEN_DENYLIST_BACKEND = 'memory'
+    DATABASE_REPLICA_URLS = []
+    REPLICA_CHECK_INTERVAL = 0
+    FOLLOW_GRAPH_REFRESH_INTERVAL = 0
+    SOCKETIO_MESSAGE_QUEUE = None
+    SOCKETIO_ASYNC_MODE = 'threading'
+    REALTIME_FLUSH_INTERVAL = 0
+    JOB_WORKERS = 0
+    MEDIA_WORKERS = 0
+    ADMISSION_ENABLED = False
+    MEDIA_ROOT = os.path.join(tempfile.gettempdir(), 'connectsphere_test_media')
     SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL', 'postgresql://localhost/test_connectsphere')
@@ -0,0 +1,85 @@
+import random
+from collections import defaultdict
+
+from flask import current_app
+from sqlalchemy import bindparam, func, select, update
+
+from dbutil import insert_or_increment
+from models import db, User, UserCounterShard
+
+# Profile stats counters (followers, following, posts) maintained on write.
+#
+# Routes adjust the counters in the same transaction as the row they count,
+# so /profile and /check_session read them straight off the user row (or
+# the cached identity snapshot). Accounts with at least
+# COUNTER_SHARD_THRESHOLD followers are "hot": their follower_count
+# increments go to one of COUNTER_SHARDS UserCounterShard rows picked at
+# random instead of the single user row, so concurrent follows don't queue
+# on one row lock. Reads of a hot account add up the shards, and
+# repair_counters.py folds them back into the user row.
+
+COUNTERS = ('follower_count', 'following_count', 'post_count')
+
+
+def is_hot(follower_count):
+    return follower_count >= current_app.config.get('COUNTER_SHARD_THRESHOLD', 10000)
+
+
+# deltas: {(user_id, counter): delta}; keys in `sharded` go to a shard row
+def adjust_counters(deltas, sharded=()):
+    connection = db.session.connection()
+    user = User.__table__
+    shard_count = current_app.config.get('COUNTER_SHARDS', 16)
+    dirty_user_ids = db.session.info.setdefault('dirty_user_ids', set())
+
+    by_user = defaultdict(dict)
+    for (user_id, name), delta in deltas.items():
+        if delta:
+            by_user[user_id][name] = delta
+
+    shard_rows, direct_rows = [], []
+    for user_id in sorted(by_user):
+        direct = dict.fromkeys(COUNTERS, 0)
+        for name, delta in by_user[user_id].items():
+            if (user_id, name) in sharded:
+                shard_rows.append({"user_id": user_id, "name": name, "shard": random.randrange(shard_count),
+                                   "value": delta})
+            else:
+                direct[name] = delta
+        if any(direct.values()):
+            direct_rows.append({"target_id": user_id, **{f"{name}_delta": delta for name, delta in direct.items()}})
+            # Evict the cached snapshot on commit; hot accounts' snapshots are
+            # left to expire so a burst of follows doesn't defeat the cache
+            dirty_user_ids.add(user_id)
+
+    if shard_rows:
+        connection.execute(
+            insert_or_increment(connection, UserCounterShard.__table__, ['user_id', 'name', 'shard'], 'value'),
+            shard_rows
+        )
+    if direct_rows:
+        # One executemany over rows in id order, so two users following each
+        # other (or overlapping batches) can't deadlock
+        connection.execute(
+            update(user).where(user.c.id == bindparam('target_id'))
+            .values({name: user.c[name] + bindparam(f"{name}_delta") for name in COUNTERS}),
+            direct_rows
+        )
+
+
+def count_follow(follower, followed, delta):
+    sharded = {(followed.id, 'follower_count')} if is_hot(followed.follower_count) else ()
+    adjust_counters({(follower.id, 'following_count'): delta, (followed.id, 'follower_count'): delta}, sharded)
+
+
+def count_post(user_id, delta=1):
+    adjust_counters({(user_id, 'post_count'): delta})
+
+
+# Unfolded shard values for a hot account: {counter: delta}
+def shard_totals(user_id):
+    rows = db.session.execute(
+        select(UserCounterShard.name, func.sum(UserCounterShard.value))
+        .where(UserCounterShard.user_id == user_id).group_by(UserCounterShard.name)
+    ).all()
+    return {name: total for name, total in rows}
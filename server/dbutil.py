@@ -0,0 +1,49 @@
+from sqlalchemy import insert
+
+# Small dialect helpers shared by the bulk write paths.
+
+
+# Multi-row INSERT returning each row's primary key in parameter order; one
+# INSERT per row on dialects that can't batch that
+def insert_many_returning_ids(connection, table, values):
+    key = table.primary_key.columns[0]
+    if connection.dialect.insert_executemany_returning_sort_by_parameter_order:
+        return connection.execute(insert(table).returning(key, sort_by_parameter_order=True), values).scalars().all()
+    return [connection.execute(insert(table), row).inserted_primary_key[0] for row in values]
+
+
+# INSERT that silently skips rows violating a unique constraint
+def insert_ignore(connection, table):
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        return pg_insert(table).on_conflict_do_nothing()
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        return sqlite_insert(table).on_conflict_do_nothing()
+    return insert(table).prefix_with('IGNORE')
+
+
+# INSERT that updates the existing row instead when the key (the primary
+# key, for MySQL) is already present; updates(incoming) maps columns to new
+# values, where incoming refers to the row that was being inserted
+def insert_or_update(connection, table, key_columns, updates):
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        statement = pg_insert(table)
+        return statement.on_conflict_do_update(index_elements=key_columns, set_=updates(statement.excluded))
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        statement = sqlite_insert(table)
+        return statement.on_conflict_do_update(index_elements=key_columns, set_=updates(statement.excluded))
+    from sqlalchemy.dialects.mysql import insert as mysql_insert
+    statement = mysql_insert(table)
+    return statement.on_duplicate_key_update(updates(statement.inserted))
+
+
+# INSERT that adds `column` onto the existing row's value when the key is
+# already present
+def insert_or_increment(connection, table, key_columns, column):
+    return insert_or_update(connection, table, key_columns,
+                            lambda incoming: {column: table.c[column] + incoming[column]})
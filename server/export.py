@@ -0,0 +1,101 @@
+import json
+
+from sqlalchemy import select
+
+from models import db, User, Post, Friendship
+from partitions import notification_tables
+from replicas import read_only
+
+# Streaming export of a user's data.
+#
+# Rows are read through a server-side cursor (stream_results + yield_per) and
+# serialized one at a time, so memory stays flat regardless of row count and
+# the first bytes go out as soon as the first batch arrives. Each query is
+# ordered along an existing index so the database never has to sort.
+# Notifications are one query per monthly partition, oldest month first.
+
+EXPORT_BATCH_SIZE = 1000
+# Coalesce serialized rows into chunks of about this many characters
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+
+def _posts(user_id):
+    return select(Post.id, Post.title, Post.content, Post.created_at) \
+        .where(Post.user_id == user_id).order_by(Post.id)
+
+
+def _followers(user_id):
+    return select(User.id, User.username, Friendship.created_at.label("followed_at")) \
+        .join(Friendship, Friendship.follower_id == User.id) \
+        .where(Friendship.followed_id == user_id).order_by(Friendship.follower_id)
+
+
+def _following(user_id):
+    return select(User.id, User.username, Friendship.created_at.label("followed_at")) \
+        .join(Friendship, Friendship.followed_id == User.id) \
+        .where(Friendship.follower_id == user_id).order_by(Friendship.followed_id)
+
+
+def _notifications(user_id):
+    return [select(table.c.id, table.c.message, table.c.read, table.c.created_at)
+            .where(table.c.user_id == user_id).order_by(table.c.created_at, table.c.id)
+            for table in notification_tables(db.session.connection(), newest_first=False)]
+
+
+EXPORTS = {
+    'posts': _posts,
+    'followers': _followers,
+    'following': _following,
+    'notifications': _notifications,
+}
+
+
+def _default(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+# Export functions return a statement, or a list of them to run in turn
+@read_only()
+def iter_rows(kind, user_id):
+    statements = EXPORTS[kind](user_id)
+    for statement in statements if isinstance(statements, list) else [statements]:
+        statement = statement.execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE)
+        for row in db.session.execute(statement):
+            yield row._asdict()
+
+
+def _chunked(pieces):
+    buffer, size = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= EXPORT_CHUNK_SIZE:
+            yield ''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+# One JSON object per line; with several kinds each line is tagged with its type
+def iter_ndjson(kinds, user_id):
+    def lines():
+        for kind in kinds:
+            for row in iter_rows(kind, user_id):
+                if len(kinds) > 1:
+                    row = {"type": kind, **row}
+                yield json.dumps(row, default=_default) + '\n'
+    return _chunked(lines())
+
+
+# A single JSON array, written element by element
+def iter_json_array(kind, user_id):
+    def pieces():
+        yield '['
+        first = True
+        for row in iter_rows(kind, user_id):
+            yield ('' if first else ',') + json.dumps(row, default=_default)
+            first = False
+        yield ']'
+    return _chunked(pieces())
@@ -0,0 +1,119 @@
+from flask import current_app
+
+from identity import get_user_snapshot
+from jobs import enqueue, job_handler
+from models import db, Friendship, Post, User
+from notifications import create_notifications
+from realtime import push_post_after_commit
+from timeline import detect_celebrity, get_timeline_store
+
+# Follower fan-out as background jobs (see jobs.py).
+#
+# Creating posts or following only queues a job, so request latency doesn't
+# grow with the audience. A post_fan_out job walks the author's followers in
+# id order, BULK_NOTIFY_CHUNK_SIZE at a time: it pushes the posts into their
+# timelines and live connections, inserts their Notification rows, and
+# queues the next chunk as a new job in the same transaction. Each chunk
+# commits together with its job, so a retry or a crashed worker never
+# notifies anyone twice, and a large fan-out resumes where it stopped.
+#
+# Celebrity authors (see timeline.py) are not pushed into followers'
+# timelines; their followers still get notified.
+
+
+def _chunk_size():
+    return current_app.config.get('BULK_NOTIFY_CHUNK_SIZE', 1000)
+
+
+# Fan out newly committed posts by one author to their followers
+def enqueue_post_fan_out(author_id, post_ids):
+    enqueue('post_fan_out', {"author_id": author_id, "post_ids": list(post_ids)},
+            idempotency_key=f"post_fan_out:{post_ids[0]}")
+
+
+# Tell each followed account about new follows; created is keyed by
+# followed id. Queued once per follow request in its own transaction, so it
+# needs no idempotency key (and friendship ids make a poor one: SQLite hands
+# a deleted friendship's id to the next follow, so a re-follow would be
+# dropped as a duplicate).
+def enqueue_follow_notifications(follower_id, created):
+    enqueue('follow_notify', {"follower_id": follower_id, "followed_ids": sorted(created)})
+
+
+def _post_payloads(post_ids):
+    rows = db.session.query(
+        Post.id,
+        Post.title,
+        Post.content,
+        Post.created_at,
+        User.id.label("author_id"),
+        User.username.label("author_username")
+    ).join(User, User.id == Post.user_id).filter(Post.id.in_(post_ids)).order_by(Post.id).all()
+    return [{
+        "id": row.id,
+        "title": row.title,
+        "content": row.content,
+        "created_at": row.created_at,
+        "author": {
+            "id": row.author_id,
+            "username": row.author_username
+        }
+    } for row in rows]
+
+
+def _post_message(posts):
+    username = posts[0]["author"]["username"]
+    if len(posts) == 1:
+        return f"{username} posted: {posts[0]['title']}"
+    return f"{username} posted {len(posts)} new posts."
+
+
+# payload: {"author_id", "post_ids"}, plus "after" (last follower id done)
+# and "celebrity" on every chunk but the first
+@job_handler('post_fan_out')
+def fan_out_posts_job(payload):
+    author_id, post_ids = payload["author_id"], payload["post_ids"]
+    after = payload.get("after", 0)
+    posts = _post_payloads(post_ids)
+    if not posts:
+        return
+
+    celebrity = payload.get("celebrity")
+    if celebrity is None:
+        celebrity = detect_celebrity(author_id)
+        if celebrity:
+            # One push to the author room reaches every follower's connections
+            for post in posts:
+                push_post_after_commit(db.session, post, [], True)
+
+    chunk_size = _chunk_size()
+    follower_ids = [row.follower_id for row in db.session.query(Friendship.follower_id)
+                    .filter(Friendship.followed_id == author_id, Friendship.follower_id > after)
+                    .order_by(Friendship.follower_id)
+                    .limit(chunk_size)]
+    if not follower_ids:
+        return
+
+    if not celebrity:
+        get_timeline_store().push(follower_ids, post_ids)
+        for post in posts:
+            push_post_after_commit(db.session, post, follower_ids, False)
+    message = _post_message(posts)
+    create_notifications([{"user_id": follower_id, "message": message} for follower_id in follower_ids])
+
+    if len(follower_ids) == chunk_size:
+        enqueue('post_fan_out', {**payload, "after": follower_ids[-1], "celebrity": celebrity},
+                idempotency_key=f"post_fan_out:{post_ids[0]}:{follower_ids[-1]}")
+
+
+# payload: {"follower_id", "followed_ids"}; follows undone since are skipped
+@job_handler('follow_notify')
+def notify_follows_job(payload):
+    follower = get_user_snapshot(payload["follower_id"])
+    if follower is None:
+        return
+    followed_ids = [row.followed_id for row in db.session.query(Friendship.followed_id)
+                    .filter(Friendship.follower_id == follower.id,
+                            Friendship.followed_id.in_(payload["followed_ids"]))]
+    create_notifications([{"user_id": followed_id, "message": f"{follower.username} has followed you."}
+                          for followed_id in sorted(followed_ids)])
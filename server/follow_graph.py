@@ -0,0 +1,527 @@
+import heapq
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, event, func, insert, select, tuple_
+from sqlalchemy.orm import aliased
+
+from jobs import periodic_job
+from models import db, Friendship, FriendshipDeletion, User
+from replicas import read_only
+
+# In-memory follow graph for relationship lookups and "people you may know".
+#
+# Follows are held as two CSR (compressed sparse row) adjacency structures,
+# one per direction: offsets[u]..offsets[u + 1] slices a flat, per-row sorted
+# array of user ids. That is ~12 bytes per edge instead of an ORM object, and
+# a neighbour list is a slice rather than a query.
+#
+# The CSR arrays are immutable. follow_user/unfollow_user apply deltas to a
+# small per-user overlay that compact() folds back in. A background thread
+# in each worker loads the graph (from the on-disk snapshot, mmapped, when
+# there is a recent one, else from the friendship table) as soon as the
+# worker forks. Until it is ready the same questions are answered from the
+# table by DatabaseFollowGraph, so no request waits on a load.
+#
+# The same thread then catches up every FOLLOW_GRAPH_REFRESH_INTERVAL with
+# changes made through other workers: friendship rows past the highest id
+# it has seen, and unfollows from the friendship_deletion log, which is
+# pruned after FOLLOW_GRAPH_DELETION_RETENTION. Both are index range scans,
+# so the cost follows the rate of change rather than the size of the table.
+# A graph (or snapshot) that fell further behind than the log reaches is
+# rebuilt instead.
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b'FGRAPH02'
+# magic, byte order, node count, edge count, max friendship id, max deletion id, caught up at
+SNAPSHOT_HEADER = struct.Struct('<8s8sqqqqd')
+OFFSET_TYPE, TARGET_TYPE = 'q', 'i'
+# Neighbour lists longer than this are truncated when walking two hops, so a
+# user following a few huge accounts doesn't turn one query into millions
+SUGGESTION_FANOUT = 500
+COMPACT_THRESHOLD = 10000
+# Ids re-read behind each high-water mark, for rows committed out of id
+# order and SQLite handing a deleted friendship's rowid to the next follow
+CATCH_UP_OVERLAP = 100
+# Rows between giving other threads (or gevent greenlets) a turn while
+# building from the table
+YIELD_EVERY = 50000
+
+
+def _yielding(rows):
+    for count, row in enumerate(rows, 1):
+        if count % YIELD_EVERY == 0:
+            time.sleep(0)
+        yield row
+
+
+class CSR:
+    def __init__(self, offsets, targets):
+        self.offsets = offsets
+        self.targets = targets
+
+    @property
+    def node_count(self):
+        return len(self.offsets) - 1
+
+    def row(self, node):
+        if node >= self.node_count:
+            return self.targets[0:0]
+        return self.targets[self.offsets[node]:self.offsets[node + 1]]
+
+    def has_edge(self, source, target):
+        if source >= self.node_count:
+            return False
+        lo, hi = self.offsets[source], self.offsets[source + 1]
+        index = bisect_left(self.targets, target, lo, hi)
+        return index < hi and self.targets[index] == target
+
+    # rows: iterable of (source, target) sorted by source then target
+    @classmethod
+    def from_sorted_edges(cls, node_count, rows):
+        offsets, targets = array(OFFSET_TYPE, [0]), array(TARGET_TYPE)
+        current = 0
+        for source, target in rows:
+            while current < source:
+                offsets.append(len(targets))
+                current += 1
+            targets.append(target)
+        while len(offsets) <= node_count:
+            offsets.append(len(targets))
+        return cls(offsets, targets)
+
+    # The same edges indexed the other way round, by counting sort
+    def transpose(self, node_count):
+        counts = array(OFFSET_TYPE, bytes(8 * (node_count + 1)))
+        for target in self.targets:
+            counts[target + 1] += 1
+        for node in range(node_count):
+            counts[node + 1] += counts[node]
+        offsets = array(OFFSET_TYPE, counts)
+        targets = array(TARGET_TYPE, bytes(4 * len(self.targets)))
+        # Sources are visited in order, so every row comes out sorted
+        for source in range(self.node_count):
+            for target in self.row(source):
+                targets[counts[target]] = source
+                counts[target] += 1
+        return CSR(offsets, targets)
+
+
+# Ranks two-hop candidates, votes: Counter of user id -> how many of the
+# user's follows follow them. Followers the user hasn't followed back get
+# one extra vote. Returns [(user_id, mutual_count), ...]
+def rank_suggestions(user_id, votes, following, followers, limit):
+    mutual = dict(votes)
+    votes.update(followers)
+    exclude = set(following)
+    exclude.add(user_id)
+    ranked = heapq.nsmallest(limit, ((-score, other) for other, score in votes.items() if other not in exclude))
+    return [(other, mutual.get(other, 0)) for _, other in ranked]
+
+
+def _merge(row, added, removed):
+    if not added and not removed:
+        return list(row)
+    merged = [other for other in row if other not in removed] if removed else list(row)
+    return sorted(merged + list(added)) if added else merged
+
+
+def _copy_overlay(overlay):
+    return tuple({user_id: set(ids) for user_id, ids in side.items()} for side in overlay)
+
+
+# Overlay left after folding (folded_added, folded_removed) into the CSR arrays
+# while (added, removed) kept changing
+def _rebase(added, removed, folded_added, folded_removed):
+    rebased_added, rebased_removed = ({}, {}), ({}, {})
+    for direction in (0, 1):
+        for target, newer, older in (
+            (rebased_added, added, folded_added),
+            (rebased_added, folded_removed, removed),
+            (rebased_removed, removed, folded_removed),
+            (rebased_removed, folded_added, added),
+        ):
+            for user_id, ids in newer[direction].items():
+                diff = ids - older[direction].get(user_id, set())
+                if diff:
+                    target[direction].setdefault(user_id, set()).update(diff)
+    return rebased_added, rebased_removed
+
+
+class FollowGraph:
+    def __init__(self, following, followers, max_friendship_id, max_deletion_id, caught_up_at, mapped=None):
+        self._following = following
+        self._followers = followers
+        self._mapped = mapped
+        self.edge_count = len(following.targets)
+        # High-water marks of the friendship and friendship_deletion ids seen,
+        # and when (epoch seconds) the reads that produced them started
+        self.max_friendship_id = max_friendship_id
+        self.max_deletion_id = max_deletion_id
+        self.caught_up_at = caught_up_at
+        # The same for what is folded into the CSR arrays, recorded in snapshots
+        self._base_marks = (max_friendship_id, max_deletion_id, caught_up_at)
+        # (following, followers): user id -> set of ids, applied on top of the CSR rows
+        self._added = ({}, {})
+        self._removed = ({}, {})
+        self._lock = threading.Lock()
+
+    @property
+    def overlay_size(self):
+        return sum(len(ids) for side in self._added + self._removed for ids in side.values())
+
+    def _has_edge(self, follower_id, followed_id):
+        if followed_id in self._added[0].get(follower_id, ()):
+            return True
+        if followed_id in self._removed[0].get(follower_id, ()):
+            return False
+        return self._following.has_edge(follower_id, followed_id)
+
+    def _row(self, direction, user_id):
+        csr = self._following if direction == 0 else self._followers
+        return _merge(csr.row(user_id), self._added[direction].get(user_id), self._removed[direction].get(user_id))
+
+    def _apply(self, follower_id, followed_id, add):
+        grow, shrink = (self._added, self._removed) if add else (self._removed, self._added)
+        for direction, source, target in ((0, follower_id, followed_id), (1, followed_id, follower_id)):
+            if target in shrink[direction].get(source, ()):
+                shrink[direction][source].discard(target)
+            else:
+                grow[direction].setdefault(source, set()).add(target)
+
+    # friendship_id is unused: the catch-up reads ids from the table
+    def follow(self, follower_id, followed_id, friendship_id=0):
+        with self._lock:
+            if not self._has_edge(follower_id, followed_id):
+                self._apply(follower_id, followed_id, add=True)
+                self.edge_count += 1
+
+    def unfollow(self, follower_id, followed_id):
+        with self._lock:
+            if self._has_edge(follower_id, followed_id):
+                self._apply(follower_id, followed_id, add=False)
+                self.edge_count -= 1
+
+    def follows(self, follower_id, followed_id):
+        with self._lock:
+            return self._has_edge(follower_id, followed_id)
+
+    def following(self, user_id):
+        with self._lock:
+            return self._row(0, user_id)
+
+    def followers(self, user_id):
+        with self._lock:
+            return self._row(1, user_id)
+
+    # Accounts the user follows that follow them back
+    def mutuals(self, user_id):
+        with self._lock:
+            followers = set(self._row(1, user_id))
+            return [other for other in self._row(0, user_id) if other in followers]
+
+    def relationship(self, user_id, other_id):
+        with self._lock:
+            return {
+                "following": self._has_edge(user_id, other_id),
+                "follows_you": self._has_edge(other_id, user_id)
+            }
+
+    # Accounts followed by the accounts the user follows (see rank_suggestions)
+    def suggestions(self, user_id, limit, fanout=SUGGESTION_FANOUT):
+        with self._lock:
+            following = self._row(0, user_id)
+            followers = self._row(1, user_id)
+            rows = [self._row(0, other)[:fanout] for other in following[:fanout]]
+
+        votes = Counter()
+        for row in rows:
+            votes.update(row)
+        return rank_suggestions(user_id, votes, following, followers, limit)
+
+    # Fold the overlay into fresh CSR arrays. The O(edges) rebuild runs
+    # without the lock; deltas applied meanwhile are carried over.
+    def compact(self):
+        with self._lock:
+            following = self._following
+            added, removed = _copy_overlay(self._added), _copy_overlay(self._removed)
+            marks = (self.max_friendship_id, self.max_deletion_id, self.caught_up_at)
+
+        node_count = max([following.node_count] + [user_id + 1 for side in added for user_id in side])
+        rows = ((source, target) for source in range(node_count)
+                for target in _merge(following.row(source), added[0].get(source), removed[0].get(source)))
+        following = CSR.from_sorted_edges(node_count, rows)
+        followers = following.transpose(node_count)
+
+        with self._lock:
+            self._added, self._removed = _rebase(self._added, self._removed, added, removed)
+            self._following, self._followers, self._mapped = following, followers, None
+            self._base_marks = marks
+
+    # Writes the CSR arrays only; a loaded snapshot catches up on the rest
+    def save(self, path):
+        following, followers = self._following, self._followers
+        node_count = max(following.node_count, followers.node_count)
+        header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, sys.byteorder.encode().ljust(8), node_count,
+                                      len(following.targets), *self._base_marks)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(header)
+            for csr in (following, followers):
+                f.write(memoryview(csr.offsets).cast('B'))
+                f.write(memoryview(csr.targets).cast('B'))
+                # Keep the next offsets array 8-byte aligned
+                f.write(bytes(-f.tell() % 8))
+        os.replace(tmp, path)
+
+    # Zero-copy: the arrays are views into the mapped file
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, byteorder, node_count, edge_count, *marks = SNAPSHOT_HEADER.unpack_from(mapped)
+        if magic != SNAPSHOT_MAGIC or byteorder.rstrip() != sys.byteorder.encode():
+            mapped.close()
+            raise ValueError(f"{path} is not a follow graph snapshot for this machine")
+
+        view, position, csrs = memoryview(mapped), SNAPSHOT_HEADER.size, []
+        for _ in range(2):
+            offsets_end = position + 8 * (node_count + 1)
+            targets_end = offsets_end + 4 * edge_count
+            csrs.append(CSR(view[position:offsets_end].cast(OFFSET_TYPE), view[offsets_end:targets_end].cast(TARGET_TYPE)))
+            position = targets_end + (-targets_end % 8)
+        return cls(csrs[0], csrs[1], *marks, mapped=mapped)
+
+    @classmethod
+    def from_database(cls, connection):
+        caught_up_at = time.time()
+        node_count = (connection.execute(select(func.max(User.id))).scalar() or 0) + 1
+        # Read before the scan: anything newer is caught up on afterwards
+        max_friendship_id = connection.execute(select(func.max(Friendship.id))).scalar() or 0
+        max_deletion_id = connection.execute(select(func.max(FriendshipDeletion.id))).scalar() or 0
+        # Walks uq_friendship_follower_followed, so rows arrive already sorted
+        rows = connection.execution_options(stream_results=True, yield_per=YIELD_EVERY).execute(
+            select(Friendship.follower_id, Friendship.followed_id)
+            .order_by(Friendship.follower_id, Friendship.followed_id)
+        )
+        following = CSR.from_sorted_edges(node_count, _yielding(rows))
+        time.sleep(0)
+        return cls(following, following.transpose(node_count), max_friendship_id, max_deletion_id, caught_up_at)
+
+    # Apply follows and unfollows committed since the high-water marks. An
+    # unfollowed pair may have been followed again since, so the table has
+    # the last word on every pair in the deletion log.
+    def catch_up(self, connection):
+        caught_up_at = time.time()
+        with self._lock:
+            max_friendship_id, max_deletion_id = self.max_friendship_id, self.max_deletion_id
+        rows = connection.execute(
+            select(Friendship.id, Friendship.follower_id, Friendship.followed_id)
+            .where(Friendship.id > max_friendship_id - CATCH_UP_OVERLAP).order_by(Friendship.id)
+        ).all()
+        for _, follower_id, followed_id in rows:
+            self.follow(follower_id, followed_id)
+
+        deletions = connection.execute(
+            select(FriendshipDeletion.id, FriendshipDeletion.follower_id, FriendshipDeletion.followed_id)
+            .where(FriendshipDeletion.id > max_deletion_id - CATCH_UP_OVERLAP).order_by(FriendshipDeletion.id)
+        ).all()
+        pairs = list({(follower_id, followed_id) for _, follower_id, followed_id in deletions})
+        for start in range(0, len(pairs), 500):
+            batch = pairs[start:start + 500]
+            existing = set(connection.execute(
+                select(Friendship.follower_id, Friendship.followed_id)
+                .where(tuple_(Friendship.follower_id, Friendship.followed_id).in_(batch))
+            ).all())
+            for follower_id, followed_id in batch:
+                if (follower_id, followed_id) in existing:
+                    self.follow(follower_id, followed_id)
+                else:
+                    self.unfollow(follower_id, followed_id)
+
+        with self._lock:
+            if rows:
+                self.max_friendship_id = max(self.max_friendship_id, rows[-1].id)
+            if deletions:
+                self.max_deletion_id = max(self.max_deletion_id, deletions[-1].id)
+            self.caught_up_at = caught_up_at
+
+
+# Answers from the friendship table, for requests that arrive while the
+# worker's graph is still loading. Writes are no-ops: the graph picks them
+# up from the table once loaded.
+class DatabaseFollowGraph:
+    def __init__(self, session):
+        self.session = session
+
+    def follow(self, follower_id, followed_id, friendship_id=0):
+        pass
+
+    def unfollow(self, follower_id, followed_id):
+        pass
+
+    def follows(self, follower_id, followed_id):
+        return self.session.execute(
+            select(Friendship.id).where(Friendship.follower_id == follower_id, Friendship.followed_id == followed_id)
+        ).first() is not None
+
+    def following(self, user_id):
+        return list(self.session.execute(
+            select(Friendship.followed_id).where(Friendship.follower_id == user_id).order_by(Friendship.followed_id)
+        ).scalars())
+
+    def followers(self, user_id):
+        return list(self.session.execute(
+            select(Friendship.follower_id).where(Friendship.followed_id == user_id).order_by(Friendship.follower_id)
+        ).scalars())
+
+    def mutuals(self, user_id):
+        back = aliased(Friendship)
+        return list(self.session.execute(
+            select(Friendship.followed_id)
+            .join(back, (back.follower_id == Friendship.followed_id) & (back.followed_id == Friendship.follower_id))
+            .where(Friendship.follower_id == user_id).order_by(Friendship.followed_id)
+        ).scalars())
+
+    def relationship(self, user_id, other_id):
+        return {
+            "following": self.follows(user_id, other_id),
+            "follows_you": self.follows(other_id, user_id)
+        }
+
+    # The graph's ranking, minus the per-account fanout cap on the second hop
+    @read_only()
+    def suggestions(self, user_id, limit, fanout=SUGGESTION_FANOUT):
+        following = self.following(user_id)
+        votes = Counter()
+        if following:
+            votes.update(dict(self.session.execute(
+                select(Friendship.followed_id, func.count())
+                .where(Friendship.follower_id.in_(following[:fanout])).group_by(Friendship.followed_id)
+            ).all()))
+        return rank_suggestions(user_id, votes, following, self.followers(user_id), limit)
+
+
+# A snapshot written before the deletion log's oldest kept rows can't be
+# caught up; max_age is in seconds
+def load_follow_graph(engine, snapshot_path=None, max_age=None):
+    graph = None
+    if snapshot_path and os.path.exists(snapshot_path):
+        try:
+            graph = FollowGraph.load(snapshot_path)
+        except (ValueError, struct.error) as e:
+            logger.warning("Ignoring follow graph snapshot: %s", e)
+        else:
+            if max_age is not None and time.time() - graph.caught_up_at > max_age:
+                logger.info("Ignoring follow graph snapshot older than %ss", max_age)
+                graph = None
+    with engine.connect() as connection:
+        if graph is None:
+            graph = FollowGraph.from_database(connection)
+            if snapshot_path:
+                graph.save(snapshot_path)
+        else:
+            graph.catch_up(connection)
+    return graph
+
+
+# Loads the graph in the background, then keeps it caught up. With
+# FOLLOW_GRAPH_REFRESH_INTERVAL = 0 (tests) there is no thread: the graph
+# is loaded by the first caller and never refreshed.
+class FollowGraphService:
+    def __init__(self, engine, config):
+        self.pid = os.getpid()
+        self.engine = engine
+        self.snapshot_path = config.get('FOLLOW_GRAPH_SNAPSHOT')
+        self.refresh_interval = config.get('FOLLOW_GRAPH_REFRESH_INTERVAL', 30)
+        # Catching up needs every deletion logged since; leave a margin
+        self.max_lag = config.get('FOLLOW_GRAPH_DELETION_RETENTION', 7 * 86400) / 2
+        self.graph = None
+        if self.refresh_interval:
+            threading.Thread(target=self._run, name='follow-graph', daemon=True).start()
+        else:
+            self._load()
+
+    def _load(self):
+        graph = load_follow_graph(self.engine, self.snapshot_path, self.max_lag)
+        self.graph = graph
+        # Routes skipped their deltas until now; pick up what they committed
+        with self.engine.connect() as connection:
+            graph.catch_up(connection)
+
+    def refresh(self):
+        graph = self.graph
+        if time.time() - graph.caught_up_at > self.max_lag:
+            with self.engine.connect() as connection:
+                graph = FollowGraph.from_database(connection)
+            self.graph = graph
+        else:
+            with self.engine.connect() as connection:
+                graph.catch_up(connection)
+            if graph.overlay_size <= COMPACT_THRESHOLD:
+                return
+            graph.compact()
+        if self.snapshot_path:
+            graph.save(self.snapshot_path)
+
+    def _run(self):
+        while self.graph is None:
+            try:
+                self._load()
+            except Exception:
+                logger.exception("Follow graph load failed")
+                time.sleep(self.refresh_interval)
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Follow graph refresh failed")
+
+
+_service_lock = threading.Lock()
+
+
+# The service is per process, so forked workers each load their own graph;
+# gunicorn's post_fork starts it, anything else on first use
+def start_follow_graph():
+    app = current_app._get_current_object()
+    service = app.extensions.get('follow_graph')
+    if service is None or service.pid != os.getpid():
+        with _service_lock:
+            service = app.extensions.get('follow_graph')
+            if service is None or service.pid != os.getpid():
+                service = app.extensions['follow_graph'] = FollowGraphService(db.engine, app.config)
+    return service
+
+
+# The loaded graph, or the table while it loads
+def get_follow_graph():
+    graph = start_follow_graph().graph
+    return graph if graph is not None else DatabaseFollowGraph(db.session)
+
+
+# The catch-up reads unfollows from this log
+@event.listens_for(Friendship, 'after_delete')
+def _log_deletion(mapper, connection, target):
+    connection.execute(insert(FriendshipDeletion.__table__).values(
+        follower_id=target.follower_id, followed_id=target.followed_id, deleted_at=datetime.utcnow()
+    ))
+
+
+@periodic_job('follow_graph_prune', 'FOLLOW_GRAPH_PRUNE_INTERVAL', 3600)
+def prune_deletions_job(payload):
+    retention = current_app.config.get('FOLLOW_GRAPH_DELETION_RETENTION', 7 * 86400)
+    table = FriendshipDeletion.__table__
+    db.session.execute(delete(table).where(table.c.deleted_at < datetime.utcnow() - timedelta(seconds=retention)))
@@ -0,0 +1,75 @@
+import gc
+import multiprocessing
+import os
+import resource
+
+# gunicorn settings for the cooperative serving mode (see the Procfile).
+#
+# gevent workers serve every request and Socket.IO connection on a greenlet,
+# so an idle socket or a long-poll costs a few KB instead of a worker. The
+# standard library and psycopg2 are patched here, before gunicorn preloads
+# the app, so everything imported afterwards (Redis clients, SQLAlchemy
+# pools, the job and refresh threads) is cooperative too.
+#
+# The app is imported once in the master and the workers are forked from
+# it, sharing the imported modules copy-on-write. The master never runs
+# the garbage collector and freezes everything it holds before each fork,
+# so collections in the workers don't write to (and unshare) those pages.
+#
+#   gunicorn -c gunicorn.conf.py wsgi:app
+#   WEB_CONCURRENCY=8 GUNICORN_WORKER_CONNECTIONS=20000 gunicorn -c gunicorn.conf.py wsgi:app
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+# Open sockets per worker, idle Socket.IO connections included
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 10000))
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', '5000')}")
+backlog = 4096
+preload_app = True
+keepalive = 75
+timeout = 30
+graceful_timeout = 30
+
+if worker_class == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+    try:
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:  # psycopg2 isn't installed (SQLite setups)
+        pass
+    else:
+        patch_psycopg()
+    os.environ.setdefault('SOCKETIO_ASYNC_MODE', 'gevent')
+else:
+    os.environ.setdefault('SOCKETIO_ASYNC_MODE', 'threading')
+
+# Polling sessions can't follow a client from one worker to another
+if workers > 1:
+    os.environ.setdefault('SOCKETIO_TRANSPORTS', 'websocket')
+
+gc.disable()
+
+
+def on_starting(server):
+    # Every connection is a file descriptor
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard != resource.RLIM_INFINITY and soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def pre_fork(server, worker):
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    gc.enable()
+    # Pooled connections must not be shared with the master or other workers
+    from wsgi import app
+    from models import db
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+        # Load the follow graph in the background now, not on the first
+        # request that needs it
+        from follow_graph import start_follow_graph
+        start_follow_graph()
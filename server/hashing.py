@@ -0,0 +1,111 @@
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeout
+
+import bcrypt
+from flask import current_app
+
+# Password hashing off the request thread.
+#
+# bcrypt at 12 rounds costs ~250ms of CPU. Running it inline pins a worker for
+# that long, so a burst of logins starves every other endpoint. Hashes and
+# checks are instead submitted to a process pool. At most
+# PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE_SIZE jobs may be in flight;
+# past that callers get HasherBusy immediately (routes answer 503) instead
+# of queueing behind the storm.
+#
+# The hash_async/verify_async futures can be awaited from asyncio code with
+# asyncio.wrap_future().
+
+
+class HasherBusy(Exception):
+    pass
+
+
+# Worker-side functions; must be module level so they can be pickled
+def _hash_password(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check_password(password_hash, password):
+    return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+
+
+class PasswordHasher:
+    def __init__(self, rounds=12, workers=None, queue_size=64, timeout=10):
+        self.rounds = rounds
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max(self.workers, 1) + queue_size)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    # Pools do not survive fork, so each worker process builds its own lazily
+    def _get_executor(self):
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _submit(self, fn, *args):
+        # workers == 0 runs inline, which is what tests and scripts want
+        if self.workers == 0:
+            future = Future()
+            future.set_result(fn(*args))
+            return future
+
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy("Password hashing queue is full")
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def hash_async(self, password):
+        return self._submit(_hash_password, password, self.rounds)
+
+    def verify_async(self, password_hash, password):
+        return self._submit(_check_password, password_hash, password)
+
+    def _wait(self, future):
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise HasherBusy("Password hashing timed out")
+
+    def hash(self, password):
+        return self._wait(self.hash_async(password))
+
+    def verify(self, password_hash, password):
+        return self._wait(self.verify_async(password_hash, password))
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+_hasher_lock = threading.Lock()
+
+
+def get_password_hasher():
+    app = current_app._get_current_object()
+    hasher = app.extensions.get('password_hasher')
+    if hasher is None:
+        with _hasher_lock:
+            hasher = app.extensions.get('password_hasher')
+            if hasher is None:
+                hasher = app.extensions['password_hasher'] = PasswordHasher(
+                    rounds=app.config.get('BCRYPT_LOG_ROUNDS', 12),
+                    workers=app.config.get('PASSWORD_HASH_WORKERS'),
+                    queue_size=app.config.get('PASSWORD_HASH_QUEUE_SIZE', 64),
+                    timeout=app.config.get('PASSWORD_HASH_TIMEOUT', 10)
+                )
+    return hasher
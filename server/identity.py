@@ -0,0 +1,171 @@
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, has_app_context, session
+from sqlalchemy import event
+from sqlalchemy.orm import Session, load_only, object_session
+
+from counters import COUNTERS, is_hot, shard_totals
+from models import db, User
+from replicas import read_only
+
+# Current-user loading without a primary-key query on every request.
+#
+# The user behind session['user_id'] is memoized on flask.g for the rest of
+# the request, and kept process-wide in an LRU+TTL cache of compact
+# UserSnapshot objects. Inserts and updates of User rows evict the cached
+# snapshot once the transaction commits; other processes converge within
+# IDENTITY_CACHE_TTL seconds.
+
+
+class UserSnapshot:
+    __slots__ = ('id', 'username', 'image_url', 'bio', 'follower_count', 'following_count', 'post_count')
+
+    def __init__(self, id, username, image_url, bio, follower_count=0, following_count=0, post_count=0):
+        self.id = id
+        self.username = username
+        self.image_url = image_url
+        self.bio = bio
+        self.follower_count = follower_count
+        self.following_count = following_count
+        self.post_count = post_count
+
+    # Flask-Login user protocol
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
+    def get_id(self):
+        return str(self.id)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "username": self.username,
+            "image_url": self.image_url,
+            "bio": self.bio,
+            "follower_count": self.follower_count,
+            "following_count": self.following_count,
+            "post_count": self.post_count
+        }
+
+
+class IdentityCache:
+    def __init__(self, max_size=10000, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[user_id]
+            self.misses += 1
+            return None
+
+    def put(self, snapshot):
+        with self._lock:
+            self._entries[snapshot.id] = (time.monotonic() + self.ttl, snapshot)
+            self._entries.move_to_end(snapshot.id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+_cache_lock = threading.Lock()
+
+
+def get_identity_cache():
+    app = current_app._get_current_object()
+    cache = app.extensions.get('identity_cache')
+    if cache is None:
+        with _cache_lock:
+            cache = app.extensions.get('identity_cache')
+            if cache is None:
+                cache = app.extensions['identity_cache'] = IdentityCache(
+                    max_size=app.config.get('IDENTITY_CACHE_SIZE', 10000),
+                    ttl=app.config.get('IDENTITY_CACHE_TTL', 60)
+                )
+    return cache
+
+
+# Snapshot for any user id, from the cache or a single narrow query (which
+# may go to a replica)
+@read_only()
+def get_user_snapshot(user_id):
+    cache = get_identity_cache()
+    snapshot = cache.get(user_id)
+    if snapshot is None:
+        user = db.session.query(User).options(
+            load_only(User.id, User.username, User.image_url, User.bio,
+                      User.follower_count, User.following_count, User.post_count)
+        ).filter(User.id == user_id).first()
+        if user is None:
+            return None
+        counts = {name: getattr(user, name) for name in COUNTERS}
+        if is_hot(user.follower_count):
+            for name, delta in shard_totals(user.id).items():
+                counts[name] += delta
+        snapshot = UserSnapshot(user.id, user.username, user.image_url, user.bio, **counts)
+        cache.put(snapshot)
+    return snapshot
+
+
+# The logged-in user for this request, or None. Cached on g against the
+# session's user id, which login, signup and logout change mid-request (and
+# test clients sharing one app context change between requests)
+def load_current_user():
+    user_id = session.get('user_id')
+    cached = g.get('_current_user')
+    if cached is None or cached[0] != user_id:
+        cached = g._current_user = (user_id, get_user_snapshot(user_id) if user_id is not None else None)
+    return cached[1]
+
+
+def init_login_manager(login_manager):
+    login_manager.user_loader(lambda user_id: get_user_snapshot(int(user_id)))
+    # Routes keep their own session['user_id']; let current_user see it too
+    login_manager.request_loader(lambda request: load_current_user())
+
+
+# Write-through invalidation: remember touched users, evict after commit
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _track_user_write(mapper, connection, target):
+    object_session(target).info.setdefault('dirty_user_ids', set()).add(target.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _evict_committed_users(session_):
+    user_ids = session_.info.pop('dirty_user_ids', None)
+    if user_ids and has_app_context():
+        cache = get_identity_cache()
+        for user_id in user_ids:
+            cache.invalidate(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back_users(session_):
+    session_.info.pop('dirty_user_ids', None)
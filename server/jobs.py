@@ -0,0 +1,357 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app, has_app_context
+from sqlalchemy import delete, event, func, insert, select, text, update
+from sqlalchemy.orm import Session
+
+from dbutil import insert_ignore
+from models import db, Job
+
+# Durable background jobs, queued in the job table.
+#
+# enqueue() inserts a row in the caller's transaction, so a job exists
+# exactly when the write that asked for it commits. Worker threads in every
+# process (JOB_WORKERS each) claim due rows in batches: claiming takes a
+# lease of JOB_VISIBILITY_TIMEOUT seconds, after which a job whose worker
+# died becomes runnable again. On Postgres claims use FOR UPDATE SKIP
+# LOCKED, so workers on any number of nodes share the table.
+#
+# A handler runs in its own transaction and the job is marked done in that
+# same transaction, so its writes land once or not at all. Completion is
+# fenced on the attempt count: if the lease ran out and someone else
+# claimed the job meanwhile, this run's writes are rolled back. Failures
+# are retried with exponential backoff up to max_attempts, then the row is
+# left as 'failed' for inspection. Handlers must not commit themselves.
+#
+# With an idempotency key, enqueuing the same work twice is a no-op for as
+# long as the first row is kept (done rows for JOB_RETENTION seconds).
+#
+# Periodic jobs are queued by whichever worker first notices their
+# interval has started, keyed on the interval, so each runs once per
+# interval however many processes there are.
+#
+# JOB_WORKERS = 0 runs no threads; due jobs run in the committing thread
+# right after the commit that queued them, which is what tests want.
+
+logger = logging.getLogger(__name__)
+
+PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+# Matches the ix_job_runnable predicate word for word, so SQLite uses it too
+RUNNABLE = text("status IN ('pending', 'running')")
+MAX_BACKOFF = 3600
+PURGE_INTERVAL = 60
+PURGE_CHUNK_SIZE = 1000
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HANDLERS = {}
+PERIODIC = {}
+
+
+# Register fn(payload) as the handler for jobs of this kind
+def job_handler(kind):
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return register
+
+
+# Register fn(payload) for jobs of this kind and queue one every
+# app.config[setting] seconds (default when unset; 0 turns it off)
+def periodic_job(kind, setting, default):
+    def register(fn):
+        HANDLERS[kind] = fn
+        PERIODIC[kind] = (setting, default)
+        return fn
+    return register
+
+
+# Queue a job in the current transaction; False if idempotency_key was
+# already used
+def enqueue(kind, payload, idempotency_key=None, delay=0, max_attempts=None):
+    values = {
+        "kind": kind,
+        "payload": json.dumps(payload),
+        "idempotency_key": idempotency_key,
+        "status": PENDING,
+        "attempts": 0,
+        "max_attempts": max_attempts or current_app.config.get('JOB_MAX_ATTEMPTS', 5),
+        "run_at": datetime.utcnow() + timedelta(seconds=delay),
+        "created_at": datetime.utcnow(),
+    }
+    connection = db.session.connection()
+    table = Job.__table__
+    statement = insert_ignore(connection, table) if idempotency_key else insert(table)
+    queued = bool(connection.execute(statement, values).rowcount)
+    if queued:
+        db.session.info['jobs_enqueued'] = True
+    return queued
+
+
+class ClaimedJob:
+    def __init__(self, id, kind, payload, attempts, max_attempts):
+        self.id = id
+        self.kind = kind
+        self.payload = payload
+        self.attempts = attempts
+        self.max_attempts = max_attempts
+
+
+class JobQueue:
+    def __init__(self, app, workers=2, batch_size=10, poll_interval=1, visibility_timeout=300,
+                 retry_backoff=10, retention=86400):
+        self.pid = os.getpid()
+        self.app = app
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.visibility_timeout = visibility_timeout
+        self.retry_backoff = retry_backoff
+        self.retention = retention
+        self._wakeup = threading.Event()
+        self._local = threading.local()
+        self._purged_at = time.monotonic()
+        self._purge_lock = threading.Lock()
+        self._periodic_slots = {}
+        for index in range(workers):
+            threading.Thread(target=self._run, name=f'job-worker-{index}', daemon=True).start()
+
+    # Called after a commit that queued jobs
+    def wake(self):
+        if self.workers:
+            self._wakeup.set()
+        else:
+            self.run_pending()
+
+    # Claim a batch of due jobs and start their leases
+    def claim(self, limit):
+        table = Job.__table__
+        now = datetime.utcnow()
+        connection = db.session.connection()
+        query = (select(table.c.id).where(RUNNABLE, table.c.run_at <= now)
+                 .order_by(table.c.run_at, table.c.id).limit(limit))
+        locking = connection.dialect.name in ('postgresql', 'mysql')
+        if locking:
+            query = query.with_for_update(skip_locked=True)
+        ids = connection.execute(query).scalars().all()
+        if not ids:
+            db.session.rollback()
+            return []
+        # Without row locks (SQLite) another worker may have claimed some of
+        # these since the SELECT, so the UPDATE checks again
+        statement = (update(table)
+                     .where(table.c.id.in_(ids), RUNNABLE, table.c.run_at <= now)
+                     .values(status=RUNNING, attempts=table.c.attempts + 1,
+                             run_at=now + timedelta(seconds=self.visibility_timeout)))
+        columns = (table.c.id, table.c.kind, table.c.payload, table.c.attempts, table.c.max_attempts)
+        if locking and not connection.dialect.update_returning:
+            connection.execute(statement)
+            rows = connection.execute(select(*columns).where(table.c.id.in_(ids))).all()
+        else:
+            rows = connection.execute(statement.returning(*columns)).all()
+        db.session.commit()
+        return [ClaimedJob(row.id, row.kind, json.loads(row.payload), row.attempts, row.max_attempts)
+                for row in sorted(rows, key=lambda row: row.id)]
+
+    # Fenced on attempts: a no-op once the lease has been taken over
+    def _settle(self, job, **values):
+        table = Job.__table__
+        return db.session.execute(
+            update(table).where(table.c.id == job.id, table.c.status == RUNNING, table.c.attempts == job.attempts)
+            .values(**values)
+        ).rowcount == 1
+
+    def _backoff(self, attempts):
+        return min(self.retry_backoff * 2 ** (attempts - 1), MAX_BACKOFF) * random.uniform(0.5, 1)
+
+    def execute(self, job):
+        handler = HANDLERS.get(job.kind)
+        started = time.perf_counter()
+        try:
+            if handler is None:
+                raise LookupError(f"No handler for job kind {job.kind!r}")
+            handler(job.payload)
+            if self._settle(job, status=DONE, finished_at=datetime.utcnow(), last_error=None):
+                db.session.commit()
+                outcome = 'done'
+            else:
+                logger.warning("Job %s (%s) outlived its lease; discarding this run", job.id, job.kind)
+                db.session.rollback()
+                outcome = 'lost'
+        except Exception as e:
+            db.session.rollback()
+            now = datetime.utcnow()
+            if job.attempts < job.max_attempts:
+                outcome = 'retry'
+                values = {"status": PENDING, "run_at": now + timedelta(seconds=self._backoff(job.attempts))}
+                logger.warning("Job %s (%s) failed on attempt %d: %s", job.id, job.kind, job.attempts, e)
+            else:
+                outcome = 'failed'
+                values = {"status": FAILED, "finished_at": now}
+                logger.exception("Job %s (%s) failed for good after %d attempts", job.id, job.kind, job.attempts)
+            self._settle(job, last_error=f"{type(e).__name__}: {e}"[:2000], **values)
+            db.session.commit()
+
+        metrics = current_app.extensions.get('metrics')
+        if metrics is not None:
+            labels = (('kind', job.kind),)
+            metrics.inc('jobs_processed_total', labels + (('outcome', outcome),))
+            metrics.observe('job_duration_seconds', labels, time.perf_counter() - started, DURATION_BUCKETS)
+        return outcome
+
+    # Run due jobs in this thread until there are none; returns how many ran
+    def run_pending(self):
+        # A job that queues another (from its own commit) lands back here;
+        # the outer loop picks it up instead of recursing
+        if getattr(self._local, 'draining', False):
+            return 0
+        self._local.draining = True
+        ran = 0
+        try:
+            with self.app.app_context():
+                self._maybe_purge()
+                self._schedule_periodic()
+                while True:
+                    jobs = self.claim(self.batch_size)
+                    if not jobs:
+                        return ran
+                    for job in jobs:
+                        self.execute(job)
+                        ran += 1
+        finally:
+            self._local.draining = False
+
+    # Drop done jobs past JOB_RETENTION, a chunk at a time
+    def purge(self):
+        table = Job.__table__
+        cutoff = datetime.utcnow() - timedelta(seconds=self.retention)
+        purged = 0
+        while True:
+            ids = select(table.c.id).where(table.c.status == DONE, table.c.finished_at < cutoff).limit(PURGE_CHUNK_SIZE)
+            deleted = db.session.execute(delete(table).where(table.c.id.in_(ids))).rowcount
+            db.session.commit()
+            purged += deleted
+            if deleted < PURGE_CHUNK_SIZE:
+                return purged
+
+    def _maybe_purge(self):
+        if time.monotonic() - self._purged_at < PURGE_INTERVAL or not self._purge_lock.acquire(blocking=False):
+            return
+        try:
+            self._purged_at = time.monotonic()
+            self.purge()
+        finally:
+            self._purge_lock.release()
+
+    # Queue each periodic job whose interval has started since this process
+    # last did; the idempotency key drops the other processes' copies
+    def _schedule_periodic(self):
+        now = time.time()
+        queued = False
+        for kind, (setting, default) in PERIODIC.items():
+            interval = self.app.config.get(setting, default)
+            if not interval:
+                continue
+            slot = int(now // interval)
+            if self._periodic_slots.get(kind) != slot:
+                self._periodic_slots[kind] = slot
+                enqueue(kind, {"slot": slot}, idempotency_key=f"{kind}:{slot}")
+                queued = True
+        if queued:
+            db.session.commit()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            try:
+                self.run_pending()
+            except Exception:
+                logger.exception("Job worker failed")
+                time.sleep(self.poll_interval)
+
+    # {"ready", "scheduled", "running", "failed"} counts and the age in
+    # seconds of the oldest ready job
+    def depth(self):
+        table = Job.__table__
+        now = datetime.utcnow()
+        due = table.c.run_at <= now
+        rows = db.session.execute(
+            select(table.c.status, due.label('due'), func.count(), func.min(table.c.run_at))
+            .where(RUNNABLE).group_by(table.c.status, due)
+        ).all()
+        stats = {"ready": 0, "scheduled": 0, "running": 0, "failed": 0, "oldest_ready_seconds": 0.0}
+        for status, is_due, count, oldest in rows:
+            if status == RUNNING:
+                stats["running"] += count
+            elif is_due:
+                stats["ready"] += count
+                stats["oldest_ready_seconds"] = (now - oldest).total_seconds()
+            else:
+                stats["scheduled"] += count
+        stats["failed"] = db.session.execute(select(func.count()).where(table.c.status == FAILED)).scalar()
+        return stats
+
+
+_queue_lock = threading.Lock()
+
+
+# Per app and per process: forked workers each start their own threads
+def get_job_queue():
+    app = current_app._get_current_object()
+    queue = app.extensions.get('jobs')
+    if queue is None or queue.pid != os.getpid():
+        with _queue_lock:
+            queue = app.extensions.get('jobs')
+            if queue is None or queue.pid != os.getpid():
+                config = app.config
+                queue = app.extensions['jobs'] = JobQueue(
+                    app,
+                    workers=config.get('JOB_WORKERS', 2),
+                    batch_size=config.get('JOB_BATCH_SIZE', 10),
+                    poll_interval=config.get('JOB_POLL_INTERVAL', 1),
+                    visibility_timeout=config.get('JOB_VISIBILITY_TIMEOUT', 300),
+                    retry_backoff=config.get('JOB_RETRY_BACKOFF', 10),
+                    retention=config.get('JOB_RETENTION', 86400)
+                )
+    return queue
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_workers(session_):
+    if session_.info.pop('jobs_enqueued', False) and has_app_context():
+        get_job_queue().wake()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_enqueued(session_):
+    session_.info.pop('jobs_enqueued', None)
+
+
+def _start_workers():
+    get_job_queue()
+
+
+def init_jobs(app):
+    # Start this process's workers with its first request, so jobs queued
+    # before a restart or by other processes don't wait for a local enqueue
+    app.before_request(_start_workers)
+
+    metrics = app.extensions.get('metrics')
+    if metrics is None:
+        return
+
+    def queue_gauges():
+        if not has_app_context():
+            return
+        stats = get_job_queue().depth()
+        for state in ('ready', 'scheduled', 'running', 'failed'):
+            yield 'job_queue_depth', (('state', state),), stats[state]
+        yield 'job_queue_oldest_ready_seconds', (), stats['oldest_ready_seconds']
+
+    metrics.add_gauges(queue_gauges)
@@ -0,0 +1,205 @@
+import math
+import random
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import bindparam, delete, func, select, update
+
+from dbutil import insert_ignore, insert_or_increment, insert_or_update
+from jobs import periodic_job
+from models import db, User, Post, Like, PostLikeShard, TrendingPost
+
+# Likes, like counters and the trending table.
+#
+# A like is one Like row; liking a post twice (or unliking it twice) is a
+# no-op, so clients can retry freely. Post.like_count is adjusted in the
+# same transaction. Posts with at least LIKE_SHARD_THRESHOLD likes are
+# viral: their increments go to one of COUNTER_SHARDS PostLikeShard rows
+# picked at random instead of the post row, so a burst of likes doesn't
+# queue on one row lock, and like_counts() adds the shards back up.
+#
+# Trending is read from TrendingPost with one index range scan. A like at
+# time t weighs 2^((t - TRENDING_EPOCH) / TRENDING_HALF_LIFE): relative to
+# a like arriving now, each like's weight halves every half-life. A post's
+# score is log2 of the sum of its likes' weights, so a like (or unlike) is
+# a single UPDATE of that row, and comparing two scores compares the posts'
+# decayed like totals at any moment: rows never need rescoring as time
+# passes. Only posts from the last TRENDING_WINDOW seconds are scored.
+#
+# The trending_refresh job runs every TRENDING_REFRESH_INTERVAL seconds. It
+# folds viral posts' shards into like_count and their trending scores, and
+# drops posts that left the window. Viral posts' scores therefore lag by up
+# to one interval, and their unlikes only cancel likes from that interval.
+
+TRENDING_EPOCH = datetime(2024, 1, 1)
+LN2 = math.log(2)
+# An unlike that would leave less than this share of a post's score drops
+# the row instead of taking the log of (almost) nothing
+MIN_REMAINING_SHARE = 1e-6
+
+
+def is_viral(like_count):
+    return like_count >= current_app.config.get('LIKE_SHARD_THRESHOLD', 1000)
+
+
+# Log2 of the weight of a like made at `when`
+def like_weight(when):
+    return (when - TRENDING_EPOCH).total_seconds() / current_app.config.get('TRENDING_HALF_LIFE', 21600)
+
+
+# A post's trending score as its likes' total weight right now, where a
+# like made now weighs 1
+def decayed_likes(score, now):
+    return 2 ** (score - like_weight(now))
+
+
+def window_start(now):
+    return now - timedelta(seconds=current_app.config.get('TRENDING_WINDOW', 86400))
+
+
+def _count_like(connection, post, delta):
+    if is_viral(post.like_count):
+        connection.execute(
+            insert_or_increment(connection, PostLikeShard.__table__, ['post_id', 'shard'], 'value'),
+            {"post_id": post.id, "shard": random.randrange(current_app.config.get('COUNTER_SHARDS', 16)),
+             "value": delta}
+        )
+        return False
+    table = Post.__table__
+    connection.execute(update(table).where(table.c.id == post.id).values(like_count=table.c.like_count + delta))
+    return True
+
+
+# rows: [{"post_id", "score": log2 of the added weight, "created_at"}]
+def _add_to_trending(connection, rows):
+    table = TrendingPost.__table__
+    connection.execute(
+        insert_or_update(connection, table, ['post_id'], lambda incoming: {
+            "score": table.c.score + func.ln(1 + func.power(2.0, incoming.score - table.c.score)) / LN2
+        }),
+        rows
+    )
+
+
+def _remove_from_trending(connection, post_id, weight):
+    table = TrendingPost.__table__
+    share = func.power(2.0, weight - table.c.score)
+    connection.execute(delete(table).where(table.c.post_id == post_id, share > 1 - MIN_REMAINING_SHARE))
+    connection.execute(
+        update(table).where(table.c.post_id == post_id, share <= 1 - MIN_REMAINING_SHARE)
+        .values(score=table.c.score + func.ln(1 - share) / LN2)
+    )
+
+
+# post: a row with id, created_at and like_count. False if already liked
+def like_post(user_id, post):
+    connection = db.session.connection()
+    now = datetime.utcnow()
+    liked = connection.execute(insert_ignore(connection, Like.__table__),
+                               {"user_id": user_id, "post_id": post.id, "created_at": now}).rowcount
+    if not liked:
+        return False
+    # Viral posts reach trending when their shards are folded
+    if _count_like(connection, post, 1) and post.created_at >= window_start(now):
+        _add_to_trending(connection, [{"post_id": post.id, "score": like_weight(now), "created_at": post.created_at}])
+    return True
+
+
+# post: a row with id, created_at and like_count. False if not liked
+def unlike_post(user_id, post):
+    connection = db.session.connection()
+    table = Like.__table__
+    match = (table.c.user_id == user_id, table.c.post_id == post.id)
+    liked_at = connection.execute(select(table.c.created_at).where(*match)).scalar()
+    # Checked by rowcount too, so concurrent unlikes only count once
+    if liked_at is None or not connection.execute(delete(table).where(*match)).rowcount:
+        return False
+    if _count_like(connection, post, -1) and post.created_at >= window_start(datetime.utcnow()):
+        _remove_from_trending(connection, post.id, like_weight(liked_at))
+    return True
+
+
+# Exact like counts, {post_id: count}, for rows with id and like_count
+def like_counts(posts):
+    counts = {post.id: post.like_count for post in posts}
+    viral = [post.id for post in posts if is_viral(post.like_count)]
+    if viral:
+        rows = db.session.execute(
+            select(PostLikeShard.post_id, func.sum(PostLikeShard.value))
+            .where(PostLikeShard.post_id.in_(viral)).group_by(PostLikeShard.post_id)
+        )
+        for post_id, total in rows:
+            counts[post_id] += total
+    return counts
+
+
+def like_count(post_id):
+    post = db.session.query(Post.id, Post.like_count).filter(Post.id == post_id).one()
+    return like_counts([post])[post_id]
+
+
+# The top `limit` posts of the window by decayed likes, best first
+def trending_posts(limit):
+    return db.session.query(
+        Post.id,
+        Post.title,
+        Post.content,
+        Post.created_at,
+        Post.like_count,
+        TrendingPost.score,
+        User.id.label("author_id"),
+        User.username.label("author_username")
+    ).select_from(TrendingPost) \
+        .join(Post, Post.id == TrendingPost.post_id) \
+        .join(User, User.id == Post.user_id) \
+        .filter(TrendingPost.created_at >= window_start(datetime.utcnow())) \
+        .order_by(TrendingPost.score.desc(), TrendingPost.post_id.desc()) \
+        .limit(limit).all()
+
+
+# Move viral posts' shard values onto like_count, and their net new likes
+# onto their trending scores as if made now; returns the posts folded
+def fold_like_shards(now):
+    connection = db.session.connection()
+    shard, post = PostLikeShard.__table__, Post.__table__
+    rows = connection.execute(
+        select(shard.c.post_id, shard.c.shard, shard.c.value).where(shard.c.value != 0)
+        .order_by(shard.c.post_id, shard.c.shard).with_for_update()
+    ).all()
+    if not rows:
+        return 0
+
+    totals = defaultdict(int)
+    for row in rows:
+        totals[row.post_id] += row.value
+    # Subtract what was read rather than zeroing, keeping likes that land meanwhile
+    connection.execute(
+        update(shard).where(shard.c.post_id == bindparam('target_id'), shard.c.shard == bindparam('target_shard'))
+        .values(value=shard.c.value - bindparam('delta')),
+        [{"target_id": row.post_id, "target_shard": row.shard, "delta": row.value} for row in rows]
+    )
+    connection.execute(
+        update(post).where(post.c.id == bindparam('target_id')).values(like_count=post.c.like_count + bindparam('delta')),
+        [{"target_id": post_id, "delta": total} for post_id, total in totals.items()]
+    )
+
+    gained = [post_id for post_id, total in totals.items() if total > 0]
+    if gained:
+        weight = like_weight(now)
+        recent = connection.execute(
+            select(post.c.id, post.c.created_at).where(post.c.id.in_(gained), post.c.created_at >= window_start(now))
+            .order_by(post.c.id)
+        ).all()
+        if recent:
+            _add_to_trending(connection, [{"post_id": row.id, "score": weight + math.log2(totals[row.id]),
+                                           "created_at": row.created_at} for row in recent])
+    return len(totals)
+
+
+@periodic_job('trending_refresh', 'TRENDING_REFRESH_INTERVAL', 60)
+def refresh_trending_job(payload):
+    now = datetime.utcnow()
+    fold_like_shards(now)
+    table = TrendingPost.__table__
+    db.session.execute(delete(table).where(table.c.created_at < window_start(now)))
@@ -0,0 +1,327 @@
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import warnings
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+
+from flask import current_app, redirect, send_from_directory
+
+# Avatar uploads and thumbnails, stored by content hash.
+#
+# An upload is streamed from the request body to a temporary file in
+# MEDIA_CHUNK_SIZE pieces while it is hashed, so memory use doesn't grow
+# with the image. The SHA-256 of the bytes names everything derived from
+# them: the original is kept under originals/ and one square JPEG per
+# MEDIA_THUMBNAIL_SIZES under thumbs/. Uploading an image that is already
+# stored (by anyone) skips the work entirely.
+#
+# Decoding and resizing run in a process pool, like password hashing: at
+# most MEDIA_WORKERS + MEDIA_QUEUE_SIZE images are in flight and past that
+# uploads get MediaBusy (503). Since a key's bytes never change, files are
+# served with a year-long immutable Cache-Control, and Range requests are
+# answered with partial content.
+#
+# MEDIA_BACKEND picks the storage: 'local' keeps files under MEDIA_ROOT,
+# 's3' puts them in MEDIA_S3_BUCKET and redirects reads to MEDIA_PUBLIC_URL
+# (a CDN in front of the bucket). Anything else is imported as
+# 'module:Class' and built with the app config.
+
+# Only thumbnails are public; originals are kept for regenerating them
+PUBLIC_KEY = re.compile(r'thumbs/[0-9a-f]{2}/[0-9a-f]{64}-[0-9]+\.jpg')
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+IMMUTABLE_CACHE_CONTROL = f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+# Leading bytes of the formats Pillow is allowed to decode
+SIGNATURES = {
+    b'\x89PNG\r\n\x1a\n': 'PNG',
+    b'\xff\xd8\xff': 'JPEG',
+    b'GIF87a': 'GIF',
+    b'GIF89a': 'GIF',
+}
+
+
+class MediaBusy(Exception):
+    pass
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class UnsupportedImage(Exception):
+    pass
+
+
+def original_key(digest):
+    return f"originals/{digest[:2]}/{digest}"
+
+
+def thumbnail_key(digest, size):
+    return f"thumbs/{digest[:2]}/{digest}-{size}.jpg"
+
+
+def sniff_format(head):
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'WEBP'
+    for signature, image_format in SIGNATURES.items():
+        if head.startswith(signature):
+            return image_format
+    return None
+
+
+class LocalMediaStorage:
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        # On the same filesystem as root, so moving a finished file in is atomic
+        self.tmp_dir = os.path.join(self.root, 'tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def exists(self, key):
+        return os.path.exists(os.path.join(self.root, key))
+
+    # Move a finished file into place; a concurrent upload of the same key
+    # writes identical bytes, so the last rename winning is fine
+    def put(self, key, path, content_type):
+        target = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+
+    def serve(self, key, max_age):
+        # send_file answers Range, If-Range and If-None-Match; the key makes
+        # an ETag that every server agrees on
+        response = send_from_directory(self.root, key, max_age=max_age, conditional=True,
+                                       etag=os.path.basename(key).rsplit('.', 1)[0])
+        response.accept_ranges = 'bytes'
+        return response
+
+
+class S3MediaStorage:
+    def __init__(self, client, bucket, public_url, prefix=''):
+        self.client = client
+        self.bucket = bucket
+        self.public_url = public_url.rstrip('/')
+        self.prefix = prefix
+        self.tmp_dir = tempfile.gettempdir()
+
+    def exists(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.prefix + key)
+            return True
+        except ClientError:
+            return False
+
+    def put(self, key, path, content_type):
+        self.client.upload_file(path, self.bucket, self.prefix + key, ExtraArgs={
+            'ContentType': content_type,
+            'CacheControl': IMMUTABLE_CACHE_CONTROL,
+        })
+        os.remove(path)
+
+    # The CDN serves the bytes (and ranges); the redirect itself is as
+    # immutable as the key
+    def serve(self, key, max_age):
+        response = redirect(f"{self.public_url}/{self.prefix}{key}", code=301)
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+        return response
+
+
+def create_media_storage(config):
+    backend = config.get('MEDIA_BACKEND', 'local')
+    if backend == 'local':
+        return LocalMediaStorage(config['MEDIA_ROOT'])
+    if backend == 's3':
+        import boto3  # Only needed when the s3 backend is configured
+        return S3MediaStorage(boto3.client('s3'), config['MEDIA_S3_BUCKET'], config['MEDIA_PUBLIC_URL'],
+                              prefix=config.get('MEDIA_S3_PREFIX', ''))
+    if ':' in backend:
+        import importlib
+        module_name, _, class_name = backend.partition(':')
+        return getattr(importlib.import_module(module_name), class_name)(config)
+    raise ValueError(f"Unknown MEDIA_BACKEND: {backend}")
+
+
+# Worker-side function; must be module level so it can be pickled. Writes
+# one square JPEG per size next to `source` and returns their paths
+def _make_thumbnails(source, sizes, max_pixels, quality):
+    from PIL import Image, ImageOps  # Only needed where thumbnails are made
+
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    outputs = []
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', Image.DecompressionBombWarning)
+            with Image.open(source) as image:
+                if image.format not in ('PNG', 'JPEG', 'GIF', 'WEBP'):
+                    raise UnsupportedImage(f"Unsupported image format {image.format}")
+                # JPEGs decode straight at a fraction of full size
+                image.draft('RGB', (max(sizes), max(sizes)))
+                image = ImageOps.exif_transpose(image)
+                if image.mode != 'RGB':
+                    background = Image.new('RGB', image.size, (255, 255, 255))
+                    rgba = image.convert('RGBA')
+                    background.paste(rgba, mask=rgba.getchannel('A'))
+                    image = background
+                for size in sorted(sizes, reverse=True):
+                    output = f"{source}-{size}.jpg"
+                    ImageOps.fit(image, (size, size), Image.LANCZOS).save(output, 'JPEG', quality=quality,
+                                                                         optimize=True, progressive=True)
+                    outputs.append((size, output))
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError, Image.DecompressionBombWarning) as e:
+        for _, output in outputs:
+            os.remove(output)
+        raise UnsupportedImage(f"Not a valid image: {e}")
+    return outputs
+
+
+def _remove_thumbnails(source, sizes):
+    for size in sizes:
+        try:
+            os.remove(f"{source}-{size}.jpg")
+        except FileNotFoundError:
+            pass
+
+
+class ThumbnailPool:
+    def __init__(self, workers=None, queue_size=16, timeout=30):
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max(self.workers, 1) + queue_size)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    # Pools do not survive fork, so each worker process builds its own lazily
+    def _get_executor(self):
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                    self._pid = os.getpid()
+        return self._executor
+
+    # Returns [(size, path)], or raises UnsupportedImage or MediaBusy
+    def make_thumbnails(self, source, sizes, max_pixels, quality):
+        # workers == 0 runs inline, which is what tests and scripts want
+        if self.workers == 0:
+            return _make_thumbnails(source, sizes, max_pixels, quality)
+
+        if not self._slots.acquire(blocking=False):
+            raise MediaBusy("Thumbnail queue is full")
+        try:
+            future = self._get_executor().submit(_make_thumbnails, source, sizes, max_pixels, quality)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            # A task that already started can't be cancelled and still
+            # writes its thumbnails after the caller has cleaned up, so
+            # delete them once it finishes (now, if it already has)
+            if not future.cancel():
+                future.add_done_callback(lambda _: _remove_thumbnails(source, sizes))
+            raise MediaBusy("Thumbnail generation timed out")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+_media_lock = threading.Lock()
+
+
+def get_media_storage():
+    app = current_app._get_current_object()
+    storage = app.extensions.get('media_storage')
+    if storage is None:
+        with _media_lock:
+            storage = app.extensions.get('media_storage')
+            if storage is None:
+                storage = app.extensions['media_storage'] = create_media_storage(app.config)
+    return storage
+
+
+def get_thumbnail_pool():
+    app = current_app._get_current_object()
+    pool = app.extensions.get('thumbnail_pool')
+    if pool is None:
+        with _media_lock:
+            pool = app.extensions.get('thumbnail_pool')
+            if pool is None:
+                pool = app.extensions['thumbnail_pool'] = ThumbnailPool(
+                    workers=app.config.get('MEDIA_WORKERS'),
+                    queue_size=app.config.get('MEDIA_QUEUE_SIZE', 16),
+                    timeout=app.config.get('MEDIA_TIMEOUT', 30)
+                )
+    return pool
+
+
+# Copy `stream` to a temporary file in the storage's tmp_dir, hashing it on
+# the way; returns (path, sha256 hex digest, sniffed format)
+def spool_upload(stream, storage, max_bytes, chunk_size=64 * 1024):
+    fd, path = tempfile.mkstemp(dir=storage.tmp_dir, prefix='upload-')
+    digest = hashlib.sha256()
+    size = 0
+    image_format = None
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                if image_format is None:
+                    image_format = sniff_format(chunk[:16])
+                    if image_format is None:
+                        raise UnsupportedImage("Upload a PNG, JPEG, GIF or WebP image")
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"Images may be at most {max_bytes} bytes")
+                digest.update(chunk)
+                f.write(chunk)
+        if not size:
+            raise UnsupportedImage("The request body is empty; send the image as the body")
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, digest.hexdigest(), image_format
+
+
+# Store an uploaded image and its thumbnails unless they already exist;
+# returns {size: thumbnail key}
+def store_avatar(stream):
+    config = current_app.config
+    storage = get_media_storage()
+    sizes = config.get('MEDIA_THUMBNAIL_SIZES', (64, 256))
+    path, digest, image_format = spool_upload(stream, storage, config.get('MEDIA_MAX_UPLOAD_BYTES', 10 * 1024 * 1024),
+                                              config.get('MEDIA_CHUNK_SIZE', 64 * 1024))
+    keys = {size: thumbnail_key(digest, size) for size in sizes}
+    thumbnails = []
+    try:
+        # Thumbnails are stored last and largest last, so if the largest
+        # exists everything does
+        if storage.exists(keys[max(sizes)]):
+            return keys
+        thumbnails = get_thumbnail_pool().make_thumbnails(path, sizes, config.get('MEDIA_MAX_PIXELS', 40_000_000),
+                                                          config.get('MEDIA_JPEG_QUALITY', 85))
+        storage.put(original_key(digest), path, f"image/{image_format.lower()}")
+        for size, thumbnail in sorted(thumbnails):
+            storage.put(keys[size], thumbnail, 'image/jpeg')
+        return keys
+    finally:
+        for leftover in [path] + [thumbnail for _, thumbnail in thumbnails]:
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+
+# None for keys that aren't public
+def serve_media(key):
+    if not PUBLIC_KEY.fullmatch(key):
+        return None
+    response = get_media_storage().serve(key, IMMUTABLE_MAX_AGE)
+    response.cache_control.immutable = True
+    return response
@@ -0,0 +1,257 @@
+import bisect
+import logging
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+
+from models import db
+
+# Request and SQL instrumentation exported in Prometheus text format.
+#
+# Every request records its latency, statement count and database time per
+# endpoint. Statements are counted through engine events, and a request that
+# runs the same statement shape more than N_PLUS_ONE_THRESHOLD times is
+# logged as a likely N+1. Pool checkout wait and pool occupancy are exported
+# per bind too. Everything is kept in plain per-process counters behind one lock, so
+# with several gunicorn workers each one serves its own /metrics.
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# Collapse expanded IN lists and literals so "same query, different ids" match
+_SHAPE_PATTERNS = [
+    (re.compile(r"\(\s*(?:\?|%\(\w+\)s|%s|:\w+)(?:\s*,\s*(?:\?|%\(\w+\)s|%s|:\w+))*\s*\)"), '(?)'),
+    (re.compile(r"\b\d+\b"), '0'),
+    (re.compile(r"\s+"), ' '),
+]
+
+
+def statement_shape(statement):
+    for pattern, replacement in _SHAPE_PATTERNS:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.histograms = {}
+        self.gauge_callbacks = []
+        self.counter_callbacks = []
+
+    def inc(self, name, labels=(), value=1):
+        with self._lock:
+            self.counters[(name, labels)] += value
+
+    def observe(self, name, labels, value, buckets):
+        with self._lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = self.histograms[(name, labels)] = Histogram(buckets)
+            histogram.observe(value)
+
+    # callback() -> iterable of (name, labels, value), evaluated at scrape time
+    def add_gauges(self, callback):
+        self.gauge_callbacks.append(callback)
+
+    # Same, for totals something else keeps (values must only go up)
+    def add_counters(self, callback):
+        self.counter_callbacks.append(callback)
+
+    def render(self):
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = [(key, list(h.counts), h.total, h.count, h.buckets)
+                          for key, h in sorted(self.histograms.items(), key=lambda item: item[0])]
+
+        lines, typed = [], set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            declare(name, 'counter')
+            lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        for (name, labels), counts, total, count, buckets in histograms:
+            declare(name, 'histogram')
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                lines.append(f"{name}_bucket{_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(total)}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+        for callback in self.counter_callbacks:
+            for name, labels, value in callback():
+                declare(name, 'counter')
+                lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        for callback in self.gauge_callbacks:
+            for name, labels, value in callback():
+                declare(name, 'gauge')
+                lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+# Exact, unlike {:g}, which keeps 6 significant digits: a counter past
+# 999999 would print as 1.23457e+06 and look stalled to rate()
+def _number(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+def get_registry():
+    return current_app.extensions['metrics']
+
+
+# Engine hooks: per-statement timing attributed to the current request
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+    if context is not None:
+        context.metrics_timing = True
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    if context is not None:
+        context.metrics_timing = False
+    if has_request_context() and 'metrics_statements' in g:
+        g.metrics_statements += 1
+        g.metrics_db_time += elapsed
+        # An executemany is one batched call, however the driver splits it up
+        if not executemany:
+            g.metrics_shapes[statement_shape(statement)] += 1
+
+
+# A failed statement never reaches after_cursor_execute; drop its start time
+# or the connection's stack grows for as long as the pool keeps it
+def _handle_error(exception_context):
+    context = exception_context.execution_context
+    if context is not None and getattr(context, 'metrics_timing', False):
+        context.metrics_timing = False
+        exception_context.connection.info['query_start'].pop()
+
+
+# SQLAlchemy has no "checkout started" event, so time Pool.connect directly
+def _wrap_pool_connect(engine, registry, labels):
+    connect = engine.pool.connect
+
+    def timed_connect():
+        started = time.perf_counter()
+        try:
+            return connect()
+        finally:
+            registry.observe('db_pool_checkout_wait_seconds', labels, time.perf_counter() - started, LATENCY_BUCKETS)
+
+    engine.pool.connect = timed_connect
+
+
+def _instrument_pool(engine, registry, bind):
+    labels = (('bind', bind),)
+    _wrap_pool_connect(engine, registry, labels)
+    # dispose() swaps in a fresh pool; wrap that one too
+    event.listen(engine, 'engine_disposed', lambda conn: _wrap_pool_connect(engine, registry, labels))
+
+    def pool_gauges():
+        pool = engine.pool
+        if hasattr(pool, 'checkedout'):
+            yield 'db_pool_checked_out', labels, pool.checkedout()
+            yield 'db_pool_checked_in', labels, pool.checkedin()
+            yield 'db_pool_size', labels, pool.size()
+            yield 'db_pool_overflow', labels, pool.overflow()
+
+    registry.add_gauges(pool_gauges)
+
+
+def _before_request():
+    g.metrics_started = time.perf_counter()
+    g.metrics_statements = 0
+    g.metrics_db_time = 0.0
+    g.metrics_shapes = Counter()
+
+
+def _after_request(response):
+    if 'metrics_started' not in g:
+        return response
+    registry = get_registry()
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    labels = (('endpoint', endpoint), ('method', request.method))
+
+    registry.observe('http_request_duration_seconds', labels,
+                     time.perf_counter() - g.metrics_started, LATENCY_BUCKETS)
+    registry.observe('db_statements_per_request', labels, g.metrics_statements, STATEMENT_BUCKETS)
+    registry.observe('db_time_per_request_seconds', labels, g.metrics_db_time, LATENCY_BUCKETS)
+    registry.inc('http_requests_total', labels + (('status', str(response.status_code)),))
+
+    threshold = current_app.config.get('N_PLUS_ONE_THRESHOLD', 10)
+    for shape, count in g.metrics_shapes.items():
+        if count > threshold:
+            registry.inc('db_n_plus_one_total', labels)
+            logger.warning("Possible N+1 on %s %s: statement ran %d times: %s",
+                           request.method, endpoint, count, shape[:200])
+    return response
+
+
+def metrics_view():
+    return Response(get_registry().render(), mimetype='text/plain; version=0.0.4')
+
+
+def init_metrics(app):
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+    registry = app.extensions['metrics'] = MetricsRegistry()
+
+    # The primary is labelled bind="default", replicas by their bind key
+    with app.app_context():
+        engines = db.engines
+    for key, engine in engines.items():
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(engine, 'handle_error', _handle_error)
+        _instrument_pool(engine, registry, key or 'default')
+
+    def identity_counters():
+        cache = app.extensions.get('identity_cache')
+        if cache is not None:
+            stats = cache.stats()
+            yield 'identity_cache_hits_total', (), stats['hits']
+            yield 'identity_cache_misses_total', (), stats['misses']
+
+    def identity_gauges():
+        cache = app.extensions.get('identity_cache')
+        if cache is not None:
+            yield 'identity_cache_size', (), cache.stats()['size']
+
+    registry.add_counters(identity_counters)
+    registry.add_gauges(identity_gauges)
+
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
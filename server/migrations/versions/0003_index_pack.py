@@ -0,0 +1,59 @@
+"""index pack for hot access paths
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 08:53:47.698437
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+# (name, table, columns, extra kwargs) - see the matching __table_args__ in models.py
+INDEXES = [
+    ('ix_friendship_followed_id_follower_id', 'friendship', ['followed_id', 'follower_id'], {}),
+    ('ix_notification_user_id_created_at_id', 'notification', ['user_id', 'created_at', 'id'], {}),
+    ('ix_notification_unread', 'notification', ['user_id', 'created_at', 'id'],
+     {'postgresql_where': sa.text('read = false'), 'sqlite_where': sa.text('read = 0')}),
+    ('ix_post_user_id_id', 'post', ['user_id', 'id'], {}),
+]
+
+
+def upgrade():
+    is_postgres = op.get_bind().dialect.name == 'postgresql'
+
+    # Drop duplicate follows left behind by the old check-then-insert race
+    op.execute(
+        'DELETE FROM friendship WHERE id NOT IN '
+        '(SELECT MIN(id) FROM friendship GROUP BY follower_id, followed_id)'
+    )
+
+    if is_postgres:
+        # Build indexes without blocking writes on large tables, then promote
+        # the unique index to the constraint
+        with op.get_context().autocommit_block():
+            for name, table, columns, kwargs in INDEXES:
+                op.create_index(name, table, columns, unique=False, postgresql_concurrently=True, **kwargs)
+            op.create_index('uq_friendship_follower_followed', 'friendship', ['follower_id', 'followed_id'],
+                            unique=True, postgresql_concurrently=True)
+        op.execute('ALTER TABLE friendship ADD CONSTRAINT uq_friendship_follower_followed '
+                   'UNIQUE USING INDEX uq_friendship_follower_followed')
+    else:
+        for name, table, columns, kwargs in INDEXES:
+            op.create_index(name, table, columns, unique=False, **kwargs)
+        with op.batch_alter_table('friendship') as batch_op:
+            batch_op.create_unique_constraint('uq_friendship_follower_followed', ['follower_id', 'followed_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('friendship') as batch_op:
+        batch_op.drop_constraint('uq_friendship_follower_followed', type_='unique')
+    for name, table, columns, kwargs in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,125 @@
+"""full-text search and hashtags
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 11:20:05.512903
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+# Kept in step with POSTGRES_DDL / SQLITE_DDL in search.py. The tsvector
+# columns are trigger-maintained so adding them doesn't rewrite the table;
+# existing rows are filled in afterwards by reindex.py.
+POST_VECTOR = ("setweight(to_tsvector('english', coalesce(NEW.title, '')), 'A') || "
+               "setweight(to_tsvector('english', coalesce(NEW.content, '')), 'B')")
+USER_VECTOR = ("setweight(to_tsvector('simple', coalesce(NEW.username, '')), 'A') || "
+               "setweight(to_tsvector('english', coalesce(NEW.bio, '')), 'B')")
+
+POSTGRES_UPGRADE = [
+    "ALTER TABLE post ADD COLUMN search_vector tsvector",
+    "CREATE FUNCTION post_search_vector_update() RETURNS trigger AS $$ BEGIN "
+    f"NEW.search_vector := {POST_VECTOR}; RETURN NEW; END $$ LANGUAGE plpgsql",
+    "CREATE TRIGGER post_search_vector_trigger BEFORE INSERT OR UPDATE OF title, content ON post "
+    "FOR EACH ROW EXECUTE FUNCTION post_search_vector_update()",
+    'ALTER TABLE "user" ADD COLUMN search_vector tsvector',
+    "CREATE FUNCTION user_search_vector_update() RETURNS trigger AS $$ BEGIN "
+    f"NEW.search_vector := {USER_VECTOR}; RETURN NEW; END $$ LANGUAGE plpgsql",
+    'CREATE TRIGGER user_search_vector_trigger BEFORE INSERT OR UPDATE OF username, bio ON "user" '
+    "FOR EACH ROW EXECUTE FUNCTION user_search_vector_update()",
+]
+
+POSTGRES_DOWNGRADE = [
+    "DROP INDEX IF EXISTS ix_user_search_vector",
+    "DROP INDEX IF EXISTS ix_post_search_vector",
+    'DROP TRIGGER IF EXISTS user_search_vector_trigger ON "user"',
+    "DROP FUNCTION IF EXISTS user_search_vector_update()",
+    'ALTER TABLE "user" DROP COLUMN IF EXISTS search_vector',
+    "DROP TRIGGER IF EXISTS post_search_vector_trigger ON post",
+    "DROP FUNCTION IF EXISTS post_search_vector_update()",
+    "ALTER TABLE post DROP COLUMN IF EXISTS search_vector",
+]
+
+SQLITE_UPGRADE = [
+    "CREATE VIRTUAL TABLE post_fts USING fts5(title, content, content='post', content_rowid='id')",
+    "CREATE TRIGGER post_fts_ai AFTER INSERT ON post BEGIN "
+    "INSERT INTO post_fts(rowid, title, content) VALUES (new.id, new.title, new.content); END",
+    "CREATE TRIGGER post_fts_ad AFTER DELETE ON post BEGIN "
+    "INSERT INTO post_fts(post_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content); END",
+    "CREATE TRIGGER post_fts_au AFTER UPDATE OF title, content ON post BEGIN "
+    "INSERT INTO post_fts(post_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content); "
+    "INSERT INTO post_fts(rowid, title, content) VALUES (new.id, new.title, new.content); END",
+    "CREATE VIRTUAL TABLE user_fts USING fts5(username, bio, content='user', content_rowid='id')",
+    'CREATE TRIGGER user_fts_ai AFTER INSERT ON "user" BEGIN '
+    "INSERT INTO user_fts(rowid, username, bio) VALUES (new.id, new.username, new.bio); END",
+    'CREATE TRIGGER user_fts_ad AFTER DELETE ON "user" BEGIN '
+    "INSERT INTO user_fts(user_fts, rowid, username, bio) VALUES ('delete', old.id, old.username, old.bio); END",
+    'CREATE TRIGGER user_fts_au AFTER UPDATE OF username, bio ON "user" BEGIN '
+    "INSERT INTO user_fts(user_fts, rowid, username, bio) VALUES ('delete', old.id, old.username, old.bio); "
+    "INSERT INTO user_fts(rowid, username, bio) VALUES (new.id, new.username, new.bio); END",
+    # External-content tables start empty; index the rows that already exist
+    "INSERT INTO post_fts(post_fts) VALUES('rebuild')",
+    "INSERT INTO user_fts(user_fts) VALUES('rebuild')",
+]
+
+SQLITE_DOWNGRADE = [
+    "DROP TRIGGER IF EXISTS user_fts_au",
+    "DROP TRIGGER IF EXISTS user_fts_ad",
+    "DROP TRIGGER IF EXISTS user_fts_ai",
+    "DROP TABLE IF EXISTS user_fts",
+    "DROP TRIGGER IF EXISTS post_fts_au",
+    "DROP TRIGGER IF EXISTS post_fts_ad",
+    "DROP TRIGGER IF EXISTS post_fts_ai",
+    "DROP TABLE IF EXISTS post_fts",
+]
+
+
+def upgrade():
+    op.create_table('hashtag',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.create_table('post_hashtag',
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('hashtag_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['hashtag_id'], ['hashtag.id'], ),
+    sa.ForeignKeyConstraint(['post_id'], ['post.id'], ),
+    sa.PrimaryKeyConstraint('post_id', 'hashtag_id')
+    )
+    with op.batch_alter_table('post_hashtag', schema=None) as batch_op:
+        batch_op.create_index('ix_post_hashtag_hashtag_id_post_id', ['hashtag_id', 'post_id'], unique=False)
+
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        for statement in POSTGRES_UPGRADE:
+            op.execute(statement)
+        # GIN builds are slow on big tables; don't hold a write lock for them
+        with op.get_context().autocommit_block():
+            op.execute('CREATE INDEX CONCURRENTLY ix_post_search_vector ON post USING gin (search_vector)')
+            op.execute('CREATE INDEX CONCURRENTLY ix_user_search_vector ON "user" USING gin (search_vector)')
+    elif dialect == 'sqlite':
+        for statement in SQLITE_UPGRADE:
+            op.execute(statement)
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    statements = {'postgresql': POSTGRES_DOWNGRADE, 'sqlite': SQLITE_DOWNGRADE}.get(dialect, [])
+    for statement in statements:
+        op.execute(statement)
+
+    with op.batch_alter_table('post_hashtag', schema=None) as batch_op:
+        batch_op.drop_index('ix_post_hashtag_hashtag_id_post_id')
+    op.drop_table('post_hashtag')
+    op.drop_table('hashtag')
@@ -0,0 +1,158 @@
+"""monthly notification partitions
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18 14:02:37.415208
+
+"""
+import re
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+
+# Kept in step with partitions.py. On Postgres notification becomes a table
+# partitioned by RANGE (created_at) with a DEFAULT partition; elsewhere its
+# rows move into one notification_pYYYY_MM table per month, notification
+# stays as an empty parent and ids come from the notification_id_seq table.
+# Either way partitions exist from the oldest row's month through
+# PARTITIONS_AHEAD months past now. Existing rows are copied with one
+# INSERT ... SELECT (per month off Postgres) while the table is locked, so
+# run this in a maintenance window on a large install.
+PARTITIONS_AHEAD = 2
+PARTITION_NAME = re.compile(r'notification_p(\d{4})_(\d{2})')
+
+
+def _next_month(start):
+    return datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+
+
+# Month starts from first's month through PARTITIONS_AHEAD months past now
+def _months(first, now):
+    start = datetime(first.year, first.month, 1)
+    end = datetime(now.year, now.month, 1)
+    for _ in range(PARTITIONS_AHEAD):
+        end = _next_month(end)
+    months = []
+    while start <= end:
+        months.append(start)
+        start = _next_month(start)
+    return months
+
+
+def _create_notification_table(name, primary_key, created_at_nullable, **kw):
+    op.create_table(name,
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('message', sa.String(length=500), nullable=False),
+    sa.Column('read', sa.Boolean(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=created_at_nullable),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint(*primary_key),
+    **kw
+    )
+
+
+def _create_indexes(table, retention=True):
+    op.create_index(f'ix_{table}_user_id_created_at_id', table, ['user_id', 'created_at', 'id'], unique=False)
+    op.create_index(f'ix_{table}_unread', table, ['user_id', 'created_at', 'id'], unique=False,
+                    postgresql_where=sa.text('read = false'), sqlite_where=sa.text('read = 0'))
+    if retention:
+        op.create_index(f'ix_{table}_read_created_at', table, ['created_at'], unique=False,
+                        postgresql_where=sa.text('read = true'), sqlite_where=sa.text('read = 1'))
+
+
+def _upgrade_postgres(bind, now):
+    op.execute("UPDATE notification SET created_at = now() AT TIME ZONE 'utc' WHERE created_at IS NULL")
+    first = bind.execute(sa.text('SELECT min(created_at) FROM notification')).scalar() or now
+    op.drop_index('ix_notification_unread', table_name='notification')
+    op.drop_index('ix_notification_user_id_created_at_id', table_name='notification')
+    op.rename_table('notification', 'notification_legacy')
+    op.execute('ALTER TABLE notification_legacy RENAME CONSTRAINT notification_pkey TO notification_legacy_pkey')
+
+    _create_notification_table('notification', ['id', 'created_at'], False,
+                               postgresql_partition_by='RANGE (created_at)')
+    # The old serial's sequence carries on numbering the new table
+    op.execute('ALTER SEQUENCE notification_id_seq OWNED BY notification.id')
+    op.execute("ALTER TABLE notification ALTER COLUMN id SET DEFAULT nextval('notification_id_seq')")
+    _create_indexes('notification')
+    for start in _months(first, now):
+        op.execute(f"CREATE TABLE notification_p{start:%Y_%m} PARTITION OF notification "
+                   f"FOR VALUES FROM ('{start.isoformat()}') TO ('{_next_month(start).isoformat()}')")
+    op.execute('CREATE TABLE notification_default PARTITION OF notification DEFAULT')
+
+    op.execute('INSERT INTO notification (id, user_id, message, read, created_at) '
+               'SELECT id, user_id, message, read, created_at FROM notification_legacy')
+    op.drop_table('notification_legacy')
+
+
+def _upgrade_other(bind, now):
+    op.execute("UPDATE notification SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL")
+    op.create_table('notification_id_seq',
+    sa.Column('value', sa.Integer(), nullable=False)
+    )
+    op.execute('INSERT INTO notification_id_seq (value) SELECT coalesce(max(id), 0) FROM notification')
+
+    first = bind.execute(sa.text('SELECT min(created_at) FROM notification')).scalar()
+    first = datetime.fromisoformat(str(first)) if first is not None else now
+    for start in _months(first, now):
+        name = f'notification_p{start:%Y_%m}'
+        _create_notification_table(name, ['id'], False)
+        _create_indexes(name)
+        bind.execute(sa.text(
+            f'INSERT INTO {name} (id, user_id, message, read, created_at) '
+            'SELECT id, user_id, message, read, created_at FROM notification '
+            'WHERE created_at >= :start AND created_at < :end'
+        ), {"start": start.isoformat(' '), "end": _next_month(start).isoformat(' ')})
+
+    op.drop_index('ix_notification_unread', table_name='notification')
+    op.drop_index('ix_notification_user_id_created_at_id', table_name='notification')
+    op.drop_table('notification')
+    _create_notification_table('notification', ['id', 'created_at'], False)
+    _create_indexes('notification')
+
+
+def upgrade():
+    bind = op.get_bind()
+    now = datetime.utcnow()
+    if bind.dialect.name == 'postgresql':
+        _upgrade_postgres(bind, now)
+    else:
+        _upgrade_other(bind, now)
+
+
+def downgrade():
+    bind = op.get_bind()
+    for index in ('read_created_at', 'unread', 'user_id_created_at_id'):
+        op.drop_index(f'ix_notification_{index}', table_name='notification')
+    op.rename_table('notification', 'notification_partitioned')
+    if bind.dialect.name == 'postgresql':
+        op.execute('ALTER TABLE notification_partitioned RENAME CONSTRAINT notification_pkey '
+                   'TO notification_partitioned_pkey')
+        sources = ['notification_partitioned']
+    else:
+        sources = sorted(name for name in sa.inspect(bind).get_table_names() if PARTITION_NAME.fullmatch(name))
+
+    _create_notification_table('notification', ['id'], True)
+    if bind.dialect.name == 'postgresql':
+        op.execute('ALTER SEQUENCE notification_id_seq OWNED BY notification.id')
+        op.execute("ALTER TABLE notification ALTER COLUMN id SET DEFAULT nextval('notification_id_seq')")
+    for source in sources:
+        op.execute(f'INSERT INTO notification (id, user_id, message, read, created_at) '
+                   f'SELECT id, user_id, message, read, created_at FROM {source}')
+    _create_indexes('notification', retention=False)
+
+    # Dropping the parent drops its partitions on Postgres
+    op.drop_table('notification_partitioned')
+    if bind.dialect.name != 'postgresql':
+        for source in sources:
+            op.drop_table(source)
+        op.drop_table('notification_id_seq')
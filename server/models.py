@@ -1,9 +1,11 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from datetime import datetime
+from hashing import get_password_hasher
+from replicas import RoutingSession
 
-# Initialize database and bcrypt instances
-db = SQLAlchemy()
+# Initialize database and bcrypt instances; reads may go to a replica (see replicas.py)
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 bcrypt = Bcrypt()
 
 # User Model
@@ -13,18 +15,27 @@ class User(db.Model):
     _password_hash = db.Column(db.String(128), nullable=False)
     image_url = db.Column(db.String(255), nullable=True, default='https://via.placeholder.com/150')
     bio = db.Column(db.String(500), nullable=True)
+    # Maintained by notifications.py so badge polling never scans notification;
+    # the version goes up on every change, for conditional GETs
+    unread_notifications = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    notifications_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Profile stats, maintained by counters.py; hot accounts also have UserCounterShard rows
+    follower_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    following_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    post_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     posts = db.relationship('Post', backref='author', lazy=True)
 
     @property
     def password(self):
         raise AttributeError('Password is not accessible')
 
+    # Hashing runs in the shared worker pool; may raise hashing.HasherBusy
     @password.setter
     def password(self, password):
-        self._password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+        self._password_hash = get_password_hasher().hash(password)
 
     def check_password(self, password):
-        return bcrypt.check_password_hash(self._password_hash, password)
+        return get_password_hasher().verify(self._password_hash, password)
 
     def __repr__(self):
         return f"<User {self.username}>"
@@ -36,10 +47,41 @@ class Post(db.Model):
     content = db.Column(db.Text, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Maintained by likes.py; viral posts also have PostLikeShard rows
+    like_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    __table_args__ = (
+        # Global feed: ORDER BY created_at DESC, id DESC
+        db.Index('ix_post_created_at_id', 'created_at', 'id'),
+        # An author's recent posts (timeline backfill/prune, celebrity merge)
+        db.Index('ix_post_user_id_id', 'user_id', 'id'),
+    )
 
     def __repr__(self):
         return f"<Post {self.title}>"
 
+# Hashtags (For search), extracted from post content when a post is created
+class Hashtag(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), unique=True, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<Hashtag #{self.name}>"
+
+class PostHashtag(db.Model):
+    __tablename__ = 'post_hashtag'
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), primary_key=True)
+    hashtag_id = db.Column(db.Integer, db.ForeignKey('hashtag.id'), primary_key=True)
+
+    __table_args__ = (
+        # Posts for a tag, newest first
+        db.Index('ix_post_hashtag_hashtag_id_post_id', 'hashtag_id', 'post_id'),
+    )
+
+    def __repr__(self):
+        return f"<PostHashtag {self.post_id} #{self.hashtag_id}>"
+
 # Friendships (For social networking)
 # This table allows users to follow each other
 class Friendship(db.Model):
@@ -51,18 +93,140 @@ class Friendship(db.Model):
     follower = db.relationship('User', foreign_keys=[follower_id], backref=db.backref('following', lazy='dynamic'))
     followed = db.relationship('User', foreign_keys=[followed_id], backref=db.backref('followers', lazy='dynamic'))
 
+    __table_args__ = (
+        # One row per follow; also serves "who does X follow" lookups
+        db.UniqueConstraint('follower_id', 'followed_id', name='uq_friendship_follower_followed'),
+        # "Who follows X" for fan-out
+        db.Index('ix_friendship_followed_id_follower_id', 'followed_id', 'follower_id'),
+    )
+
     def __repr__(self):
         return f"<Friendship {self.follower_id} -> {self.followed_id}>"
 
-# Notifications (For real-time notifications)
-class Notification(db.Model):
+# Unfollows, for workers catching their follow graphs up (see follow_graph.py)
+class FriendshipDeletion(db.Model):
+    __tablename__ = 'friendship_deletion'
     id = db.Column(db.Integer, primary_key=True)
+    follower_id = db.Column(db.Integer, nullable=False)
+    followed_id = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Pruning past the retention period
+        db.Index('ix_friendship_deletion_deleted_at', 'deleted_at'),
+        # Ids are high-water marks, so SQLite must not reuse them once pruned
+        {'sqlite_autoincrement': True},
+    )
+
+    def __repr__(self):
+        return f"<FriendshipDeletion {self.follower_id} -> {self.followed_id}>"
+
+# Spread increments to a hot account's counter over several rows
+class UserCounterShard(db.Model):
+    __tablename__ = 'user_counter_shard'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    name = db.Column(db.String(32), primary_key=True)
+    shard = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    def __repr__(self):
+        return f"<UserCounterShard {self.user_id} {self.name}[{self.shard}]={self.value}>"
+
+# One row per like; liking twice is a no-op
+class Like(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), primary_key=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Who liked a post
+        db.Index('ix_like_post_id_user_id', 'post_id', 'user_id'),
+    )
+
+    def __repr__(self):
+        return f"<Like {self.user_id} -> {self.post_id}>"
+
+# Spread like_count increments of a viral post over several rows
+class PostLikeShard(db.Model):
+    __tablename__ = 'post_like_shard'
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), primary_key=True)
+    shard = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    def __repr__(self):
+        return f"<PostLikeShard {self.post_id}[{self.shard}]={self.value}>"
+
+# Time-decayed like scores of recent posts (see likes.py)
+class TrendingPost(db.Model):
+    __tablename__ = 'trending_post'
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), primary_key=True)
+    score = db.Column(db.Float, nullable=False)
+    # The post's created_at, so the window can be pruned without a join
+    created_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        # Trending: ORDER BY score DESC, post_id DESC
+        db.Index('ix_trending_post_score_post_id', 'score', 'post_id'),
+        # Dropping posts that left the window
+        db.Index('ix_trending_post_created_at', 'created_at'),
+    )
+
+    def __repr__(self):
+        return f"<TrendingPost {self.post_id} {self.score:.3f}>"
+
+# Notifications (For real-time notifications). Partitioned by month of
+# created_at, which is why it is part of the primary key; on SQLite the rows
+# live in per-month tables and this one stays empty (see partitions.py)
+class Notification(db.Model):
+    id = db.Column(db.Integer, db.Sequence('notification_id_seq'), primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     message = db.Column(db.String(500), nullable=False)
     read = db.Column(db.Boolean, default=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, primary_key=True, default=datetime.utcnow)
 
-    user = db.relationship('User', backref=db.backref('notifications', lazy=True))
+    user = db.relationship('User')
+
+    __table_args__ = (
+        # A user's notifications, newest first
+        db.Index('ix_notification_user_id_created_at_id', 'user_id', 'created_at', 'id'),
+        # Unread listing and mark-read only ever touch unread rows
+        db.Index('ix_notification_unread', 'user_id', 'created_at', 'id',
+                 postgresql_where=db.text('read = false'),
+                 sqlite_where=db.text('read = 0')),
+        # Retention purges of old read rows, oldest first
+        db.Index('ix_notification_read_created_at', 'created_at',
+                 postgresql_where=db.text('read = true'),
+                 sqlite_where=db.text('read = 1')),
+        {'postgresql_partition_by': 'RANGE (created_at)'},
+    )
 
     def __repr__(self):
         return f"<Notification {self.message}>"
+
+# Background jobs (see jobs.py)
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    # A second enqueue with the same key is dropped while this row is kept
+    idempotency_key = db.Column(db.String(255), unique=True)
+    status = db.Column(db.String(16), nullable=False, default='pending', server_default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    max_attempts = db.Column(db.Integer, nullable=False, default=5, server_default='5')
+    # Pending: when it may run next; running: when its lease runs out
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        # Claiming only ever looks at runnable rows, soonest due first
+        db.Index('ix_job_runnable', 'run_at', 'id',
+                 postgresql_where=db.text("status IN ('pending', 'running')"),
+                 sqlite_where=db.text("status IN ('pending', 'running')")),
+        # Purging finished jobs and counting failed ones
+        db.Index('ix_job_status_finished_at', 'status', 'finished_at'),
+    )
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.kind} {self.status}>"
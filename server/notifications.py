@@ -0,0 +1,203 @@
+from collections import Counter
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import bindparam, delete, event, select, update
+
+from jobs import enqueue, periodic_job
+from models import db, User, Notification
+from pagination import decode_cursor, keyset_filter, paginate_rows
+from partitions import (drop_partition, ensure_partitions, insert_notifications, list_partitions, next_period,
+                        notification_tables, partition_table)
+from realtime import push_after_commit
+
+# Set-based notification writes with a maintained unread counter.
+#
+# User.unread_notifications is kept in step with the notification table so
+# badge polling is a single primary-key read, and User.notifications_version
+# goes up on every change so /notifications can answer conditional GETs.
+# Every path that creates or marks notifications goes through the helpers
+# below and updates both in the same transaction. New notifications are
+# pushed to the user's live connections on commit.
+#
+# Rows are stored in monthly partitions (see partitions.py), and reads go
+# through notification_tables() so only the months a query can reach are
+# touched. The notification_retention job keeps storage bounded: every
+# NOTIFICATION_RETENTION_INTERVAL seconds it creates the coming months'
+# partitions, deletes read notifications older than
+# NOTIFICATION_READ_RETENTION_DAYS, and drops each month once all of it is
+# older than NOTIFICATION_RETENTION_DAYS, after marking its unread rows read
+# so the counters stay right. It works NOTIFICATION_PURGE_BATCH_SIZE rows at
+# a time and queues itself again while work is left, so no transaction or
+# lock outlasts one small batch.
+
+
+def _record_change(connection, user_id, unread_delta):
+    _record_changes(connection, {user_id: unread_delta})
+
+
+# {user_id: unread_delta} as one executemany UPDATE, in id order so
+# overlapping batches can't deadlock
+def _record_changes(connection, deltas):
+    user = User.__table__
+    connection.execute(
+        update(user)
+        .where(user.c.id == bindparam('target_id'))
+        .values(unread_notifications=user.c.unread_notifications + bindparam('delta'),
+                notifications_version=user.c.notifications_version + 1),
+        [{"target_id": user_id, "delta": delta} for user_id, delta in sorted(deltas.items())]
+    )
+
+
+# Rows have to be routed to their month's partition and counted, so they
+# are only created through create_notifications()
+@event.listens_for(Notification, 'before_insert')
+def _reject_orm_insert(mapper, connection, target):
+    raise TypeError("Create notifications with notifications.create_notifications()")
+
+
+# Same shape as the /notifications items
+def _payload(notification_id, message, read, created_at):
+    return {
+        "id": notification_id,
+        "message": message,
+        "read": bool(read),
+        "created_at": created_at
+    }
+
+
+# Multi-row insert of {"user_id": ..., "message": ...} dicts
+def create_notifications(rows):
+    if not rows:
+        return 0
+    now = datetime.utcnow()
+    values = [{
+        "user_id": row["user_id"],
+        "message": row["message"],
+        "read": False,
+        "created_at": row.get("created_at", now)
+    } for row in rows]
+    connection = db.session.connection()
+    ids = insert_notifications(connection, values)
+    for notification_id, row in zip(ids, values):
+        push_after_commit(db.session, 'notifications', [row["user_id"]],
+                          _payload(notification_id, row["message"], False, row["created_at"]))
+
+    _record_changes(connection, Counter(row["user_id"] for row in values))
+    return len(values)
+
+
+# Internal bulk notify (announcements, imports): the same message to every
+# user in user_ids, committed BULK_NOTIFY_CHUNK_SIZE users at a time so a
+# large audience never holds one long transaction. Returns the count.
+def bulk_notify(user_ids, message, chunk_size=None):
+    chunk_size = chunk_size or current_app.config.get('BULK_NOTIFY_CHUNK_SIZE', 1000)
+    user_ids = list(user_ids)
+    for start in range(0, len(user_ids), chunk_size):
+        create_notifications([{"user_id": user_id, "message": message}
+                              for user_id in user_ids[start:start + chunk_size]])
+        db.session.commit()
+    return len(user_ids)
+
+
+# A page of a user's notifications, newest first, as (rows, next_cursor);
+# months are read newest first until the page is full
+def list_notifications(user_id, limit, cursor=None, unread_only=True):
+    bound = decode_cursor(cursor)[0] if cursor else None
+    rows = []
+    for table in notification_tables(db.session.connection(), until=bound):
+        query = select(table.c.id, table.c.message, table.c.read, table.c.created_at) \
+            .where(table.c.user_id == user_id)
+        if unread_only:
+            # Spelled `== False` so it matches the ix_notification_unread predicate
+            query = query.where(table.c.read == False)  # noqa: E712
+        query = keyset_filter(query, table.c.created_at, table.c.id, cursor)
+        rows += db.session.execute(query.limit(limit + 1 - len(rows))).all()
+        if len(rows) > limit:
+            break
+    return paginate_rows(rows, limit, lambda row: row.created_at, lambda row: row.id)
+
+
+# Mark a user's unread notifications as read, one UPDATE per partition
+# reached. With no bounds everything is marked; up_to_id/before/ids narrow
+# it down. Returns the count.
+def mark_read(user_id, up_to_id=None, before=None, ids=None):
+    connection = db.session.connection()
+    marked = 0
+    for table in notification_tables(connection, until=before):
+        statement = (
+            update(table)
+            .where(table.c.user_id == user_id,
+                   table.c.read == False)  # noqa: E712 (partial index predicate)
+            .values(read=True)
+        )
+        if up_to_id is not None:
+            statement = statement.where(table.c.id <= up_to_id)
+        if before is not None:
+            statement = statement.where(table.c.created_at <= before)
+        if ids is not None:
+            statement = statement.where(table.c.id.in_(ids))
+        marked += connection.execute(statement).rowcount
+    if marked:
+        _record_change(connection, user_id, -marked)
+    return marked
+
+
+def unread_count(user_id):
+    return db.session.query(User.unread_notifications).filter(User.id == user_id).scalar() or 0
+
+
+# Mark up to batch_size of a partition's unread rows read, adjusting their
+# users' counters; returns how many were marked
+def _expire_unread(connection, table, batch_size):
+    batch = select(table.c.id).where(table.c.read == False).limit(batch_size)  # noqa: E712
+    user_ids = connection.execute(
+        update(table).where(table.c.id.in_(batch.scalar_subquery()), table.c.read == False)  # noqa: E712
+        .values(read=True).returning(table.c.user_id)
+    ).scalars().all()
+    if user_ids:
+        _record_changes(connection, {user_id: -count for user_id, count in Counter(user_ids).items()})
+    return len(user_ids)
+
+
+# Delete up to batch_size read notifications created before cutoff, oldest
+# first; returns how many were deleted
+def _delete_read(connection, cutoff, batch_size):
+    deleted = Counter()
+    for table in notification_tables(connection, until=cutoff, newest_first=False):
+        # Spelled `== True` so it matches the ix_notification_read_created_at predicate
+        batch = select(table.c.id).where(table.c.read == True, table.c.created_at < cutoff) \
+            .order_by(table.c.created_at).limit(batch_size - sum(deleted.values()))  # noqa: E712
+        deleted.update(connection.execute(
+            delete(table).where(table.c.id.in_(batch.scalar_subquery()), table.c.created_at < cutoff)
+            .returning(table.c.user_id)
+        ).scalars())
+        if sum(deleted.values()) >= batch_size:
+            break
+    # Their /notifications?status=all pages changed
+    if deleted:
+        _record_changes(connection, {user_id: 0 for user_id in deleted})
+    return sum(deleted.values())
+
+
+# One bounded step of retention; True while there is work left
+def purge_notifications(now, batch_size):
+    config = current_app.config
+    connection = db.session.connection()
+    expired = now - timedelta(days=config.get('NOTIFICATION_RETENTION_DAYS', 365))
+    for start, name in list_partitions(connection):
+        if next_period(start) > expired:
+            break
+        if not _expire_unread(connection, partition_table(name), batch_size):
+            drop_partition(connection, name)
+        return True
+    cutoff = now - timedelta(days=config.get('NOTIFICATION_READ_RETENTION_DAYS', 90))
+    return _delete_read(connection, cutoff, batch_size) >= batch_size
+
+
+@periodic_job('notification_retention', 'NOTIFICATION_RETENTION_INTERVAL', 3600)
+def notification_retention_job(payload):
+    now = datetime.utcnow()
+    ensure_partitions(db.session.connection(), now, now)
+    if purge_notifications(now, current_app.config.get('NOTIFICATION_PURGE_BATCH_SIZE', 1000)):
+        enqueue('notification_retention', {})
@@ -0,0 +1,59 @@
+import base64
+import json
+from datetime import datetime
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+# Read ?limit= from the query string, clamped to [1, MAX_PAGE_SIZE]
+def parse_limit(args, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    try:
+        limit = int(args.get('limit', default))
+    except (TypeError, ValueError):
+        raise ValueError("limit must be an integer")
+    return max(1, min(limit, maximum))
+
+
+# Cursors are an opaque, url-safe encoding of the (created_at, id) of the
+# last row on the previous page. Clients must pass them back unchanged.
+def encode_cursor(created_at, row_id):
+    payload = json.dumps([created_at.isoformat(), row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError, UnicodeError):
+        raise ValueError("Invalid cursor")
+
+
+# Apply a (created_at, id) DESC keyset window to a query. The leading
+# created_at <= bound lets both SQLite and Postgres seek into the index
+# instead of walking it from the top.
+def keyset_filter(query, created_at_column, id_column, cursor):
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        query = query.filter(
+            created_at_column <= created_at,
+            (created_at_column < created_at) | (id_column < row_id)
+        )
+    return query.order_by(created_at_column.desc(), id_column.desc())
+
+
+# Fetch one row past the page size to learn whether another page exists
+def paginate(query, limit, created_at_of, id_of):
+    return paginate_rows(query.limit(limit + 1).all(), limit, created_at_of, id_of)
+
+
+# Page and next cursor from up to limit + 1 rows fetched some other way
+def paginate_rows(rows, limit, created_at_of, id_of):
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(created_at_of(last), id_of(last))
+    return rows, next_cursor
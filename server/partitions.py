@@ -0,0 +1,207 @@
+import re
+import threading
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from sqlalchemy import Column, Index, Integer, MetaData, Table, event, insert, inspect, text, update
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from dbutil import insert_many_returning_ids
+from models import Notification
+
+# Monthly time-range partitions of the notification table.
+#
+# On Postgres notification is declaratively partitioned by RANGE
+# (created_at): rows are written to and read from the parent, the planner
+# skips partitions a created_at bound rules out, and an ORDER BY created_at
+# reads partitions newest first and stops at the LIMIT. A DEFAULT partition
+# catches rows for months nobody created a partition for.
+#
+# SQLite has no partitioning, so the same layout is kept by hand: one
+# notification_pYYYY_MM table per month with its own copy of the indexes,
+# created on first write, and ids taken from the one-row
+# notification_id_seq table so they stay unique across months. The
+# notification table itself stays empty there; callers get the tables to
+# query from notification_tables(), which leaves out the months their
+# created_at bounds exclude.
+#
+# Either way a month is dropped as a whole once it is past retention (see
+# notifications.py), so old data costs a DROP TABLE rather than a long
+# DELETE, and the table and its indexes stop growing with the platform's age.
+
+PARTITION_NAME = re.compile(r'notification_p(\d{4})_(\d{2})')
+DEFAULT_PARTITION = 'notification_default'
+# Months created ahead of the current one, so rows never wait on DDL
+PARTITIONS_AHEAD = 2
+# Partition DDL takes a brief exclusive lock on the parent; give up rather
+# than queue behind (and block) ordinary reads and writes
+DDL_LOCK_TIMEOUT = '5s'
+
+_metadata = MetaData()
+_id_sequence = Table('notification_id_seq', _metadata, Column('value', Integer, nullable=False))
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def native_partitioning(connection):
+    return connection.dialect.name == 'postgresql'
+
+
+# created_at is naive UTC; aware bounds are converted so they compare with it
+def naive_utc(when):
+    if when is not None and when.tzinfo is not None:
+        return when.astimezone(timezone.utc).replace(tzinfo=None)
+    return when
+
+
+def period_start(when):
+    return datetime(when.year, when.month, 1)
+
+
+def next_period(start):
+    return datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+
+
+def partition_name(start):
+    return f"notification_p{start:%Y_%m}"
+
+
+# Table for one partition, with notification's columns and indexes; the
+# indexes are renamed after it since SQLite index names are per database
+def partition_table(name):
+    table = _tables.get(name)
+    if table is None:
+        with _tables_lock:
+            table = _tables.get(name)
+            if table is None:
+                parent = Notification.__table__
+                table = Table(name, _metadata,
+                              *[Column(column.name, column.type, primary_key=column.name == 'id',
+                                       autoincrement=False, nullable=column.nullable)
+                                for column in parent.columns])
+                for index in parent.indexes:
+                    Index(index.name.replace('ix_notification', f'ix_{name}', 1),
+                          *[table.c[column.name] for column in index.columns], **index.dialect_kwargs)
+                _tables[name] = table
+    return table
+
+
+# [(period start, table name)] of the existing monthly partitions, oldest first
+def list_partitions(connection):
+    if native_partitioning(connection):
+        names = connection.execute(text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = 'notification'::regclass"
+        )).scalars()
+    else:
+        names = inspect(connection).get_table_names()
+    partitions = []
+    for name in names:
+        match = PARTITION_NAME.fullmatch(name)
+        if match:
+            partitions.append((datetime(int(match.group(1)), int(match.group(2)), 1), name))
+    return sorted(partitions)
+
+
+# The tables holding notifications created in [since, until] (either bound
+# optional): the partitioned parent on Postgres, which prunes by itself,
+# otherwise the overlapping monthly tables, newest first unless told not to
+def notification_tables(connection, since=None, until=None, newest_first=True):
+    if native_partitioning(connection):
+        return [Notification.__table__]
+    since, until = naive_utc(since), naive_utc(until)
+    tables = [partition_table(name) for start, name in list_partitions(connection)
+              if (until is None or start <= until) and (since is None or next_period(start) > since)]
+    return tables[::-1] if newest_first else tables
+
+
+def _create_partition(connection, start):
+    name = partition_name(start)
+    if native_partitioning(connection):
+        connection.exec_driver_sql(f"SET LOCAL lock_timeout = '{DDL_LOCK_TIMEOUT}'")
+        connection.exec_driver_sql(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF notification "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{next_period(start).isoformat()}')"
+        )
+    else:
+        # IF NOT EXISTS, since two writers can reach a new month together
+        table = partition_table(name)
+        connection.execute(CreateTable(table, if_not_exists=True))
+        for index in table.indexes:
+            connection.execute(CreateIndex(index, if_not_exists=True))
+    return name
+
+
+# Create the missing monthly partitions from `since` through PARTITIONS_AHEAD
+# months past `until`; returns the names created
+def ensure_partitions(connection, since, until):
+    existing = {start for start, _ in list_partitions(connection)}
+    created = []
+    start = period_start(since)
+    end = period_start(until)
+    for _ in range(PARTITIONS_AHEAD):
+        end = next_period(end)
+    while start <= end:
+        if start not in existing:
+            created.append(_create_partition(connection, start))
+        start = next_period(start)
+    return created
+
+
+# Detach (on Postgres) and drop one monthly partition
+def drop_partition(connection, name):
+    if native_partitioning(connection):
+        connection.exec_driver_sql(f"SET LOCAL lock_timeout = '{DDL_LOCK_TIMEOUT}'")
+        connection.exec_driver_sql(f"ALTER TABLE notification DETACH PARTITION {name}")
+    connection.exec_driver_sql(f'DROP TABLE IF EXISTS "{name}"')
+
+
+# Reserve `count` consecutive notification ids (without native partitioning)
+def allocate_ids(connection, count):
+    last = connection.execute(
+        update(_id_sequence).values(value=_id_sequence.c.value + count).returning(_id_sequence.c.value)
+    ).scalar_one()
+    return list(range(last - count + 1, last + 1))
+
+
+# Insert notification rows (dicts with every column but id) into their
+# partitions; returns their ids in order
+def insert_notifications(connection, values):
+    if native_partitioning(connection):
+        return insert_many_returning_ids(connection, Notification.__table__, values)
+    ids = allocate_ids(connection, len(values))
+    by_period = defaultdict(list)
+    for notification_id, row in zip(ids, values):
+        by_period[period_start(row["created_at"])].append({**row, "id": notification_id})
+    for start, rows in sorted(by_period.items()):
+        name = partition_name(start)
+        if not connection.dialect.has_table(connection, name):
+            _create_partition(connection, start)
+        connection.execute(insert(partition_table(name)), rows)
+    return ids
+
+
+# create_all() databases (tests, benchmarks, seed.py) get the same layout as
+# migration 0009: the default partition on Postgres or the id sequence table
+# elsewhere, and partitions for this month and the next few
+@event.listens_for(Notification.__table__, 'after_create')
+def _create_partitions(target, connection, **kw):
+    if native_partitioning(connection):
+        # A server-side default too, so COPY and plain INSERTs get ids
+        connection.exec_driver_sql("ALTER SEQUENCE notification_id_seq OWNED BY notification.id")
+        connection.exec_driver_sql("ALTER TABLE notification ALTER COLUMN id SET DEFAULT nextval('notification_id_seq')")
+        connection.exec_driver_sql(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF notification DEFAULT")
+    else:
+        _id_sequence.create(connection, checkfirst=True)
+        connection.execute(insert(_id_sequence).values(value=0))
+    now = datetime.utcnow()
+    ensure_partitions(connection, now, now)
+
+
+# Postgres drops the partitions along with the parent
+@event.listens_for(Notification.__table__, 'before_drop')
+def _drop_partitions(target, connection, **kw):
+    if not native_partitioning(connection):
+        for _, name in list_partitions(connection):
+            connection.exec_driver_sql(f'DROP TABLE IF EXISTS "{name}"')
+        _id_sequence.drop(connection, checkfirst=True)
@@ -0,0 +1,205 @@
+import threading
+
+from flask import current_app, has_app_context, json, session
+from flask_socketio import SocketIO, Namespace, emit, join_room, leave_room, rooms
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db, Friendship
+from token_auth import InvalidToken, token_auth_enabled, verify_token
+
+# Real-time push of notifications and new posts over Socket.IO.
+#
+# Clients connect to the /live namespace with their session cookie (or an
+# access token as {"token": ...} in the connect auth) and are put in a room
+# of their own ("user:<id>"). Writers queue pushes with push() or, inside a
+# database transaction, push_after_commit(); they are held for
+# REALTIME_FLUSH_INTERVAL seconds and then sent as one "notifications" or
+# "posts" frame per room, with rooms that got identical frames sharing a
+# single emit.
+#
+# With SOCKETIO_MESSAGE_QUEUE set, every emit goes through the queue, so a
+# push from any process reaches clients connected to any other. Leave it
+# unset (as TestingConfig does) to keep everything in-process.
+#
+# Served by gevent workers (gunicorn.conf.py), an idle connection costs a
+# greenlet and a socket rather than a thread, so one process holds many
+# thousands. The polling transport needs every request of a session to
+# reach the same process; with several workers behind one port
+# SOCKETIO_TRANSPORTS is limited to websocket unless set explicitly.
+#
+# Posts by accounts over FEED_CELEBRITY_THRESHOLD followers aren't pushed to
+# each follower's room; followers join an "author:<id>" room for those
+# accounts on connect, and again when told to after a follow or unfollow,
+# and get the post from one emit there.
+
+NAMESPACE = '/live'
+
+socketio = SocketIO()
+
+
+def user_room(user_id):
+    return f'user:{user_id}'
+
+
+def author_room(user_id):
+    return f'author:{user_id}'
+
+
+class EmitCoalescer:
+    def __init__(self, emit, window, start_task, sleep):
+        self._emit = emit
+        self.window = window
+        self._start_task = start_task
+        self._sleep = sleep
+        # (event, room) -> [item, ...]
+        self._pending = {}
+        self._scheduled = False
+        self._lock = threading.Lock()
+
+    def add(self, event_name, rooms, item):
+        with self._lock:
+            for room in rooms:
+                self._pending.setdefault((event_name, room), []).append(item)
+            if self._scheduled or not self.window:
+                schedule = False
+            else:
+                schedule = self._scheduled = True
+        if not self.window:
+            self.flush()
+        elif schedule:
+            self._start_task(self._flush_later)
+
+    def _flush_later(self):
+        self._sleep(self.window)
+        with self._lock:
+            self._scheduled = False
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        # One emit per distinct frame, addressed to every room that gets it
+        frames = {}
+        for (event_name, room), items in pending.items():
+            # Fan-out appends the same item objects to every room
+            frame = frames.setdefault((event_name, tuple(map(id, items))), (items, []))
+            frame[1].append(room)
+        for (event_name, _), (items, rooms) in frames.items():
+            self._emit(event_name, {"items": items}, rooms)
+
+
+def _followed_celebrities(user_id):
+    from timeline import get_timeline_store
+    celebrities = get_timeline_store().celebrities()
+    if not celebrities:
+        return []
+    return [row.followed_id for row in db.session.query(Friendship.followed_id)
+            .filter(Friendship.follower_id == user_id, Friendship.followed_id.in_(celebrities))]
+
+
+class LiveNamespace(Namespace):
+    def on_connect(self, auth=None):
+        user_id = session.get('user_id')
+        if user_id is None and auth and auth.get('token') and token_auth_enabled():
+            # Browsers can't set headers on a WebSocket; tokens come in `auth`
+            try:
+                user_id = session['user_id'] = int(verify_token(auth['token'])['sub'])
+            except InvalidToken:
+                pass
+        if user_id is None:
+            raise ConnectionRefusedError('unauthorized')
+        join_room(user_room(user_id))
+        self._join_author_rooms(user_id)
+        emit('ready', {"user_id": user_id})
+
+    # Sent by the client when it gets a "subscriptions" event
+    def on_resubscribe(self, data=None):
+        user_id = session.get('user_id')
+        if user_id is not None:
+            self._join_author_rooms(user_id)
+
+    def _join_author_rooms(self, user_id):
+        wanted = {author_room(followed_id) for followed_id in _followed_celebrities(user_id)}
+        for room in rooms():
+            if room.startswith('author:') and room not in wanted:
+                leave_room(room)
+        for room in wanted:
+            join_room(room)
+
+
+def get_coalescer():
+    return current_app.extensions.get('realtime')
+
+
+# Queue `item` as part of the next `event_name` frame for each room
+def push(event_name, rooms, item):
+    coalescer = get_coalescer() if has_app_context() else None
+    if coalescer is not None and rooms:
+        coalescer.add(event_name, rooms, item)
+
+
+# Same, but held until the session's transaction commits (dropped on rollback)
+def push_after_commit(session_, event_name, user_ids, item):
+    rooms = [user_room(user_id) for user_id in user_ids]
+    session_.info.setdefault('pending_pushes', []).append((event_name, rooms, item))
+
+
+def _post_rooms(post_data, follower_ids, celebrity):
+    rooms = [user_room(user_id) for user_id in follower_ids]
+    if celebrity:
+        rooms.append(author_room(post_data["author"]["id"]))
+    return rooms
+
+
+# New post to the given followers' connections; celebrities' followers get
+# it through the author room instead
+def push_post(post_data, follower_ids, celebrity):
+    push('posts', _post_rooms(post_data, follower_ids, celebrity), post_data)
+
+
+# Same, once the session's transaction commits
+def push_post_after_commit(session_, post_data, follower_ids, celebrity):
+    session_.info.setdefault('pending_pushes', []).append(
+        ('posts', _post_rooms(post_data, follower_ids, celebrity), post_data))
+
+
+# Following or unfollowing a celebrity changes which author rooms the
+# user's connections should be in
+def push_subscriptions_changed(user_id):
+    push('subscriptions', [user_room(user_id)], {})
+
+
+@event.listens_for(Session, 'after_commit')
+def _send_committed_pushes(session_):
+    for event_name, rooms, item in session_.info.pop('pending_pushes', ()):
+        push(event_name, rooms, item)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_rolled_back_pushes(session_):
+    session_.info.pop('pending_pushes', None)
+
+
+def init_realtime(app):
+    socketio.init_app(
+        app,
+        message_queue=app.config.get('SOCKETIO_MESSAGE_QUEUE'),
+        cors_allowed_origins=app.config.get('SOCKETIO_CORS_ALLOWED_ORIGINS'),
+        # None picks eventlet, gevent or threads by what is installed
+        async_mode=app.config.get('SOCKETIO_ASYNC_MODE'),
+        transports=app.config.get('SOCKETIO_TRANSPORTS'),
+        # Serialize frames like jsonify does, datetimes included
+        json=json,
+    )
+    socketio.on_namespace(LiveNamespace(NAMESPACE))
+
+    def send(event_name, data, rooms):
+        socketio.emit(event_name, data, to=rooms, namespace=NAMESPACE)
+
+    app.extensions['realtime'] = EmitCoalescer(
+        send,
+        app.config.get('REALTIME_FLUSH_INTERVAL', 0.05),
+        socketio.start_background_task,
+        socketio.sleep,
+    )
@@ -0,0 +1,81 @@
+import argparse
+import os
+import time
+
+from sqlalchemy import create_engine, func, select
+
+from config import Config
+from models import User, Post
+from search import POST_VECTOR_SQL, USER_VECTOR_SQL, index_hashtags
+
+# Incremental search reindex over existing rows.
+#
+#   python reindex.py --database-url postgresql://localhost/connectsphere
+#   python reindex.py --from-id 2500000          # resume after an interruption
+#   python reindex.py --rebuild-fts              # SQLite: rebuild the FTS5 tables too
+#
+# New and edited rows are indexed as they are written (triggers for the text
+# index, create_post for hashtags); this fills in rows that predate migration
+# 0004. Work is done in short transactions of --batch-size posts walked by
+# primary key, and everything it writes is idempotent, so it can run against
+# a live database and be stopped and resumed at any point.
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Backfill the search index for existing rows")
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL', Config.SQLALCHEMY_DATABASE_URI))
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--from-id', type=int, default=0, help="only reindex posts with a greater id")
+    parser.add_argument('--rebuild-fts', action='store_true', help="SQLite: rebuild post_fts and user_fts")
+    return parser.parse_args(argv)
+
+
+def backfill_hashtags(engine, batch_size, from_id=0):
+    post = Post.__table__
+    last_id, total = from_id, 0
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(
+                select(post.c.id, post.c.title, post.c.content)
+                .where(post.c.id > last_id).order_by(post.c.id).limit(batch_size)
+            ).all()
+            if not rows:
+                return total
+            total += index_hashtags(connection, [(id, f"{title} {content}") for id, title, content in rows])
+        last_id = rows[-1].id
+        print(f"hashtags: through post {last_id}, {total} links")
+
+
+# Postgres: fill search_vector on rows written before the trigger existed
+def backfill_vectors(engine, table, expression, batch_size):
+    expression = expression.format(row=f'"{table.name}"')
+    with engine.connect() as connection:
+        max_id = connection.execute(select(func.max(table.c.id))).scalar() or 0
+    for start in range(0, max_id, batch_size):
+        with engine.begin() as connection:
+            connection.exec_driver_sql(
+                f'UPDATE "{table.name}" SET search_vector = {expression} '
+                'WHERE id > %(start)s AND id <= %(end)s AND search_vector IS NULL',
+                {"start": start, "end": start + batch_size}
+            )
+        print(f"{table.name}: through id {min(start + batch_size, max_id)}")
+
+
+def reindex(args):
+    engine = create_engine(args.database_url)
+    started = time.perf_counter()
+
+    if engine.dialect.name == 'postgresql':
+        backfill_vectors(engine, Post.__table__, POST_VECTOR_SQL, args.batch_size)
+        backfill_vectors(engine, User.__table__, USER_VECTOR_SQL, args.batch_size)
+    elif engine.dialect.name == 'sqlite' and args.rebuild_fts:
+        with engine.begin() as connection:
+            connection.exec_driver_sql("INSERT INTO post_fts(post_fts) VALUES('rebuild')")
+            connection.exec_driver_sql("INSERT INTO user_fts(user_fts) VALUES('rebuild')")
+
+    links = backfill_hashtags(engine, args.batch_size, args.from_id)
+    print(f"Reindexed {links} hashtag links in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    reindex(parse_args())
@@ -0,0 +1,145 @@
+import argparse
+import os
+import time
+
+from sqlalchemy import bindparam, create_engine, func, select, update
+
+from config import Config
+from dbutil import insert_ignore
+from models import User, Post, Friendship, UserCounterShard
+
+# Recompute drifted profile stats counters and fold counter shards.
+#
+#   python repair_counters.py --database-url postgresql://localhost/connectsphere
+#   python repair_counters.py --fold-only      # cheap; suitable for cron
+#   python repair_counters.py --from-id 500000 # resume after an interruption
+#
+# Folding moves each shard's value onto the user row and subtracts the same
+# amount from the shard, so increments that land meanwhile are kept. A full
+# repair walks users in --batch-size id ranges, and in one short
+# transaction per range:
+#
+# 1. creates any missing shard rows of the range's sharded counters, so
+#    that the next step covers every row a follow could increment;
+# 2. locks the range's shard rows, then its user rows (the order the write
+#    path takes them in), so follows for those users wait for the commit;
+# 3. recounts followers, following and posts with grouped index scans;
+# 4. stores the recount on every user whose counters plus shards disagree
+#    with it, and folds the shards it locked.
+
+COUNT_QUERIES = {
+    'follower_count': (Friendship.followed_id, Friendship),
+    'following_count': (Friendship.follower_id, Friendship),
+    'post_count': (Post.user_id, Post),
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Repair profile stats counters")
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL', Config.SQLALCHEMY_DATABASE_URI))
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--from-id', type=int, default=0, help="only repair users with a greater id")
+    parser.add_argument('--fold-only', action='store_true', help="fold shards without recounting")
+    return parser.parse_args(argv)
+
+
+# Move shard values onto the user rows; returns the number of shards folded
+def fold_shards(connection, first_id=None, last_id=None):
+    shard, user = UserCounterShard.__table__, User.__table__
+    query = select(shard.c.user_id, shard.c.name, shard.c.shard, shard.c.value).where(shard.c.value != 0)
+    if first_id is not None:
+        query = query.where(shard.c.user_id > first_id, shard.c.user_id <= last_id)
+    rows = connection.execute(query.order_by(shard.c.user_id)).all()
+    for user_id, name, shard_id, value in rows:
+        connection.execute(update(user).where(user.c.id == user_id).values({name: user.c[name] + value}))
+        connection.execute(
+            update(shard)
+            .where(shard.c.user_id == user_id, shard.c.name == name, shard.c.shard == shard_id)
+            .values(value=shard.c.value - value)
+        )
+    return len(rows)
+
+
+def _lock_shards(connection, first_id, last_id, shard_count):
+    shard = UserCounterShard.__table__
+    in_range = (shard.c.user_id > first_id, shard.c.user_id <= last_id)
+    counters = connection.execute(select(shard.c.user_id, shard.c.name).where(*in_range).distinct()).all()
+    if counters:
+        connection.execute(insert_ignore(connection, shard), [
+            {"user_id": user_id, "name": name, "shard": shard_id, "value": 0}
+            for user_id, name in counters for shard_id in range(shard_count)
+        ])
+    return connection.execute(
+        select(shard.c.user_id, shard.c.name, shard.c.shard, shard.c.value).where(*in_range)
+        .order_by(shard.c.user_id, shard.c.name, shard.c.shard).with_for_update()
+    ).all()
+
+
+def repair_batch(connection, first_id, last_id, shard_count=Config.COUNTER_SHARDS):
+    user, shard = User.__table__, UserCounterShard.__table__
+    shards = _lock_shards(connection, first_id, last_id, shard_count)
+    current = {row.id: row for row in connection.execute(
+        select(user.c.id, user.c.follower_count, user.c.following_count, user.c.post_count)
+        .where(user.c.id > first_id, user.c.id <= last_id).order_by(user.c.id).with_for_update()
+    )}
+    pending = {}
+    for row in shards:
+        pending[row.user_id, row.name] = pending.get((row.user_id, row.name), 0) + row.value
+
+    actual = {user_id: dict.fromkeys(COUNT_QUERIES, 0) for user_id in current}
+    for name, (column, model) in COUNT_QUERIES.items():
+        rows = connection.execute(
+            select(column, func.count()).select_from(model)
+            .where(column > first_id, column <= last_id).group_by(column)
+        )
+        for user_id, count in rows:
+            if user_id in actual:
+                actual[user_id][name] = count
+
+    repaired = 0
+    for user_id, counts in actual.items():
+        row = current[user_id]
+        if any(getattr(row, name) + pending.get((user_id, name), 0) != count for name, count in counts.items()):
+            repaired += 1
+        elif not any(pending.get((user_id, name)) for name in counts):
+            continue
+        connection.execute(update(user).where(user.c.id == user_id).values(counts))
+    # Fold: the user rows now hold the whole count
+    folded = [{"target_id": row.user_id, "target_name": row.name, "target_shard": row.shard, "delta": row.value}
+              for row in shards if row.value]
+    if folded:
+        connection.execute(
+            update(shard).where(shard.c.user_id == bindparam('target_id'), shard.c.name == bindparam('target_name'),
+                                shard.c.shard == bindparam('target_shard'))
+            .values(value=shard.c.value - bindparam('delta')),
+            folded
+        )
+    return repaired
+
+
+def repair_counters(engine, batch_size, from_id=0, verbose=True):
+    with engine.connect() as connection:
+        max_id = connection.execute(select(func.max(User.id))).scalar() or 0
+    repaired = 0
+    for first_id in range(from_id, max_id, batch_size):
+        with engine.begin() as connection:
+            repaired += repair_batch(connection, first_id, first_id + batch_size)
+        if verbose:
+            print(f"counters: through user {min(first_id + batch_size, max_id)}, {repaired} repaired")
+    return repaired
+
+
+def main(args):
+    engine = create_engine(args.database_url)
+    started = time.perf_counter()
+    if args.fold_only:
+        with engine.begin() as connection:
+            folded = fold_shards(connection)
+        print(f"Folded {folded} counter shards in {time.perf_counter() - started:.1f}s")
+        return
+    repaired = repair_counters(engine, args.batch_size, args.from_id)
+    print(f"Repaired {repaired} users in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,252 @@
+import functools
+import inspect
+import logging
+import os
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from flask_sqlalchemy.session import Session as FlaskSession
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError
+
+# Read replicas for db.session, and pool settings for every bind.
+#
+# Replicas are the SQLALCHEMY_BINDS whose key starts with "replica" (built
+# from DATABASE_REPLICA_URLS unless given explicitly). RoutingSession sends a
+# session's reads to one replica when they come from a GET/HEAD request or
+# from inside read_only(); everything else, any flush or INSERT/UPDATE/
+# DELETE, and SELECT ... FOR UPDATE go to the primary, and once a session
+# has used the primary it stays there.
+#
+# A request that writes sets a `last_write` cookie; that client's reads stay
+# on the primary for READ_YOUR_WRITES_WINDOW seconds after it, so it sees
+# its own writes even with replicas behind.
+#
+# A background thread per process checks every replica each
+# REPLICA_CHECK_INTERVAL seconds. Sessions pick among the reachable ones at
+# most REPLICA_MAX_LAG seconds behind, preferring the least lagged; with
+# none available reads fall back to the primary.
+
+REPLICA_PREFIX = 'replica'
+READ_YOUR_WRITES_COOKIE = 'last_write'
+
+# Postgres standby lag; 0 when caught up, so an idle primary reads as no lag
+POSTGRES_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+"""
+
+logger = logging.getLogger(__name__)
+
+_read_only = ContextVar('read_only', default=False)
+
+
+# Usable as `with read_only():` or `@read_only()`: reads inside may go to a
+# replica whatever the request method, and outside requests too (jobs,
+# scripts). A decorated generator is read-only while it runs, not while the
+# caller holds it between items.
+class read_only:
+    def __enter__(self):
+        self._token = _read_only.set(True)
+        return self
+
+    def __exit__(self, *exc_info):
+        _read_only.reset(self._token)
+
+    def __call__(self, fn):
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def generator(*args, **kwargs):
+                items = fn(*args, **kwargs)
+                try:
+                    while True:
+                        with read_only():
+                            try:
+                                item = next(items)
+                            except StopIteration:
+                                return
+                        yield item
+                finally:
+                    items.close()
+            return generator
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with read_only():
+                return fn(*args, **kwargs)
+        return wrapper
+
+
+def _recently_wrote():
+    window = current_app.config.get('READ_YOUR_WRITES_WINDOW', 5)
+    try:
+        last_write = float(request.cookies.get(READ_YOUR_WRITES_COOKIE, 0))
+    except ValueError:
+        return False
+    # A timestamp in the future is forged or skewed; ignore it
+    return 0 <= time.time() - last_write < window
+
+
+def _replica_allowed():
+    if _read_only.get():
+        return not has_request_context() or not _recently_wrote()
+    if not has_request_context() or request.method not in ('GET', 'HEAD'):
+        return False
+    return not _recently_wrote()
+
+
+class RoutingSession(FlaskSession):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is not None or engine is not self._db.engines.get(None):
+            return engine
+        if self._flushing or getattr(clause, 'is_dml', False) or getattr(clause, '_for_update_arg', None) is not None:
+            self.info['use_primary'] = True
+        if self.info.get('use_primary') or not has_app_context():
+            return engine
+        replicas = current_app.extensions.get('replicas')
+        # Checked per statement: in a POST only the read_only() parts may
+        # leave the primary
+        if replicas is None or not _replica_allowed():
+            return engine
+        if 'replica' not in self.info:
+            self.info['replica'] = replicas.choose()
+        return self.info['replica'] or engine
+
+
+class ReplicaSet:
+    def __init__(self, engines, max_lag=5, check_interval=5, metrics=None):
+        self.pid = os.getpid()
+        self.engines = engines
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.metrics = metrics
+        # name -> (reachable, lag seconds); assumed fine until the first check
+        self.status = {name: (True, 0.0) for name in engines}
+        self._thread = None
+        self._lock = threading.Lock()
+        for name, engine in engines.items():
+            event.listen(engine, 'handle_error', lambda context, name=name: self._on_error(name, context))
+
+    def _on_error(self, name, context):
+        if context.is_disconnect:
+            logger.warning("Replica %s disconnected; routing reads elsewhere until it checks healthy", name)
+            self.status[name] = (False, self.status[name][1])
+
+    def _lag(self, connection):
+        if connection.dialect.name == 'postgresql':
+            return float(connection.execute(text(POSTGRES_LAG_SQL)).scalar() or 0)
+        connection.execute(text('SELECT 1'))
+        return 0.0
+
+    def check(self):
+        for name, engine in self.engines.items():
+            try:
+                with engine.connect() as connection:
+                    self.status[name] = (True, self._lag(connection))
+            except DBAPIError:
+                logger.warning("Replica %s failed its health check", name, exc_info=True)
+                self.status[name] = (False, self.status[name][1])
+
+    def _run(self):
+        while True:
+            time.sleep(self.check_interval)
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Replica health check failed")
+
+    # Forked workers each start their own checker on first use
+    def _ensure_checker(self):
+        if self.check_interval and (self._thread is None or self.pid != os.getpid()):
+            with self._lock:
+                if self._thread is None or self.pid != os.getpid():
+                    self.pid = os.getpid()
+                    self._thread = threading.Thread(target=self._run, name='replica-check', daemon=True)
+                    self._thread.start()
+
+    # An engine for a session's reads, or None for the primary
+    def choose(self):
+        self._ensure_checker()
+        candidates = [(lag, name) for name, (healthy, lag) in self.status.items() if healthy and lag <= self.max_lag]
+        if not candidates:
+            name = None
+        else:
+            # Spread load across replicas that are about equally fresh
+            best = min(lag for lag, _ in candidates)
+            name = random.choice([name for lag, name in candidates if lag <= best + 0.5])
+        if self.metrics is not None:
+            self.metrics.inc('db_read_sessions_total', (('bind', name or 'primary'),))
+        return self.engines[name] if name else None
+
+    def gauges(self):
+        for name, (healthy, lag) in self.status.items():
+            yield 'db_replica_healthy', (('bind', name),), int(healthy)
+            yield 'db_replica_lag_seconds', (('bind', name),), lag
+
+
+def _pool_options(url, pool):
+    url = make_url(url)
+    # In-memory SQLite gets a StaticPool, which takes no sizing options
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        return {}
+    return dict(pool)
+
+
+# Fill SQLALCHEMY_ENGINE_OPTIONS and the replica binds from DATABASE_POOL,
+# DATABASE_REPLICA_URLS and DATABASE_REPLICA_POOL; call before db.init_app.
+# Options already set, per bind, win.
+def configure_engines(app):
+    config = app.config
+    options = _pool_options(config['SQLALCHEMY_DATABASE_URI'], config.get('DATABASE_POOL', {}))
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = {**options, **config.get('SQLALCHEMY_ENGINE_OPTIONS', {})}
+
+    binds = dict(config.get('SQLALCHEMY_BINDS') or {})
+    for index, url in enumerate(config.get('DATABASE_REPLICA_URLS', []), start=1):
+        binds.setdefault(f'{REPLICA_PREFIX}_{index}', {
+            'url': url, **_pool_options(url, config.get('DATABASE_REPLICA_POOL', {}))
+        })
+    config['SQLALCHEMY_BINDS'] = binds
+
+
+def _is_write(context):
+    return context.isinsert or context.isupdate or context.isdelete
+
+
+def _record_write(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and _is_write(context):
+        g.db_wrote = True
+
+
+def _set_last_write(response):
+    if g.get('db_wrote'):
+        response.set_cookie(READ_YOUR_WRITES_COOKIE, f'{time.time():.3f}',
+                            max_age=int(current_app.config.get('READ_YOUR_WRITES_WINDOW', 5)) + 1,
+                            httponly=True, samesite='Lax')
+    return response
+
+
+# Call after db.init_app
+def init_replicas(app, db):
+    with app.app_context():
+        engines = db.engines
+    replicas = {key: engine for key, engine in engines.items() if key and key.startswith(REPLICA_PREFIX)}
+    if not replicas:
+        return
+    metrics = app.extensions.get('metrics')
+    replica_set = app.extensions['replicas'] = ReplicaSet(
+        replicas,
+        max_lag=app.config.get('REPLICA_MAX_LAG', 5),
+        check_interval=app.config.get('REPLICA_CHECK_INTERVAL', 5),
+        metrics=metrics
+    )
+    if metrics is not None:
+        metrics.add_gauges(replica_set.gauges)
+    event.listen(engines[None], 'after_cursor_execute', _record_write)
+    app.after_request(_set_last_write)
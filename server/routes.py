@@ -1,11 +1,45 @@
-from flask import Blueprint, request, jsonify, session
-from models import db, User, Post, Friendship, Notification
-from flask_bcrypt import Bcrypt
+from datetime import datetime
+from flask import Blueprint, Response, current_app, request, jsonify, session, stream_with_context, url_for
+from models import db, User, Post, Friendship
 from sqlalchemy.exc import IntegrityError
-
-# Initialize the Blueprint and bcrypt
+from hashing import HasherBusy
+from identity import load_current_user, get_user_snapshot
+from notifications import list_notifications, mark_read, unread_count
+from partitions import naive_utc
+from conditional import make_etag, not_modified, with_validators, posts_version, notifications_version
+from counters import count_follow, count_post
+from batch import batch_items, post_item_error, create_posts, follow_users
+from export import EXPORTS, iter_ndjson, iter_json_array
+from follow_graph import get_follow_graph
+from realtime import push_subscriptions_changed
+from fanout import enqueue_post_fan_out, enqueue_follow_notifications
+from media import MediaBusy, UnsupportedImage, UploadTooLarge, store_avatar, serve_media
+from likes import like_post, unlike_post, like_count, like_counts, trending_posts, decayed_likes
+from token_auth import (InvalidToken, bearer_token, issue_tokens, rotate_refresh_token, token_auth_enabled,
+                        token_identity, is_token_session, revoke_current_token)
+from search import (SEARCH_CANDIDATE_LIMIT, index_hashtags, search_posts, search_users,
+                    autocomplete_users, autocomplete_hashtags, hashtag_posts)
+from pagination import parse_limit, keyset_filter, paginate, encode_cursor, decode_cursor
+from timeline import (get_timeline_store, backfill_timeline, backfill_timelines, prune_timeline,
+                      read_timeline)
+
+# Initialize the Blueprint
 auth_bp = Blueprint('auth', __name__)
-bcrypt = Bcrypt()
+
+
+# Shed load instead of queueing when the password hashing pool is saturated
+@auth_bp.errorhandler(HasherBusy)
+def hasher_busy(e):
+    response = jsonify({"error": "Server is busy, please try again shortly"})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+# Same for the thumbnail pool
+@auth_bp.errorhandler(MediaBusy)
+def media_busy(e):
+    response = jsonify({"error": "Server is busy, please try again shortly"})
+    response.headers['Retry-After'] = '1'
+    return response, 503
 
 # Signup route
 @auth_bp.route('/signup', methods=['POST'])
@@ -50,9 +84,12 @@ def login():
     username = data.get('username')
     password = data.get('password')
 
+    if not username or not password:
+        return jsonify({"error": "Username and password are required"}), 422
+
     user = User.query.filter_by(username=username).first()
 
-    if not user or not bcrypt.check_password_hash(user._password_hash, password):
+    if not user or not user.check_password(password):
         return jsonify({"error": "Invalid username or password"}), 401
 
     session['user_id'] = user.id
@@ -64,25 +101,154 @@ def login():
         "bio": user.bio
     }), 200
 
+# Token login route (TOKEN_AUTH_ENABLED): an access and a refresh token
+# instead of a session cookie
+@auth_bp.route('/token', methods=['POST'])
+def create_token():
+    if not token_auth_enabled():
+        return jsonify({"error": "Token authentication is not enabled"}), 404
+
+    data = request.get_json()
+    username = data.get('username')
+    password = data.get('password')
+
+    if not username or not password:
+        return jsonify({"error": "Username and password are required"}), 422
+
+    user = User.query.filter_by(username=username).first()
+
+    if not user or not user.check_password(password):
+        return jsonify({"error": "Invalid username or password"}), 401
+
+    return jsonify(issue_tokens(user)), 200
+
+# Trade a refresh token (as the Bearer token) for a new pair; the old one
+# stops working
+@auth_bp.route('/token/refresh', methods=['POST'])
+def refresh_token():
+    if not token_auth_enabled():
+        return jsonify({"error": "Token authentication is not enabled"}), 404
+
+    token = bearer_token(request)
+    if token is None:
+        return jsonify({"error": "A refresh token is required"}), 401
+
+    try:
+        claims = rotate_refresh_token(token)
+    except InvalidToken as e:
+        return jsonify({"error": str(e)}), 401
+
+    # Reloaded so a changed username or avatar reaches the new access token
+    user = get_user_snapshot(int(claims['sub']))
+    if user is None:
+        return jsonify({"error": "User not found"}), 401
+
+    return jsonify(issue_tokens(user, family=claims['fam'])), 200
+
 # Check session route (auto-login)
 @auth_bp.route('/check_session', methods=['GET'])
 def check_session():
     if 'user_id' not in session:
         return jsonify({"error": "Not logged in"}), 401
 
+    # Token sessions are answered from the token's claims
+    user_data = token_identity()
+    if user_data is None:
+        user = load_current_user()
+        if user is None:
+            session.pop('user_id', None)
+            return jsonify({"error": "Not logged in"}), 401
+        # Revalidated against the cached snapshot, without touching the database
+        user_data = user.to_dict()
+
+    etag = make_etag('session', *user_data.values())
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    return with_validators(jsonify(user_data), etag), 200
+
+# Profile route
+@auth_bp.route('/profile', methods=['GET'])
+def get_profile():
+    if 'user_id' not in session:
+        return jsonify({"error": "You must be logged in to view your profile"}), 401
+
+    user = load_current_user()
+    if user is None:
+        return jsonify({"error": "User not found"}), 404
+
+    # Revalidated against the cached snapshot, without touching the database
+    user_data = user.to_dict()
+    etag = make_etag('profile', *user_data.values())
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    return with_validators(jsonify(user_data), etag), 200
+
+# Update profile route
+@auth_bp.route('/profile', methods=['PUT', 'PATCH'])
+def update_profile():
+    if 'user_id' not in session:
+        return jsonify({"error": "You must be logged in to update your profile"}), 401
+
+    data = request.get_json()
     user = User.query.get(session['user_id'])
+    if user is None:
+        return jsonify({"error": "User not found"}), 404
 
-    return jsonify({
-        "id": user.id,
-        "username": user.username,
-        "image_url": user.image_url,
-        "bio": user.bio
-    }), 200
+    if 'bio' in data:
+        user.bio = data['bio']
+    if 'image_url' in data:
+        user.image_url = data['image_url']
+    db.session.commit()
+
+    # The commit evicted the cached snapshot; this reloads it with the stats
+    return jsonify(get_user_snapshot(user.id).to_dict()), 200
+
+# Upload an avatar: the PNG, JPEG, GIF or WebP image is the request body
+@auth_bp.route('/profile/avatar', methods=['POST', 'PUT'])
+def upload_avatar():
+    if 'user_id' not in session:
+        return jsonify({"error": "You must be logged in to change your avatar"}), 401
+
+    max_bytes = current_app.config.get('MEDIA_MAX_UPLOAD_BYTES', 10 * 1024 * 1024)
+    if request.content_length is not None and request.content_length > max_bytes:
+        return jsonify({"error": f"Images may be at most {max_bytes} bytes"}), 413
+
+    # Before touching the database, so a slow upload doesn't hold a connection
+    try:
+        keys = store_avatar(request.stream)
+    except UploadTooLarge as e:
+        return jsonify({"error": str(e)}), 413
+    except UnsupportedImage as e:
+        return jsonify({"error": str(e)}), 415
+
+    user = User.query.get(session['user_id'])
+    if user is None:
+        return jsonify({"error": "User not found"}), 404
+    # The commit evicts the cached identity snapshot
+    thumbnails = {str(size): url_for('auth.get_media', key=key, _external=True) for size, key in keys.items()}
+    user.image_url = thumbnails[str(max(keys))]
+    db.session.commit()
+
+    return jsonify({"image_url": user.image_url, "thumbnails": thumbnails}), 200
+
+# Uploaded images, by content hash; cacheable forever, Range requests supported
+@auth_bp.route('/media/<path:key>', methods=['GET'])
+def get_media(key):
+    response = serve_media(key)
+    if response is None:
+        return jsonify({"error": "Image not found"}), 404
+    return response
 
 # Logout route
 @auth_bp.route('/logout', methods=['DELETE'])
 def logout():
     if 'user_id' in session:
+        if is_token_session():
+            revoke_current_token()
         session.pop('user_id', None)
         return '', 204
     return jsonify({"error": "No user logged in"}), 401
@@ -98,7 +264,7 @@ def create_post():
     if not data.get('title') or not data.get('content'):
         return jsonify({"error": "Title and content are required"}), 422
 
-    user = User.query.get(session['user_id'])
+    user = load_current_user()
     post = Post(
         title=data['title'],
         content=data['content'],
@@ -106,8 +272,15 @@ def create_post():
     )
 
     db.session.add(post)
+    db.session.flush()
+    index_hashtags(db.session.connection(), [(post.id, f"{post.title} {post.content}")])
+    count_post(user.id)
+    # Followers' timelines, live pushes and notifications happen in the background
+    enqueue_post_fan_out(user.id, [post.id])
     db.session.commit()
 
+    get_timeline_store().push([user.id], [post.id])
+
     return jsonify({
         "id": post.id,
         "title": post.title,
@@ -119,25 +292,267 @@ def create_post():
         }
     }), 201
 
-# Get all posts route (for home/feed)
+# Create many posts in one transaction: {"posts": [{"title": ..., "content": ...}, ...]}.
+# Each item gets a result, in order; invalid items are skipped, not fatal.
+@auth_bp.route('/posts/batch', methods=['POST'])
+def create_posts_batch():
+    if 'user_id' not in session:
+        return jsonify({"error": "You must be logged in to create posts"}), 401
+
+    items, error = batch_items(request.get_json(silent=True), 'posts')
+    if error:
+        return jsonify({"error": error}), 422
+
+    results, valid = [], []
+    for index, item in enumerate(items):
+        result = {"index": index}
+        item_error = post_item_error(item)
+        if item_error:
+            result.update({"status": "error", "error": item_error})
+        else:
+            valid.append((result, item))
+        results.append(result)
+
+    user = load_current_user()
+    if valid:
+        post_ids = create_posts(user.id, [item for _, item in valid])
+        enqueue_post_fan_out(user.id, post_ids)
+        db.session.commit()
+
+        get_timeline_store().push([user.id], post_ids)
+        for (result, item), post_id in zip(valid, post_ids):
+            result.update({"status": "created", "id": post_id})
+
+    return jsonify({"results": results, "created": len(valid)}), 200
+
+# Get posts route (for home/feed), newest first, paged with ?limit=&cursor=
 @auth_bp.route('/posts', methods=['GET'])
 def get_posts():
     if 'user_id' not in session:
         return jsonify({"error": "You must be logged in to view posts"}), 401
 
-    posts = Post.query.all()
+    # Only the newest post id and timestamp are read before deciding on a 304
+    max_id, last_modified = posts_version()
+    etag = make_etag('posts', max_id)
+    cached = not_modified(etag, last_modified, public=True)
+    if cached:
+        return cached
+
+    try:
+        limit = parse_limit(request.args)
+        query = db.session.query(
+            Post.id,
+            Post.title,
+            Post.content,
+            Post.created_at,
+            User.id.label("author_id"),
+            User.username.label("author_username")
+        ).join(User, User.id == Post.user_id)
+        query = keyset_filter(query, Post.created_at, Post.id, request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 422
+
+    rows, next_cursor = paginate(query, limit, lambda row: row.created_at, lambda row: row.id)
     posts_data = [{
-        "id": post.id,
-        "title": post.title,
-        "content": post.content,
-        "created_at": post.created_at,
+        "id": row.id,
+        "title": row.title,
+        "content": row.content,
+        "created_at": row.created_at,
+        "author": {
+            "id": row.author_id,
+            "username": row.author_username
+        }
+    } for row in rows]
+
+    response = jsonify({"posts": posts_data, "next_cursor": next_cursor})
+    return with_validators(response, etag, last_modified, public=True), 200
+
+# Home timeline route: own posts plus posts from followed accounts
+@auth_bp.route('/feed', methods=['GET'])
+def get_feed():
+    if 'user_id' not in session:
+        return jsonify({"error": "You must be logged in to view your feed"}), 401
+
+    try:
+        limit = parse_limit(request.args)
+        cursor = request.args.get('cursor')
+        max_id = decode_cursor(cursor)[1] if cursor else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 422
+
+    rows = read_timeline(session['user_id'], max_id, limit)
+    posts_data = [{
+        "id": row.id,
+        "title": row.title,
+        "content": row.content,
+        "created_at": row.created_at,
+        "author": {
+            "id": row.author_id,
+            "username": row.author_username
+        }
+    } for row in rows]
+    next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id) if len(rows) == limit else None
+
+    return jsonify({"posts": posts_data, "next_cursor": next_cursor}), 200
+
+# Most liked posts of the last TRENDING_WINDOW, recent likes counting most: ?limit=
+@auth_bp.route('/posts/trending', methods=['GET'])
+def get_trending_posts():
+    if 'user_id' not in session:
+        return jsonify({"error": "You must be logged in to view posts"}), 401
+
+    try:
+        limit = parse_limit(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 422
+
+    rows = trending_posts(limit)
+    counts = like_counts(rows)
+    now = datetime.utcnow()
+    posts_data = [{
+        "id": row.id,
+        "title": row.title,
+        "content": row.content,
+        "created_at": row.created_at,
+        "like_count": counts[row.id],
+        "trending_score": round(decayed_likes(row.score, now), 3),
+        "author": {
+            "id": row.author_id,
+            "username": row.author_username
+        }
+    } for row in rows]
+
+    return jsonify({"posts": posts_data}), 200
+
+# Like a post; liking it again changes nothing
+@auth_bp.route('/like/<int:post_id>', methods=['POST'])
+def like(post_id):
+    if 'user_id' not in session:
+        return jsonify({"error": "You must be logged in to like posts"}), 401
+
+    post = db.session.query(Post.id, Post.created_at, Post.like_count).filter(Post.id == post_id).first()
+    if not post:
+        return jsonify({"error": "Post not found"}), 404
+
+    like_post(session['user_id'], post)
+    db.session.commit()
+
+    return jsonify({"liked": True, "like_count": like_count(post_id)}), 200
+
+# Unlike a post; unliking it again changes nothing
+@auth_bp.route('/like/<int:post_id>', methods=['DELETE'])
+def unlike(post_id):
+    if 'user_id' not in session:
+        return jsonify({"error": "You must be logged in to unlike posts"}), 401
+
+    post = db.session.query(Post.id, Post.created_at, Post.like_count).filter(Post.id == post_id).first()
+    if not post:
+        return jsonify({"error": "Post not found"}), 404
+
+    unlike_post(session['user_id'], post)
+    db.session.commit()
+
+    return jsonify({"liked": False, "like_count": like_count(post_id)}), 200
+
+# Ranked full-text search: ?q=&type=posts|users&limit=&page=
+@auth_bp.route('/search', methods=['GET'])
+def search():
+    if 'user_id' not in session:
+        return jsonify({"error": "You must be logged in to search"}), 401
+
+    term = request.args.get('q', '').strip()
+    search_type = request.args.get('type', 'posts')
+    if not term:
+        return jsonify({"error": "A search term is required"}), 422
+    if search_type not in ('posts', 'users'):
+        return jsonify({"error": "type must be posts or users"}), 422
+
+    try:
+        limit = parse_limit(request.args)
+        page = max(1, int(request.args.get('page', 1)))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 422
+    offset = (page - 1) * limit
+    if offset >= SEARCH_CANDIDATE_LIMIT:
+        return jsonify({"error": "Page is past the end of the search results"}), 422
+
+    if search_type == 'users':
+        results = [{
+            "id": row.id,
+            "username": row.username,
+            "image_url": row.image_url,
+            "bio": row.bio
+        } for row in search_users(term, limit, offset)]
+    else:
+        results = [{
+            "id": row.id,
+            "title": row.title,
+            "content": row.content,
+            "created_at": row.created_at,
+            "author": {
+                "id": row.author_id,
+                "username": row.author_username
+            }
+        } for row in search_posts(term, limit, offset)]
+
+    next_page = page + 1 if len(results) == limit and offset + limit < SEARCH_CANDIDATE_LIMIT else None
+    return jsonify({"results": results, "next_page": next_page}), 200
+
+# Prefix autocomplete for usernames or hashtags: ?q=&type=users|hashtags
+@auth_bp.route('/search/autocomplete', methods=['GET'])
+def search_autocomplete():
+    if 'user_id' not in session:
+        return jsonify({"error": "You must be logged in to search"}), 401
+
+    prefix = request.args.get('q', '').strip()
+    search_type = request.args.get('type', 'users')
+    if not prefix:
+        return jsonify({"error": "A prefix is required"}), 422
+    try:
+        limit = parse_limit(request.args, default=10, maximum=20)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 422
+
+    if search_type == 'hashtags':
+        results = [{"id": row.id, "name": row.name} for row in autocomplete_hashtags(prefix, limit)]
+    elif search_type == 'users':
+        results = [{
+            "id": row.id,
+            "username": row.username,
+            "image_url": row.image_url
+        } for row in autocomplete_users(prefix, limit)]
+    else:
+        return jsonify({"error": "type must be users or hashtags"}), 422
+
+    return jsonify({"results": results}), 200
+
+# Posts carrying a hashtag, newest first, paged with ?limit=&cursor=
+@auth_bp.route('/hashtags/<name>/posts', methods=['GET'])
+def get_hashtag_posts(name):
+    if 'user_id' not in session:
+        return jsonify({"error": "You must be logged in to view posts"}), 401
+
+    try:
+        limit = parse_limit(request.args)
+        cursor = request.args.get('cursor')
+        max_id = decode_cursor(cursor)[1] if cursor else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 422
+
+    rows = hashtag_posts(name, max_id, limit)
+    posts_data = [{
+        "id": row.id,
+        "title": row.title,
+        "content": row.content,
+        "created_at": row.created_at,
         "author": {
-            "id": post.author.id,
-            "username": post.author.username
+            "id": row.author_id,
+            "username": row.author_username
         }
-    } for post in posts]
+    } for row in rows]
+    next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id) if len(rows) == limit else None
 
-    return jsonify(posts_data), 200
+    return jsonify({"posts": posts_data, "next_cursor": next_cursor}), 200
 
 # Follow a user route
 @auth_bp.route('/follow/<int:followed_id>', methods=['POST'])
@@ -145,8 +560,8 @@ def follow_user(followed_id):
     if 'user_id' not in session:
         return jsonify({"error": "You must be logged in to follow users"}), 401
 
-    follower = User.query.get(session['user_id'])
-    followed = User.query.get(followed_id)
+    follower = load_current_user()
+    followed = get_user_snapshot(followed_id)
 
     if not followed:
         return jsonify({"error": "User to follow not found"}), 404
@@ -158,22 +573,81 @@ def follow_user(followed_id):
     if Friendship.query.filter_by(follower_id=follower.id, followed_id=followed.id).first():
         return jsonify({"error": "You are already following this user"}), 422
 
-    friendship = Friendship(follower_id=follower.id, followed_id=followed.id)
-    db.session.add(friendship)
-    db.session.commit()
+    # The unique constraint settles concurrent follows that both passed the check
+    try:
+        friendship = Friendship(follower_id=follower.id, followed_id=followed.id)
+        db.session.add(friendship)
+        db.session.flush()
+        friendship_id = friendship.id
+        count_follow(follower, followed, 1)
+        enqueue_follow_notifications(follower.id, {followed.id: friendship_id})
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"error": "You are already following this user"}), 422
+
+    backfill_timeline(follower.id, followed.id)
+    get_follow_graph().follow(follower.id, followed.id, friendship_id)
+    if get_timeline_store().is_celebrity(followed.id):
+        push_subscriptions_changed(follower.id)
 
     return jsonify({
         "message": f"You are now following {followed.username}"
     }), 200
 
+# Follow many users in one transaction: {"user_ids": [...]}. Each entry gets
+# a result: followed, already_following, not_found, duplicate or error.
+@auth_bp.route('/follow/batch', methods=['POST'])
+def follow_users_batch():
+    if 'user_id' not in session:
+        return jsonify({"error": "You must be logged in to follow users"}), 401
+
+    items, error = batch_items(request.get_json(silent=True), 'user_ids')
+    if error:
+        return jsonify({"error": error}), 422
+
+    follower = load_current_user()
+    results, wanted = [], {}
+    for index, user_id in enumerate(items):
+        result = {"index": index, "user_id": user_id}
+        if not isinstance(user_id, int) or isinstance(user_id, bool):
+            result.update({"status": "error", "error": "User ids must be integers"})
+        elif user_id == follower.id:
+            result.update({"status": "error", "error": "You cannot follow yourself"})
+        elif user_id in wanted:
+            result["status"] = "duplicate"
+        else:
+            wanted[user_id] = result
+        results.append(result)
+
+    created = {}
+    if wanted:
+        statuses, created = follow_users(follower, list(wanted))
+        if created:
+            enqueue_follow_notifications(follower.id, created)
+        db.session.commit()
+        for user_id, status in statuses.items():
+            wanted[user_id]["status"] = status
+
+    if created:
+        backfill_timelines(follower.id, list(created))
+        graph = get_follow_graph()
+        for followed_id, friendship_id in created.items():
+            graph.follow(follower.id, followed_id, friendship_id)
+        celebrities = get_timeline_store().celebrities()
+        if any(followed_id in celebrities for followed_id in created):
+            push_subscriptions_changed(follower.id)
+
+    return jsonify({"results": results, "followed": len(created)}), 200
+
 # Unfollow a user route
 @auth_bp.route('/unfollow/<int:followed_id>', methods=['DELETE'])
 def unfollow_user(followed_id):
     if 'user_id' not in session:
         return jsonify({"error": "You must be logged in to unfollow users"}), 401
 
-    follower = User.query.get(session['user_id'])
-    followed = User.query.get(followed_id)
+    follower = load_current_user()
+    followed = get_user_snapshot(followed_id)
 
     if not followed:
         return jsonify({"error": "User to unfollow not found"}), 404
@@ -184,40 +658,152 @@ def unfollow_user(followed_id):
         return jsonify({"error": "You are not following this user"}), 422
 
     db.session.delete(friendship)
+    count_follow(follower, followed, -1)
     db.session.commit()
 
+    prune_timeline(follower.id, followed.id)
+    get_follow_graph().unfollow(follower.id, followed.id)
+    if get_timeline_store().is_celebrity(followed.id):
+        push_subscriptions_changed(follower.id)
+
     return jsonify({
         "message": f"You have unfollowed {followed.username}"
     }), 200
 
-# Get notifications for the logged-in user
+# "People you may know": accounts followed by the accounts you follow
+@auth_bp.route('/suggestions', methods=['GET'])
+def get_suggestions():
+    if 'user_id' not in session:
+        return jsonify({"error": "You must be logged in to view suggestions"}), 401
+
+    try:
+        limit = parse_limit(request.args, default=10, maximum=50)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 422
+
+    ranked = get_follow_graph().suggestions(session['user_id'], limit)
+    users = {row.id: row for row in db.session.query(User.id, User.username, User.image_url)
+             .filter(User.id.in_([user_id for user_id, _ in ranked]))}
+    suggestions_data = [{
+        "id": user_id,
+        "username": users[user_id].username,
+        "image_url": users[user_id].image_url,
+        "mutual_count": mutual_count
+    } for user_id, mutual_count in ranked if user_id in users]
+
+    return jsonify({"suggestions": suggestions_data}), 200
+
+# Follow state between the logged-in user and another account
+@auth_bp.route('/relationship/<int:user_id>', methods=['GET'])
+def get_relationship(user_id):
+    if 'user_id' not in session:
+        return jsonify({"error": "You must be logged in to view relationships"}), 401
+
+    return jsonify(get_follow_graph().relationship(session['user_id'], user_id)), 200
+
+# Accounts the logged-in user follows that follow them back
+@auth_bp.route('/mutuals', methods=['GET'])
+def get_mutuals():
+    if 'user_id' not in session:
+        return jsonify({"error": "You must be logged in to view mutual follows"}), 401
+
+    try:
+        limit = parse_limit(request.args)
+        after_id = int(request.args.get('after_id', 0))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 422
+
+    ids = [user_id for user_id in get_follow_graph().mutuals(session['user_id']) if user_id > after_id][:limit]
+    rows = db.session.query(User.id, User.username, User.image_url) \
+        .filter(User.id.in_(ids)).order_by(User.id).all()
+    mutuals_data = [{"id": row.id, "username": row.username, "image_url": row.image_url} for row in rows]
+    next_after_id = ids[-1] if len(ids) == limit else None
+
+    return jsonify({"mutuals": mutuals_data, "next_after_id": next_after_id}), 200
+
+# Get notifications for the logged-in user, newest first, paged with ?limit=&cursor=
+# Only unread notifications are returned unless ?status=all
 @auth_bp.route('/notifications', methods=['GET'])
 def get_notifications():
     if 'user_id' not in session:
         return jsonify({"error": "You must be logged in to view notifications"}), 401
 
-    user = User.query.get(session['user_id'])
-    notifications = Notification.query.filter_by(user_id=user.id, read=False).all()
+    user = load_current_user()
+    etag = make_etag('notifications', user.id, notifications_version(user.id))
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    try:
+        limit = parse_limit(request.args)
+        rows, next_cursor = list_notifications(user.id, limit, request.args.get('cursor'),
+                                               unread_only=request.args.get('status', 'unread') == 'unread')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 422
+
     notifications_data = [{
-        "id": notification.id,
-        "message": notification.message,
-        "created_at": notification.created_at
-    } for notification in notifications]
+        "id": row.id,
+        "message": row.message,
+        "read": row.read,
+        "created_at": row.created_at
+    } for row in rows]
+
+    response = jsonify({"notifications": notifications_data, "next_cursor": next_cursor})
+    return with_validators(response, etag), 200
+
+# Unread badge count, read from the maintained counter
+@auth_bp.route('/notifications/unread_count', methods=['GET'])
+def get_unread_notification_count():
+    if 'user_id' not in session:
+        return jsonify({"error": "You must be logged in to view notifications"}), 401
 
-    return jsonify(notifications_data), 200
+    return jsonify({"unread": unread_count(session['user_id'])}), 200
 
-# Mark notifications as read
+# Mark notifications as read: all of them, or narrowed by
+# {"up_to_id": id}, {"before": iso timestamp} or {"ids": [...]}
 @auth_bp.route('/notifications/read', methods=['POST'])
 def mark_notifications_as_read():
     if 'user_id' not in session:
         return jsonify({"error": "You must be logged in to mark notifications"}), 401
 
-    user = User.query.get(session['user_id'])
-    notifications = Notification.query.filter_by(user_id=user.id, read=False).all()
-
-    for notification in notifications:
-        notification.read = True
-
+    data = request.get_json(silent=True) or {}
+    try:
+        up_to_id = int(data['up_to_id']) if data.get('up_to_id') is not None else None
+        # created_at is naive UTC; an offset in the timestamp is converted to it
+        before = naive_utc(datetime.fromisoformat(data['before'])) if data.get('before') else None
+        ids = [int(i) for i in data['ids']] if data.get('ids') is not None else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "up_to_id, before and ids must be an id, an ISO timestamp and a list of ids"}), 422
+
+    user = load_current_user()
+    marked = mark_read(user.id, up_to_id=up_to_id, before=before, ids=ids)
     db.session.commit()
 
-    return jsonify({"message": "Notifications marked as read"}), 200
+    return jsonify({"message": "Notifications marked as read", "marked": marked}), 200
+
+# Stream an export of the logged-in user's posts, followers, following or
+# notifications. ?format=ndjson (default) or ?format=json for one array;
+# /export/all streams everything as NDJSON tagged with a "type" field.
+@auth_bp.route('/export/<kind>', methods=['GET'])
+def export_data(kind):
+    if 'user_id' not in session:
+        return jsonify({"error": "You must be logged in to export data"}), 401
+
+    if kind != 'all' and kind not in EXPORTS:
+        return jsonify({"error": f"Unknown export '{kind}'"}), 404
+
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'json') or (kind == 'all' and export_format == 'json'):
+        return jsonify({"error": "format must be ndjson, or json for a single export"}), 422
+
+    user_id = session['user_id']
+    if export_format == 'json':
+        body, mimetype = iter_json_array(kind, user_id), 'application/json'
+    else:
+        kinds = list(EXPORTS) if kind == 'all' else [kind]
+        body, mimetype = iter_ndjson(kinds, user_id), 'application/x-ndjson'
+
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{kind}.{export_format}"'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
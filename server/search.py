@@ -0,0 +1,217 @@
+import re
+
+from sqlalchemy import Float, Integer, event, func, literal_column, select, text
+
+from dbutil import insert_ignore
+from models import db, User, Post, Hashtag, PostHashtag
+from replicas import read_only
+
+# Full-text search over posts and users, plus hashtags.
+#
+# Postgres keeps a trigger-maintained tsvector column with a GIN index on post
+# and user; SQLite uses external-content FTS5 tables kept current by triggers.
+# Both are created by migration 0004 and, for create_all() databases (tests,
+# benchmarks, seed.py), by the metadata hooks at the bottom of this module.
+#
+# Ranking only looks at the newest SEARCH_CANDIDATE_LIMIT matches, which keeps
+# common terms from forcing a rank computation over millions of rows. The
+# queries are read_only(), so they may be served by a replica.
+
+SEARCH_CANDIDATE_LIMIT = 1000
+HASHTAG_PATTERN = re.compile(r'#(\w{1,100})')
+TERM_PATTERN = re.compile(r'\w+')
+
+# tsvector expressions; {row} is NEW inside triggers or the table in backfills
+POST_VECTOR_SQL = ("setweight(to_tsvector('english', coalesce({row}.title, '')), 'A') || "
+                   "setweight(to_tsvector('english', coalesce({row}.content, '')), 'B')")
+USER_VECTOR_SQL = ("setweight(to_tsvector('simple', coalesce({row}.username, '')), 'A') || "
+                   "setweight(to_tsvector('english', coalesce({row}.bio, '')), 'B')")
+
+# The vectors are trigger-maintained rather than GENERATED columns so adding
+# them to a large table is instant; existing rows are filled by reindex.py.
+POSTGRES_DDL = [
+    "ALTER TABLE post ADD COLUMN IF NOT EXISTS search_vector tsvector",
+    "CREATE OR REPLACE FUNCTION post_search_vector_update() RETURNS trigger AS $$ BEGIN "
+    f"NEW.search_vector := {POST_VECTOR_SQL.format(row='NEW')}; RETURN NEW; END $$ LANGUAGE plpgsql",
+    "DROP TRIGGER IF EXISTS post_search_vector_trigger ON post",
+    "CREATE TRIGGER post_search_vector_trigger BEFORE INSERT OR UPDATE OF title, content ON post "
+    "FOR EACH ROW EXECUTE FUNCTION post_search_vector_update()",
+    "CREATE INDEX IF NOT EXISTS ix_post_search_vector ON post USING gin (search_vector)",
+    'ALTER TABLE "user" ADD COLUMN IF NOT EXISTS search_vector tsvector',
+    "CREATE OR REPLACE FUNCTION user_search_vector_update() RETURNS trigger AS $$ BEGIN "
+    f"NEW.search_vector := {USER_VECTOR_SQL.format(row='NEW')}; RETURN NEW; END $$ LANGUAGE plpgsql",
+    'DROP TRIGGER IF EXISTS user_search_vector_trigger ON "user"',
+    'CREATE TRIGGER user_search_vector_trigger BEFORE INSERT OR UPDATE OF username, bio ON "user" '
+    "FOR EACH ROW EXECUTE FUNCTION user_search_vector_update()",
+    'CREATE INDEX IF NOT EXISTS ix_user_search_vector ON "user" USING gin (search_vector)',
+]
+
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS post_fts USING fts5(title, content, content='post', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS post_fts_ai AFTER INSERT ON post BEGIN "
+    "INSERT INTO post_fts(rowid, title, content) VALUES (new.id, new.title, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS post_fts_ad AFTER DELETE ON post BEGIN "
+    "INSERT INTO post_fts(post_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS post_fts_au AFTER UPDATE OF title, content ON post BEGIN "
+    "INSERT INTO post_fts(post_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content); "
+    "INSERT INTO post_fts(rowid, title, content) VALUES (new.id, new.title, new.content); END",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS user_fts USING fts5(username, bio, content='user', content_rowid='id')",
+    'CREATE TRIGGER IF NOT EXISTS user_fts_ai AFTER INSERT ON "user" BEGIN '
+    "INSERT INTO user_fts(rowid, username, bio) VALUES (new.id, new.username, new.bio); END",
+    'CREATE TRIGGER IF NOT EXISTS user_fts_ad AFTER DELETE ON "user" BEGIN '
+    "INSERT INTO user_fts(user_fts, rowid, username, bio) VALUES ('delete', old.id, old.username, old.bio); END",
+    # Only searchable columns fire this, so counter updates on user don't churn the index
+    'CREATE TRIGGER IF NOT EXISTS user_fts_au AFTER UPDATE OF username, bio ON "user" BEGIN '
+    "INSERT INTO user_fts(user_fts, rowid, username, bio) VALUES ('delete', old.id, old.username, old.bio); "
+    "INSERT INTO user_fts(rowid, username, bio) VALUES (new.id, new.username, new.bio); END",
+]
+
+
+@event.listens_for(db.metadata, 'after_create')
+def _create_search_schema(target, connection, **kw):
+    statements = {'postgresql': POSTGRES_DDL, 'sqlite': SQLITE_DDL}.get(connection.dialect.name, [])
+    for statement in statements:
+        connection.exec_driver_sql(statement)
+
+
+@event.listens_for(db.metadata, 'before_drop')
+def _drop_search_schema(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        connection.exec_driver_sql('DROP TABLE IF EXISTS post_fts')
+        connection.exec_driver_sql('DROP TABLE IF EXISTS user_fts')
+
+
+def extract_hashtags(content):
+    return {tag.lower() for tag in HASHTAG_PATTERN.findall(content or '')}
+
+
+# Link posts to their hashtags: [(post_id, text), ...]. Idempotent, so the
+# reindex script can replay it over rows that were already indexed.
+def index_hashtags(connection, posts):
+    tags_by_post = {post_id: extract_hashtags(content) for post_id, content in posts}
+    names = set().union(*tags_by_post.values()) if tags_by_post else set()
+    if not names:
+        return 0
+
+    hashtag = Hashtag.__table__
+    connection.execute(insert_ignore(connection, hashtag), [{"name": name} for name in sorted(names)])
+    ids = dict(connection.execute(select(hashtag.c.name, hashtag.c.id).where(hashtag.c.name.in_(names))).all())
+
+    links = [{"post_id": post_id, "hashtag_id": ids[name]}
+             for post_id, tags in tags_by_post.items() for name in tags]
+    connection.execute(insert_ignore(connection, PostHashtag.__table__), links)
+    return len(links)
+
+
+def _fts5_query(term):
+    # Quote every word so user input can't inject FTS5 syntax
+    return ' '.join('"{}"'.format(word.replace('"', '""')) for word in TERM_PATTERN.findall(term))
+
+
+# Newest matching ids with a higher-is-better rank, as a subquery
+def _post_candidates(term):
+    if db.session.get_bind().dialect.name == 'postgresql':
+        vector = literal_column('post.search_vector')
+        query = func.websearch_to_tsquery('english', term)
+        return select(Post.id.label('id'), func.ts_rank_cd(vector, query).label('rank')) \
+            .where(vector.op('@@')(query)) \
+            .order_by(Post.id.desc()).limit(SEARCH_CANDIDATE_LIMIT).subquery('candidates')
+    return text(
+        "SELECT rowid AS id, -bm25(post_fts, 10.0, 1.0) AS rank FROM post_fts "
+        "WHERE post_fts MATCH :match ORDER BY rowid DESC LIMIT :candidates"
+    ).bindparams(match=_fts5_query(term), candidates=SEARCH_CANDIDATE_LIMIT) \
+        .columns(id=Integer, rank=Float).subquery('candidates')
+
+
+def _user_candidates(term):
+    if db.session.get_bind().dialect.name == 'postgresql':
+        vector = literal_column('"user".search_vector')
+        # Usernames are indexed unstemmed ('simple') and bios stemmed, so
+        # match either reading: 'running' must find the user running, not 'run'
+        query = func.websearch_to_tsquery('simple', term).op('||')(func.websearch_to_tsquery('english', term))
+        return select(User.id.label('id'), func.ts_rank_cd(vector, query).label('rank')) \
+            .where(vector.op('@@')(query)) \
+            .order_by(User.id.desc()).limit(SEARCH_CANDIDATE_LIMIT).subquery('candidates')
+    return text(
+        "SELECT rowid AS id, -bm25(user_fts, 10.0, 1.0) AS rank FROM user_fts "
+        "WHERE user_fts MATCH :match ORDER BY rowid DESC LIMIT :candidates"
+    ).bindparams(match=_fts5_query(term), candidates=SEARCH_CANDIDATE_LIMIT) \
+        .columns(id=Integer, rank=Float).subquery('candidates')
+
+
+@read_only()
+def search_posts(term, limit, offset):
+    if not TERM_PATTERN.search(term):
+        return []
+    candidates = _post_candidates(term)
+    return db.session.execute(
+        select(
+            Post.id,
+            Post.title,
+            Post.content,
+            Post.created_at,
+            User.id.label("author_id"),
+            User.username.label("author_username"),
+            candidates.c.rank
+        )
+        .join(candidates, candidates.c.id == Post.id)
+        .join(User, User.id == Post.user_id)
+        .order_by(candidates.c.rank.desc(), Post.id.desc())
+        .limit(limit).offset(offset)
+    ).all()
+
+
+@read_only()
+def search_users(term, limit, offset):
+    if not TERM_PATTERN.search(term):
+        return []
+    candidates = _user_candidates(term)
+    return db.session.execute(
+        select(User.id, User.username, User.image_url, User.bio, candidates.c.rank)
+        .join(candidates, candidates.c.id == User.id)
+        .order_by(candidates.c.rank.desc(), User.id.desc())
+        .limit(limit).offset(offset)
+    ).all()
+
+
+# Prefix matches as an index range scan rather than LIKE, which SQLite and
+# non-C Postgres collations can't serve from a plain btree
+def _prefix_range(column, prefix):
+    return (column >= prefix) & (column < prefix + '\U0010ffff')
+
+
+@read_only()
+def autocomplete_users(prefix, limit):
+    return db.session.execute(
+        select(User.id, User.username, User.image_url)
+        .where(_prefix_range(User.username, prefix))
+        .order_by(User.username).limit(limit)
+    ).all()
+
+
+@read_only()
+def autocomplete_hashtags(prefix, limit):
+    return db.session.execute(
+        select(Hashtag.id, Hashtag.name)
+        .where(_prefix_range(Hashtag.name, prefix.lstrip('#').lower()))
+        .order_by(Hashtag.name).limit(limit)
+    ).all()
+
+
+# Newest posts carrying a hashtag, strictly below max_id when given
+@read_only()
+def hashtag_posts(name, max_id, limit):
+    query = select(
+        Post.id,
+        Post.title,
+        Post.content,
+        Post.created_at,
+        User.id.label("author_id"),
+        User.username.label("author_username")
+    ).join(PostHashtag, PostHashtag.post_id == Post.id) \
+        .join(Hashtag, Hashtag.id == PostHashtag.hashtag_id) \
+        .join(User, User.id == Post.user_id) \
+        .where(Hashtag.name == name.lstrip('#').lower())
+    if max_id is not None:
+        query = query.where(PostHashtag.post_id < max_id)
+    return db.session.execute(query.order_by(PostHashtag.post_id.desc()).limit(limit)).all()
@@ -1,104 +1,259 @@
-from app import app, db
-from models import User, Post, Friendship, Notification
-from flask_bcrypt import Bcrypt
-from datetime import datetime
-
-bcrypt = Bcrypt(app)
-
-# Helper function to create a hashed password
-def hash_password(password):
-    return bcrypt.generate_password_hash(password).decode('utf-8')
-
-# Initialize the database with some sample data
-def seed():
-    with app.app_context():
-        # Clear the database before seeding
-        db.drop_all()
-        db.create_all()
-
-        # Create sample users
-        user1 = User(
-            username='john_doe',
-            _password_hash=hash_password('password123'),
-            image_url='https://via.placeholder.com/150',
-            bio='Hello, I am John! I love coding and coffee.'
-        )
-
-        user2 = User(
-            username='jane_smith',
-            _password_hash=hash_password('password456'),
-            image_url='https://via.placeholder.com/150',
-            bio='Hey, I am Jane. I enjoy traveling and photography.'
-        )
-
-        user3 = User(
-            username='mike_lee',
-            _password_hash=hash_password('password789'),
-            image_url='https://via.placeholder.com/150',
-            bio='Mike here! I’m a fitness enthusiast and tech lover.'
-        )
-
-        db.session.add(user1)
-        db.session.add(user2)
-        db.session.add(user3)
-        db.session.commit()
-
-        # Create sample posts
-        post1 = Post(
-            title="My First Post",
-            content="This is my first post on ConnectSphere! Excited to connect with others.",
-            user_id=user1.id,
-            created_at=datetime.utcnow()
-        )
-
-        post2 = Post(
-            title="Exploring New Places",
-            content="Had an amazing trip to the mountains last weekend. The view was breathtaking!",
-            user_id=user2.id,
-            created_at=datetime.utcnow()
-        )
-
-        post3 = Post(
-            title="Fitness Journey",
-            content="Started my fitness journey today! Let’s make it a lifestyle.",
-            user_id=user3.id,
-            created_at=datetime.utcnow()
-        )
-
-        db.session.add(post1)
-        db.session.add(post2)
-        db.session.add(post3)
-        db.session.commit()
-
-        # Create sample friendships (user1 follows user2, user2 follows user3)
-        friendship1 = Friendship(follower_id=user1.id, followed_id=user2.id)
-        friendship2 = Friendship(follower_id=user2.id, followed_id=user3.id)
-
-        db.session.add(friendship1)
-        db.session.add(friendship2)
-        db.session.commit()
-
-        # Create sample notifications
-        notification1 = Notification(
-            user_id=user2.id,
-            message=f"{user1.username} has followed you.",
-            created_at=datetime.utcnow(),
-            read=False
-        )
-
-        notification2 = Notification(
-            user_id=user3.id,
-            message=f"{user2.username} has followed you.",
-            created_at=datetime.utcnow(),
-            read=False
-        )
-
-        db.session.add(notification1)
-        db.session.add(notification2)
-        db.session.commit()
-
-        print("Database seeded successfully!")
-
-# Run the seeding function
+import argparse
+import csv
+import io
+import itertools
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert
+
+from config import Config
+from hashing import PasswordHasher
+from models import db, User, Post, Friendship, Notification
+from partitions import allocate_ids, ensure_partitions, native_partitioning, partition_name, partition_table, period_start
+from reindex import backfill_hashtags
+from repair_counters import repair_counters
+
+# Synthetic data generator. Drops and recreates all tables.
+#
+#   python seed.py                                   # small demo dataset
+#   python seed.py --users 1000000 --posts-per-user 10 \
+#       --database-url postgresql://localhost/connectsphere_load
+#
+# Rows are generated lazily and written in chunks: COPY on Postgres,
+# executemany on SQLite, multi-row INSERT elsewhere; notifications go
+# straight into their monthly partitions. Passwords come from a
+# small pool hashed once in the password hashing process pool. The same
+# --seed always produces the same data.
+
+DEMO_USERS = [
+    ('john_doe', 'password123', 'Hello, I am John! I love coding and coffee.'),
+    ('jane_smith', 'password456', 'Hey, I am Jane. I enjoy traveling and photography.'),
+    ('mike_lee', 'password789', 'Mike here! I’m a fitness enthusiast and tech lover.'),
+]
+WORDS = ('coffee code travel photo fitness music launch weekend city mountain book '
+         'design startup garden recipe game film sunset team idea').split()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Seed the database with synthetic data")
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL', Config.SQLALCHEMY_DATABASE_URI))
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--posts-per-user', type=float, default=5)
+    parser.add_argument('--follows-per-user', type=float, default=20,
+                        help="mean out-degree; followers are power-law distributed")
+    parser.add_argument('--follow-skew', type=float, default=1.1,
+                        help="Zipf exponent of follower popularity")
+    parser.add_argument('--notifications-per-user', type=float, default=5)
+    parser.add_argument('--unread-ratio', type=float, default=0.3)
+    parser.add_argument('--password-pool', type=int, default=8)
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    parser.add_argument('--days', type=int, default=365, help="spread post timestamps over this many days")
+    parser.add_argument('--seed', type=int, default=42)
+    return parser.parse_args(argv)
+
+
+def hash_password_pool(args):
+    hasher = PasswordHasher(rounds=Config.BCRYPT_LOG_ROUNDS, queue_size=len(DEMO_USERS) + args.password_pool)
+    passwords = [password for _, password, _ in DEMO_USERS] + [f'password{i}' for i in range(args.password_pool)]
+    futures = [hasher.hash_async(password) for password in passwords]
+    hashes = [future.result() for future in futures]
+    hasher.shutdown()
+    return hashes[:len(DEMO_USERS)], hashes[len(DEMO_USERS):]
+
+
+# Rough Poisson-like count with the given mean, cheap to draw millions of
+def draw_count(rng, mean):
+    if mean <= 0:
+        return 0
+    return int(rng.expovariate(1 / mean) + 0.5)
+
+
+class Loader:
+    def __init__(self, engine, chunk_size):
+        self.engine = engine
+        self.chunk_size = chunk_size
+        self.use_copy = engine.dialect.name == 'postgresql'
+
+    def load(self, table, columns, rows):
+        total = 0
+        rows = iter(rows)
+        while True:
+            chunk = list(itertools.islice(rows, self.chunk_size))
+            if not chunk:
+                return total
+            self._write(table, columns, chunk)
+            total += len(chunk)
+
+    # Like load(), but each row goes to the table route(row) returns
+    def load_routed(self, route, columns, rows):
+        total = 0
+        rows = iter(rows)
+        while True:
+            chunk = list(itertools.islice(rows, self.chunk_size))
+            if not chunk:
+                return total
+            groups = {}
+            for row in chunk:
+                groups.setdefault(route(row), []).append(row)
+            for table, group in groups.items():
+                self._write(table, columns, group)
+            total += len(chunk)
+
+    def _write(self, table, columns, chunk):
+        if self.use_copy:
+            self._copy(table, columns, chunk)
+        elif self.engine.dialect.name == 'sqlite':
+            self._executemany(table, columns, chunk)
+        else:
+            with self.engine.begin() as connection:
+                connection.execute(insert(table), [dict(zip(columns, row)) for row in chunk])
+
+    # Plain DBAPI executemany skips per-row statement compilation in SQLAlchemy
+    def _executemany(self, table, columns, chunk):
+        sql = f'INSERT INTO "{table.name}" ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})'
+        raw = self.engine.raw_connection()
+        try:
+            raw.cursor().executemany(sql, chunk)
+            raw.commit()
+        finally:
+            raw.close()
+
+    def _copy(self, table, columns, chunk):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in chunk:
+            writer.writerow(r'\N' if value is None else value for value in row)
+        buffer.seek(0)
+        raw = self.engine.raw_connection()
+        try:
+            with raw.cursor() as cursor:
+                cursor.copy_expert(
+                    f'COPY "{table.name}" ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv, NULL \'\\N\')',
+                    buffer
+                )
+            raw.commit()
+        finally:
+            raw.close()
+
+
+def seed(args):
+    rng = random.Random(args.seed)
+    engine = create_engine(args.database_url)
+    if engine.dialect.name == 'sqlite':
+        with engine.begin() as connection:
+            connection.exec_driver_sql('PRAGMA journal_mode=WAL')
+            connection.exec_driver_sql('PRAGMA synchronous=OFF')
+
+    # Like the original seed script this starts from empty tables, which also
+    # guarantees user ids 1..n for the rows generated below
+    db.metadata.drop_all(engine)
+    db.metadata.create_all(engine)
+    loader = Loader(engine, args.chunk_size)
+    n = args.users
+    now = datetime.utcnow()
+
+    def step(label, count, started):
+        print(f"{label:>14}: {count:>10} rows in {time.perf_counter() - started:6.1f}s")
+
+    started = time.perf_counter()
+    demo_hashes, pool_hashes = hash_password_pool(args)
+    step('password pool', len(demo_hashes) + len(pool_hashes), started)
+
+    # Decide notification counts up front so the unread counter is loaded with the users
+    notification_counts = [draw_count(rng, args.notifications_per_user) for _ in range(n)]
+    unread_counts = [sum(rng.random() < args.unread_ratio for _ in range(count)) for count in notification_counts]
+
+    def user_rows():
+        for i in range(n):
+            if i < len(DEMO_USERS):
+                username, _, bio = DEMO_USERS[i]
+                password_hash = demo_hashes[i]
+            else:
+                username, bio = f'user{i + 1}', f'I like {rng.choice(WORDS)} and {rng.choice(WORDS)}.'
+                password_hash = pool_hashes[i % len(pool_hashes)]
+            yield (username, password_hash, 'https://via.placeholder.com/150', bio, unread_counts[i])
+
+    started = time.perf_counter()
+    count = loader.load(User.__table__, ('username', '_password_hash', 'image_url', 'bio', 'unread_notifications'),
+                        user_rows())
+    step('users', count, started)
+
+    # User ids are 1..n on freshly created tables
+    def post_rows():
+        total = int(n * args.posts_per_user)
+        span = timedelta(days=args.days).total_seconds()
+        for i in range(total):
+            created_at = now - timedelta(seconds=span * (1 - i / max(total, 1)))
+            title = ' '.join(rng.choices(WORDS, k=3)).capitalize()
+            content = ' '.join(rng.choices(WORDS, k=20)) + f' #{rng.choice(WORDS)}'
+            yield (title, content, rng.randint(1, n), created_at)
+
+    started = time.perf_counter()
+    count = loader.load(Post.__table__, ('title', 'content', 'user_id', 'created_at'), post_rows())
+    step('posts', count, started)
+
+    # The text index is kept by triggers; hashtag links are derived here
+    started = time.perf_counter()
+    count = backfill_hashtags(engine, args.chunk_size)
+    step('hashtags', count, started)
+
+    # Followed accounts are drawn from a Zipf distribution over a shuffled
+    # popularity ranking, so a few accounts collect most of the followers
+    ranking = list(range(1, n + 1))
+    rng.shuffle(ranking)
+    cum_weights = list(itertools.accumulate(1 / (rank ** args.follow_skew) for rank in range(1, n + 1)))
+
+    def follow_rows():
+        for follower_id in range(1, n + 1):
+            k = min(draw_count(rng, args.follows_per_user), n - 1)
+            followed = set(rng.choices(ranking, cum_weights=cum_weights, k=k))
+            followed.discard(follower_id)
+            for followed_id in sorted(followed):
+                yield (follower_id, followed_id, now)
+
+    started = time.perf_counter()
+    count = loader.load(Friendship.__table__, ('follower_id', 'followed_id', 'created_at'), follow_rows())
+    step('follows', count, started)
+
+    def notification_rows():
+        for user_index in range(n):
+            total, unread = notification_counts[user_index], unread_counts[user_index]
+            for j in range(total):
+                actor = rng.randint(1, n)
+                created_at = now - timedelta(minutes=rng.randint(0, args.days * 24 * 60))
+                yield (user_index + 1, f'user{actor} has followed you.', j < total - unread, created_at)
+
+    started = time.perf_counter()
+    columns = ('user_id', 'message', 'read', 'created_at')
+    with engine.begin() as connection:
+        ensure_partitions(connection, now - timedelta(days=args.days), now)
+        native = native_partitioning(connection)
+    if native:
+        count = loader.load(Notification.__table__, columns, notification_rows())
+    else:
+        # Rows are numbered here and the ids claimed from the sequence afterwards
+        ids = itertools.count(1)
+        count = loader.load_routed(lambda row: partition_table(partition_name(period_start(row[-1]))),
+                                   ('id',) + columns, ((next(ids),) + row for row in notification_rows()))
+        with engine.begin() as connection:
+            allocate_ids(connection, count)
+    step('notifications', count, started)
+
+    # Profile stats are derived from the rows above with the repair job's grouped counts
+    started = time.perf_counter()
+    count = repair_counters(engine, args.chunk_size, verbose=False)
+    step('counters', count, started)
+
+    if engine.dialect.name == 'postgresql':
+        # Refresh planner statistics after the bulk load
+        with engine.begin() as connection:
+            connection.exec_driver_sql('ANALYZE')
+
+    print("Database seeded successfully!")
+
+
 if __name__ == '__main__':
-    seed()
+    seed(parse_args())
@@ -0,0 +1,45 @@
+import os
+import sys
+
+import pytest
+
+# The server modules import each other by bare name (`from models import db`)
+# and the benchmark scripts do the same with `common`. Several benchmarks
+# share a name with the module they measure, so they go last
+SERVER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER)
+sys.path.append(os.path.join(SERVER, 'benchmarks'))
+
+from app import create_app  # noqa: E402
+from models import db, User  # noqa: E402
+
+
+# The production app under config.TestingConfig, on TEST_DATABASE_URL when
+# set (Postgres) and a throwaway SQLite file otherwise
+@pytest.fixture
+def app(tmp_path):
+    app = create_app(config_object='config.TestingConfig',
+                     SQLALCHEMY_DATABASE_URI=os.environ.get('TEST_DATABASE_URL') or f"sqlite:///{tmp_path / 'test.db'}",
+                     MEDIA_ROOT=str(tmp_path / 'media'))
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+# make_user('alice') -> the committed User, password 'password'
+@pytest.fixture
+def make_user(app):
+    def make_user(username):
+        user = User(username=username, password='password')
+        db.session.add(user)
+        db.session.commit()
+        return user
+    return make_user
@@ -0,0 +1,152 @@
+import threading
+
+import pytest
+
+import admission
+from admission import AdaptiveLimiter, MemoryBucketStore
+from app import create_app
+from models import db
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(admission.time, 'monotonic', clock)
+    return clock
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app(config_object='config.TestingConfig',
+                     SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'test.db'}",
+                     ADMISSION_ENABLED=True,
+                     RATE_LIMITS={'read': (0.5, 2), 'auth': (100, 100)},
+                     RATE_LIMIT_LOGIN=(0.05, 3))
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
+
+
+def test_bucket_allows_a_burst_then_refills(clock):
+    store = MemoryBucketStore()
+
+    assert [store.take('key', 1, 3) for _ in range(3)] == [2, 1, 0]
+    assert store.take('key', 1, 3) == -1
+
+    clock.now += 1.5
+    assert store.take('key', 1, 3) == 0.5
+    # Never refills past the burst
+    clock.now += 60
+    assert store.take('key', 1, 3) == 2
+    assert store.take('other', 1, 3) == 2
+
+
+def test_bucket_store_evicts_least_recently_used_keys(clock):
+    store = MemoryBucketStore(max_keys=2)
+    store.take('a', 1, 1)
+    store.take('b', 1, 1)
+    store.take('a', 1, 1)
+    store.take('c', 1, 1)
+
+    # 'a' is still empty; 'b' was forgotten and starts full again
+    assert store.take('a', 1, 1) < 0
+    assert store.take('b', 1, 1) == 0
+
+
+def test_limiter_queues_then_rejects():
+    limiter = AdaptiveLimiter(initial_limit=1, queue_size=1, queue_timeout=0.05)
+    assert limiter.acquire() == (True, 0.0)
+
+    admitted, waited = limiter.acquire()
+    assert not admitted
+    assert waited >= 0.05
+
+    # With the one queue slot taken, the next caller is turned away at once
+    limiter.queue_size = 0
+    assert limiter.acquire() == (False, 0.0)
+
+
+def test_limiter_hands_a_released_slot_to_a_waiter():
+    limiter = AdaptiveLimiter(initial_limit=1, queue_timeout=5)
+    limiter.acquire()
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(limiter.acquire()))
+    waiter.start()
+    while limiter.waiting == 0:
+        pass
+
+    limiter.release(0.01)
+    waiter.join()
+
+    [(admitted, waited)] = results
+    assert admitted and waited > 0
+    assert limiter.in_flight == 1
+
+
+def test_limiter_grows_while_busy_and_shrinks_when_latency_climbs():
+    limiter = AdaptiveLimiter(initial_limit=10, sample_size=5)
+    for _ in range(10):
+        limiter.acquire()
+
+    for _ in range(5):
+        limiter.release(0.01)
+    grown = limiter.limit
+    assert grown > 10
+
+    for _ in range(5):
+        limiter.acquire()
+        limiter.release(0.1)
+    assert limiter.limit < grown
+    assert limiter.limit >= limiter.min_limit
+
+
+def test_idle_limiter_does_not_grow():
+    limiter = AdaptiveLimiter(initial_limit=10, sample_size=5)
+    for _ in range(5):
+        limiter.acquire()
+        limiter.release(0.01)
+    assert limiter.limit == 10
+
+
+def test_rate_limited_requests_get_429(client):
+    statuses = [client.get('/check_session').status_code for _ in range(3)]
+
+    assert statuses == [401, 401, 429]
+    response = client.get('/check_session')
+    assert int(response.headers['Retry-After']) >= 1
+
+
+def test_full_limiter_answers_503(app, client):
+    app.config['ADMISSION_CLASS_SETTINGS'] = {'read': {"initial_limit": 1, "min_limit": 1, "queue_size": 0}}
+    limiter = app.extensions['admission'].limiter('read')
+    limiter.acquire()
+
+    response = client.get('/check_session')
+
+    assert response.status_code == 503
+    assert int(response.headers['Retry-After']) >= 1
+    limiter.release(0.01)
+    assert client.get('/check_session').status_code == 401
+
+
+# Failed logins spend from a bucket for the username at this address; the
+# right password is then refused too, but other accounts are unaffected
+def test_failed_logins_are_rate_limited_per_username(client, make_user):
+    make_user('alice')
+    make_user('bob')
+    for _ in range(3):
+        assert client.post('/login', json={"username": "alice", "password": "wrong"}).status_code == 401
+
+    assert client.post('/login', json={"username": "alice", "password": "password"}).status_code == 429
+    assert client.post('/login', json={"username": "bob", "password": "password"}).status_code == 200
@@ -0,0 +1,31 @@
+from common import login_as
+from identity import get_identity_cache
+
+
+def test_profile_reads_come_from_the_cache(client, make_user):
+    alice = make_user('alice')
+    login_as(client, alice.id)
+
+    assert client.get('/profile').get_json()["username"] == 'alice'
+    misses = get_identity_cache().stats()["misses"]
+    assert client.get('/profile').get_json()["username"] == 'alice'
+    assert get_identity_cache().stats()["misses"] == misses
+
+
+def test_current_user_follows_the_session(app, make_user):
+    alice, bob = make_user('alice'), make_user('bob')
+    first, second = app.test_client(), app.test_client()
+    login_as(first, alice.id)
+    login_as(second, bob.id)
+
+    assert first.get('/profile').get_json()["username"] == 'alice'
+    assert second.get('/profile').get_json()["username"] == 'bob'
+    assert first.delete('/logout').status_code == 204
+    assert first.get('/profile').status_code == 401
+
+
+def test_signup_logs_the_new_user_in(client):
+    response = client.post('/signup', json={"username": "carol", "password": "password"})
+    assert response.status_code == 201
+
+    assert client.get('/profile').get_json()["username"] == 'carol'
@@ -0,0 +1,144 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func, select, update
+
+import jobs
+from jobs import DONE, FAILED, PENDING, RUNNING, JobQueue, enqueue
+from models import db, Job, User
+
+
+# A queue without worker threads; tests drive claim() and execute() by hand
+@pytest.fixture
+def queue(app):
+    return JobQueue(app, workers=0, visibility_timeout=60, retry_backoff=10)
+
+
+# Registers a test handler that raises for the first `failures` runs and
+# otherwise adds a user named in the payload; returns the list of runs
+@pytest.fixture
+def handler(monkeypatch):
+    runs = []
+
+    def install(failures=0):
+        def run(payload):
+            runs.append(payload)
+            if len(runs) <= failures:
+                raise RuntimeError(f"boom {len(runs)}")
+            db.session.add(User(username=payload["username"], password='password'))
+        monkeypatch.setitem(jobs.HANDLERS, 'test', run)
+        return runs
+    return install
+
+
+# Queue a job that isn't due yet, so the commit doesn't run it inline (the
+# app's own queue still does, along with the periodic jobs it schedules)
+def queue_job(username, **kwargs):
+    enqueue('test', {"username": username}, delay=3600, **kwargs)
+    db.session.commit()
+    return db.session.execute(select(Job.id).where(Job.kind == 'test')).scalar_one()
+
+
+# Move run_at into the past: a pending job becomes due, a lease runs out
+def make_due(job_id):
+    db.session.execute(update(Job.__table__).where(Job.__table__.c.id == job_id)
+                       .values(run_at=datetime.utcnow() - timedelta(seconds=1)))
+    db.session.commit()
+
+
+def job_row(job_id):
+    db.session.expire_all()
+    return db.session.get(Job, job_id)
+
+
+def users():
+    return db.session.execute(select(User.username)).scalars().all()
+
+
+def test_claim_leases_the_job(queue, handler):
+    handler()
+    job_id = queue_job('alice')
+    assert queue.claim(10) == []
+
+    make_due(job_id)
+    [job] = queue.claim(10)
+
+    assert (job.id, job.attempts, job.payload) == (job_id, 1, {"username": "alice"})
+    row = job_row(job_id)
+    assert row.status == RUNNING
+    assert row.run_at > datetime.utcnow() + timedelta(seconds=50)
+    # Leased: nobody else gets it until the visibility timeout
+    assert queue.claim(10) == []
+
+    assert queue.execute(job) == 'done'
+    assert job_row(job_id).status == DONE
+    assert users() == ['alice']
+
+
+def test_failed_job_is_retried_with_backoff(queue, handler):
+    runs = handler(failures=1)
+    job_id = queue_job('alice')
+    make_due(job_id)
+
+    assert queue.execute(queue.claim(10)[0]) == 'retry'
+    row = job_row(job_id)
+    assert row.status == PENDING
+    assert row.last_error == "RuntimeError: boom 1"
+    assert row.run_at > datetime.utcnow() + timedelta(seconds=4)
+    assert queue.claim(10) == []
+
+    make_due(job_id)
+    job = queue.claim(10)[0]
+    assert job.attempts == 2
+    assert queue.execute(job) == 'done'
+    assert job_row(job_id).status == DONE
+    assert len(runs) == 2
+    assert users() == ['alice']
+
+
+def test_job_is_dead_lettered_after_max_attempts(queue, handler):
+    handler(failures=10)
+    job_id = queue_job('alice', max_attempts=2)
+
+    outcomes = []
+    for _ in range(2):
+        make_due(job_id)
+        outcomes.append(queue.execute(queue.claim(10)[0]))
+
+    assert outcomes == ['retry', 'failed']
+    row = job_row(job_id)
+    assert (row.status, row.attempts, row.last_error) == (FAILED, 2, "RuntimeError: boom 2")
+    assert row.finished_at is not None
+    make_due(job_id)
+    assert queue.claim(10) == []
+    assert queue.depth()["failed"] == 1
+    assert users() == []
+
+
+# A worker that outlives its lease must not settle the job or keep its
+# writes once another claim has taken over
+def test_expired_lease_is_reclaimed_and_the_old_run_fenced(queue, handler):
+    runs = handler()
+    job_id = queue_job('alice')
+    make_due(job_id)
+    stale = queue.claim(10)[0]
+
+    make_due(job_id)
+    fresh = queue.claim(10)[0]
+    assert (stale.attempts, fresh.attempts) == (1, 2)
+
+    assert queue.execute(stale) == 'lost'
+    assert job_row(job_id).status == RUNNING
+    assert users() == []
+
+    assert queue.execute(fresh) == 'done'
+    assert job_row(job_id).status == DONE
+    assert len(runs) == 2
+    assert users() == ['alice']
+
+
+def test_idempotency_key_drops_the_second_enqueue(app):
+    assert enqueue('test', {}, idempotency_key='once', delay=3600)
+    assert not enqueue('test', {}, idempotency_key='once', delay=3600)
+    db.session.commit()
+    assert db.session.execute(select(func.count()).where(Job.idempotency_key == 'once')).scalar() == 1
@@ -0,0 +1,42 @@
+from metrics import MetricsRegistry
+from models import db
+
+
+def test_render_keeps_full_precision():
+    registry = MetricsRegistry()
+    registry.inc('requests_total', (), 1234567)
+    registry.inc('requests_total', (), 1)
+    registry.observe('latency_seconds', (), 1234567.125, (1.0,))
+    registry.add_gauges(lambda: [('queue_depth', (), 7654321.5)])
+
+    lines = registry.render().splitlines()
+
+    assert 'requests_total 1234568' in lines
+    assert 'latency_seconds_sum 1234567.125' in lines
+    assert 'queue_depth 7654321.5' in lines
+
+
+def test_counter_callbacks_are_typed_as_counters():
+    registry = MetricsRegistry()
+    registry.add_counters(lambda: [('cache_hits_total', (), 3)])
+
+    assert registry.render().splitlines() == ['# TYPE cache_hits_total counter', 'cache_hits_total 3']
+
+
+def test_failed_statement_releases_its_start_time(app):
+    with db.engine.connect() as connection:
+        for _ in range(3):
+            try:
+                connection.exec_driver_sql('SELECT * FROM no_such_table')
+            except Exception:
+                pass
+        connection.exec_driver_sql('SELECT 1')
+        assert connection.info['query_start'] == []
+
+
+def test_metrics_endpoint(client):
+    client.get('/check_session')
+
+    body = client.get('/metrics').get_data(as_text=True)
+
+    assert 'http_requests_total{' in body
@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta, timezone
+
+from common import login_as
+from models import db
+from notifications import create_notifications, unread_count
+from partitions import notification_tables, partition_name, period_start
+
+
+def test_notification_tables_accepts_aware_bounds(app):
+    now = datetime.utcnow()
+    connection = db.session.connection()
+    naive = [table.name for table in notification_tables(connection, until=now)]
+    aware = [table.name for table in notification_tables(connection, until=now.replace(tzinfo=timezone.utc))]
+    assert aware == naive
+    assert partition_name(period_start(now)) in aware
+
+
+# Regression: an aware "before" used to reach the partition pruning as-is
+# and fail comparing naive and aware datetimes (500)
+def test_mark_read_before_with_timezone(client, make_user):
+    user = make_user('alice')
+    create_notifications([{"user_id": user.id, "message": "hello"},
+                          {"user_id": user.id, "message": "again"}])
+    db.session.commit()
+    login_as(client, user.id)
+
+    response = client.post('/notifications/read', json={"before": "2030-01-01T00:00:00Z"})
+
+    assert response.status_code == 200
+    assert response.get_json()["marked"] == 2
+    assert unread_count(user.id) == 0
+
+
+def test_mark_read_before_leaves_newer_notifications(client, make_user):
+    user = make_user('alice')
+    now = datetime.utcnow()
+    create_notifications([{"user_id": user.id, "message": "old", "created_at": now - timedelta(hours=2)},
+                          {"user_id": user.id, "message": "new", "created_at": now}])
+    db.session.commit()
+    login_as(client, user.id)
+
+    cutoff = (now - timedelta(hours=1)).replace(tzinfo=timezone.utc).isoformat()
+    response = client.post('/notifications/read', json={"before": cutoff})
+
+    assert response.status_code == 200
+    assert response.get_json()["marked"] == 1
+    assert unread_count(user.id) == 1
+
+
+def test_mark_read_before_converts_offsets_to_utc(client, make_user):
+    user = make_user('alice')
+    now = datetime.utcnow().replace(microsecond=0)
+    create_notifications([{"user_id": user.id, "message": "old", "created_at": now - timedelta(hours=2)},
+                          {"user_id": user.id, "message": "new", "created_at": now}])
+    db.session.commit()
+    login_as(client, user.id)
+
+    # One hour ago in UTC, written at +05:00
+    cutoff = (now - timedelta(hours=1)).replace(tzinfo=timezone.utc).astimezone(timezone(timedelta(hours=5)))
+    response = client.post('/notifications/read', json={"before": cutoff.isoformat()})
+
+    assert response.get_json()["marked"] == 1
+    assert unread_count(user.id) == 1
+
+
+def test_mark_read_rejects_unparseable_before(client, make_user):
+    user = make_user('alice')
+    login_as(client, user.id)
+
+    for before in ("yesterday", 12345, ["2030-01-01"]):
+        assert client.post('/notifications/read', json={"before": before}).status_code == 422
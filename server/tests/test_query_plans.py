@@ -0,0 +1,50 @@
+import os
+
+import pytest
+
+from common import make_app, login_as
+from models import db
+from query_plans import SCENARIOS, seed, scenario_placeholders, run_scenario
+
+# Query-plan regression tests for the hot endpoints: every statement each
+# scenario issues must be served without a sequential scan of an application
+# table. Runs against TEST_DATABASE_URL when set (Postgres), otherwise a
+# throwaway SQLite file. For planner behaviour at production-like row counts
+# run benchmarks/query_plans.py against Postgres instead.
+
+USERS = 300
+
+
+@pytest.fixture(scope='module')
+def app(tmp_path_factory):
+    database_url = os.environ.get('TEST_DATABASE_URL') or \
+        f"sqlite:///{tmp_path_factory.mktemp('plans') / 'plans.db'}"
+    app = make_app(database_url)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed(USERS, posts_per_user=10, follows_per_user=20, notifications_per_user=10, likes_per_user=5)
+        if db.engine.dialect.name == 'postgresql':
+            db.session.execute(db.text('ANALYZE'))
+            db.session.commit()
+        yield app
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
+
+
+@pytest.fixture(scope='module')
+def logged_in(app):
+    client = app.test_client()
+    login_as(client, 1)
+    return client, scenario_placeholders(client, USERS)
+
+
+# SCENARIOS is ordered (follow before unfollow, like before unlike), and so
+# are the parametrized cases
+@pytest.mark.parametrize('name,method,path,body', SCENARIOS, ids=[scenario[0] for scenario in SCENARIOS])
+def test_no_sequential_scans(logged_in, name, method, path, body):
+    client, placeholders = logged_in
+    response, plans = run_scenario(client, method, path.format(**placeholders), body)
+    assert response.status_code < 400, (name, response.status_code, response.get_data(as_text=True))
+    assert [(statement, scans) for statement, _, scans in plans if scans] == []
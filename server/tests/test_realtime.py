@@ -0,0 +1,100 @@
+import pytest
+
+from common import login_as
+from models import db, Friendship
+from notifications import create_notifications
+from realtime import NAMESPACE, EmitCoalescer, author_room, push_post, socketio, user_room
+from timeline import get_timeline_store
+
+# Socket.IO delivery with SOCKETIO_MESSAGE_QUEUE unset, so everything stays
+# in-process. Frames are captured where the coalescer hands them to
+# Socket.IO, and room membership is read from the server's manager: the
+# Flask-SocketIO test client doesn't see broadcast emits from current
+# python-socketio releases.
+
+
+@pytest.fixture
+def emitted(app):
+    frames = []
+    app.extensions['realtime'] = EmitCoalescer(lambda *frame: frames.append(frame), 0, None, None)
+    return frames
+
+
+# The session cookie is passed by hand: Flask-SocketIO's flask_test_client
+# option reads a cookie jar newer Werkzeug test clients no longer have
+def connect(app, client, user_id=None):
+    if user_id is not None:
+        login_as(client, user_id)
+    cookie = client.get_cookie(app.config['SESSION_COOKIE_NAME'])
+    headers = {'Cookie': f"{cookie.key}={cookie.value}"} if cookie is not None else None
+    return socketio.test_client(app, namespace=NAMESPACE, headers=headers)
+
+
+def in_room(live, room):
+    return live.eio_sid in {eio_sid for _, eio_sid in socketio.server.manager.get_participants(NAMESPACE, room)}
+
+
+def test_connect_requires_a_session(app, client):
+    assert not connect(app, client).is_connected(NAMESPACE)
+
+
+def test_connect_joins_the_user_and_followed_celebrity_rooms(app, client, make_user):
+    alice, star, bob = make_user('alice'), make_user('star'), make_user('bob')
+    db.session.add_all([Friendship(follower_id=alice.id, followed_id=star.id),
+                        Friendship(follower_id=alice.id, followed_id=bob.id)])
+    db.session.commit()
+    get_timeline_store().mark_celebrity(star.id)
+
+    live = connect(app, client, alice.id)
+
+    assert live.is_connected(NAMESPACE)
+    assert in_room(live, user_room(alice.id))
+    assert in_room(live, author_room(star.id))
+    assert not in_room(live, author_room(bob.id))
+
+
+def test_notifications_are_pushed_on_commit(make_user, emitted):
+    alice, bob = make_user('alice'), make_user('bob')
+
+    create_notifications([{"user_id": alice.id, "message": "hello"}, {"user_id": bob.id, "message": "hi"}])
+    assert emitted == []
+    db.session.commit()
+
+    frames = {tuple(rooms): [item["message"] for item in data["items"]] for _, data, rooms in emitted}
+    assert [event_name for event_name, _, _ in emitted] == ['notifications', 'notifications']
+    assert frames == {(user_room(alice.id),): ["hello"], (user_room(bob.id),): ["hi"]}
+
+
+def test_rolled_back_notifications_are_not_pushed(make_user, emitted):
+    alice = make_user('alice')
+
+    create_notifications([{"user_id": alice.id, "message": "hello"}])
+    db.session.rollback()
+    db.session.commit()
+
+    assert emitted == []
+
+
+def test_celebrity_posts_also_go_to_the_author_room(emitted):
+    post = {"id": 1, "title": "hi", "author": {"id": 7}}
+    push_post(post, [1, 2], celebrity=True)
+    push_post(post, [3], celebrity=False)
+
+    assert emitted == [('posts', {"items": [post]}, [user_room(1), user_room(2), author_room(7)]),
+                       ('posts', {"items": [post]}, [user_room(3)])]
+
+
+def test_coalescer_sends_identical_frames_in_one_emit():
+    emitted, tasks = [], []
+    coalescer = EmitCoalescer(lambda *frame: emitted.append(frame), 0.05, tasks.append, lambda seconds: None)
+    item = {"id": 1}
+
+    coalescer.add('posts', [user_room(1), user_room(2)], item)
+    coalescer.add('notifications', [user_room(1)], {"id": 2})
+    assert emitted == [] and len(tasks) == 1
+
+    tasks[0]()
+    assert sorted(emitted, key=lambda frame: frame[0]) == [
+        ('notifications', {"items": [{"id": 2}]}, [user_room(1)]),
+        ('posts', {"items": [item]}, [user_room(1), user_room(2)]),
+    ]
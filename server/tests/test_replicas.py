@@ -0,0 +1,116 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import insert
+
+from app import create_app
+from common import login_as, StatementRecorder
+from export import iter_rows
+from identity import get_user_snapshot
+from models import db, User, Post
+from replicas import READ_YOUR_WRITES_COOKIE, _read_only
+from search import search_users
+
+# Read routing against two SQLite files, the second configured as a replica.
+# Both get the same schema and rows; which engine a statement ran on tells
+# where it was routed. Requests made while a test holds an app context share
+# its session, so tests drop it between steps the way a request's teardown
+# would.
+
+
+def _seed(engine):
+    now = datetime.utcnow()
+    with engine.begin() as connection:
+        connection.execute(insert(User.__table__), [{"id": 1, "username": "alice", "_password_hash": "x"}])
+        connection.execute(insert(Post.__table__), [{"id": 1, "title": "hello", "content": "world", "user_id": 1,
+                                                     "created_at": now}])
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app(config_object='config.TestingConfig',
+                     SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'primary.db'}",
+                     DATABASE_REPLICA_URLS=[f"sqlite:///{tmp_path / 'replica.db'}"])
+    with app.app_context():
+        db.create_all()
+        db.metadata.create_all(db.engines['replica_1'])
+        for engine in db.engines.values():
+            _seed(engine)
+        yield app
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+    # init_app registered a metadata for the replica bind on the shared db;
+    # later apps without that bind would fail in create_all()
+    db.metadatas.pop('replica_1', None)
+
+
+@pytest.fixture
+def routed(app):
+    primary = StatementRecorder(db.engines[None])
+    replica = StatementRecorder(db.engines['replica_1'])
+    with primary, replica:
+        yield primary, replica
+
+
+def test_marked_reads_outside_requests_use_the_replica(routed):
+    primary, replica = routed
+
+    assert [row.username for row in search_users('alice', 10, 0)] == ['alice']
+    assert replica.statements and not primary.statements
+
+    db.session.remove()
+    db.session.query(User).count()
+    assert len(primary.statements) == 1
+
+
+def test_post_requests_send_only_marked_reads_to_the_replica(app, routed):
+    primary, replica = routed
+    with app.test_request_context('/', method='POST'):
+        db.session.query(User.id).all()
+        assert len(primary.statements) == 1 and not replica.statements
+
+        assert get_user_snapshot(1).username == 'alice'
+        assert replica.statements and len(primary.statements) == 1
+
+
+def test_reads_after_a_write_stay_on_the_primary(app, routed):
+    primary, replica = routed
+    with app.test_request_context('/', method='POST'):
+        db.session.add(User(username='bob', password='password'))
+        db.session.commit()
+
+        assert [row.username for row in search_users('bob', 10, 0)] == ['bob']
+        assert not replica.statements
+
+
+def test_export_generator_reads_from_the_replica_only_while_running(routed):
+    primary, replica = routed
+
+    rows = iter_rows('posts', 1)
+    assert next(rows)['title'] == 'hello'
+    assert not _read_only.get()
+    assert list(rows) == []
+
+    assert replica.statements and not primary.statements
+
+
+def test_recent_writers_read_from_the_primary(app, routed):
+    primary, replica = routed
+    writer = app.test_client()
+    response = writer.post('/signup', json={"username": "carol", "password": "password"})
+    assert response.status_code == 201
+    assert writer.get_cookie(READ_YOUR_WRITES_COOKIE) is not None
+
+    db.session.remove()
+    del replica.statements[:]
+    response = writer.get('/search?q=carol&type=users')
+    assert [user['username'] for user in response.get_json()['results']] == ['carol']
+    assert not replica.statements
+
+    db.session.remove()
+    reader = app.test_client()
+    login_as(reader, 1)
+    response = reader.get('/search?q=alice&type=users')
+    assert [user['username'] for user in response.get_json()['results']] == ['alice']
+    assert replica.statements
@@ -0,0 +1,92 @@
+import pytest
+
+from common import login_as
+from timeline import MemoryTimelineStore, get_timeline_store
+
+# Home timelines on the memory store (FEED_BACKEND = 'memory' under
+# TestingConfig). Jobs run inline after the commit that queues them
+# (JOB_WORKERS = 0), so a post's fan-out is done when POST /posts returns.
+
+
+def test_store_keeps_ids_ordered_unique_and_bounded():
+    store = MemoryTimelineStore(max_length=3)
+    store.push([1, 2], [5, 3])
+    store.push([1], [4, 5])
+
+    assert store.range(1, None, 10) == [5, 4, 3]
+    assert store.range(2, None, 10) == [5, 3]
+
+    store.push([1], [6])
+    assert store.range(1, None, 10) == [6, 5, 4]
+
+
+def test_store_pages_below_max_id_and_removes():
+    store = MemoryTimelineStore(max_length=10)
+    store.push([1], [1, 2, 3, 4, 5])
+
+    assert store.range(1, None, 2) == [5, 4]
+    assert store.range(1, 4, 2) == [3, 2]
+    assert store.range(1, 1, 2) == []
+    assert store.range(7, None, 2) == []
+
+    store.remove(1, [2, 4])
+    assert store.range(1, None, 10) == [5, 3, 1]
+
+
+@pytest.fixture
+def clients(app, make_user):
+    users = {name: make_user(name) for name in ('alice', 'bob', 'carol')}
+    clients = {}
+    for name, user in users.items():
+        clients[name] = app.test_client()
+        login_as(clients[name], user.id)
+    return users, clients
+
+
+def post(client, title):
+    response = client.post('/posts', json={"title": title, "content": "content"})
+    assert response.status_code == 201
+    return response.get_json()["id"]
+
+
+def feed(client):
+    return [item["title"] for item in client.get('/feed?limit=20').get_json()["posts"]]
+
+
+def test_posts_fan_out_to_followers(clients):
+    users, clients = clients
+    assert clients["bob"].post(f"/follow/{users['alice'].id}").status_code == 200
+
+    post_id = post(clients['alice'], 'first')
+
+    store = get_timeline_store()
+    assert store.range(users['bob'].id, None, 10) == [post_id]
+    assert store.range(users['alice'].id, None, 10) == [post_id]
+    assert store.range(users['carol'].id, None, 10) == []
+    assert feed(clients['bob']) == ['first']
+
+
+def test_follow_backfills_and_unfollow_prunes(clients):
+    users, clients = clients
+    post(clients['alice'], 'old')
+
+    clients['bob'].post(f"/follow/{users['alice'].id}")
+    assert feed(clients['bob']) == ['old']
+
+    clients['bob'].delete(f"/unfollow/{users['alice'].id}")
+    assert feed(clients['bob']) == []
+
+
+def test_celebrity_posts_are_pulled_at_read_time(app, clients):
+    users, clients = clients
+    app.config['FEED_CELEBRITY_THRESHOLD'] = 1
+    clients['bob'].post(f"/follow/{users['alice'].id}")
+    clients['carol'].post(f"/follow/{users['alice'].id}")
+
+    post(clients['alice'], 'famous')
+
+    store = get_timeline_store()
+    assert store.is_celebrity(users['alice'].id)
+    assert store.range(users['bob'].id, None, 10) == []
+    assert feed(clients['bob']) == ['famous']
+    assert feed(clients['carol']) == ['famous']
@@ -0,0 +1,141 @@
+import time
+
+import pytest
+
+from app import create_app
+from models import db
+from token_auth import BloomFilter, MemoryDenylistStore, TokenDenylist
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app(config_object='config.TestingConfig',
+                     SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'test.db'}",
+                     TOKEN_AUTH_ENABLED=True,
+                     JWT_SECRET_KEY='token-auth-test-signing-key-32-bytes')
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
+
+
+def bearer(token):
+    return {"Authorization": f"Bearer {token}"}
+
+
+def login(client, username='alice'):
+    response = client.post('/token', json={"username": username, "password": "password"})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def refresh(client, tokens):
+    return client.post('/token/refresh', headers=bearer(tokens["refresh_token"]))
+
+
+def test_access_token_logs_in_without_a_cookie(client, make_user):
+    make_user('alice')
+    tokens = login(client)
+
+    response = client.get('/check_session', headers=bearer(tokens["access_token"]))
+
+    assert response.status_code == 200
+    assert response.get_json()["username"] == 'alice'
+    assert 'Set-Cookie' not in response.headers
+    assert client.post('/token', json={"username": "alice", "password": "wrong"}).status_code == 401
+
+
+def test_refresh_rotates_the_pair(client, make_user):
+    make_user('alice')
+    tokens = login(client)
+
+    response = refresh(client, tokens)
+
+    assert response.status_code == 200
+    rotated = response.get_json()
+    assert rotated["refresh_token"] != tokens["refresh_token"]
+    assert client.get('/check_session', headers=bearer(rotated["access_token"])).status_code == 200
+    assert refresh(client, rotated).status_code == 200
+    # An access token is not a refresh token
+    assert client.post('/token/refresh', headers=bearer(rotated["access_token"])).status_code == 401
+
+
+# Presenting a rotated refresh token again means someone else has a copy:
+# the whole family is revoked, including the pair the rotation handed out
+def test_refresh_reuse_revokes_the_family(client, make_user):
+    make_user('alice')
+    tokens = login(client)
+    rotated = refresh(client, tokens).get_json()
+
+    response = refresh(client, tokens)
+
+    assert response.status_code == 401
+    assert response.get_json()["error"] == "Refresh token reuse detected"
+    assert refresh(client, rotated).status_code == 401
+    response = client.get('/check_session', headers=bearer(rotated["access_token"]))
+    assert response.status_code == 401
+    assert response.headers['WWW-Authenticate'] == 'Bearer error="invalid_token"'
+
+    # Other logins keep working
+    assert client.get('/check_session', headers=bearer(login(client)["access_token"])).status_code == 200
+
+
+def test_logout_revokes_the_access_token_and_its_family(client, make_user):
+    make_user('alice')
+    tokens = login(client)
+
+    assert client.delete('/logout', headers=bearer(tokens["access_token"])).status_code == 204
+
+    assert client.get('/check_session', headers=bearer(tokens["access_token"])).status_code == 401
+    assert refresh(client, tokens).status_code == 401
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter.for_capacity(1000, 0.01)
+    keys = [f"token-{i}" for i in range(1000)]
+    for key in keys:
+        bloom.add(key)
+
+    assert all(key in bloom for key in keys)
+    false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+def test_denylist_revokes_until_expiry():
+    denylist = TokenDenylist(MemoryDenylistStore())
+    denylist.revoke('live', time.time() + 60)
+    denylist.revoke('expired', time.time() - 1)
+
+    assert denylist.is_revoked('live')
+    assert not denylist.is_revoked('expired')
+    assert not denylist.is_revoked('never')
+
+
+# Another process revoking into the shared store reaches this one's filter
+# at its next sync
+def test_denylist_syncs_revocations_from_the_store():
+    store = MemoryDenylistStore()
+    local = TokenDenylist(store, sync_interval=3600)
+    other = TokenDenylist(store)
+    assert not local.is_revoked('token')
+
+    other.revoke('token', time.time() + 60)
+    assert not local.is_revoked('token')
+
+    local.sync_interval = 0
+    assert local.is_revoked('token')
+
+
+def test_denylist_rebuild_forgets_expired_ids():
+    denylist = TokenDenylist(MemoryDenylistStore(), rebuild_interval=0)
+    denylist.revoke('live', time.time() + 60)
+    denylist.revoke('expired', time.time() - 1)
+    assert 'expired' in denylist.bloom
+
+    denylist.is_revoked('live')
+
+    assert 'expired' not in denylist.bloom
+    assert 'live' in denylist.bloom
+    assert denylist.size == 1
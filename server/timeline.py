@@ -0,0 +1,208 @@
+import bisect
+import threading
+
+from flask import current_app
+
+from models import db, Friendship, Post, User
+
+# Materialized home timelines (fan-out-on-write).
+#
+# Every user has a bounded list of post ids ordered by id. create_post pushes
+# the new id into the author's own list and the post_fan_out job (fanout.py)
+# into each follower's, follow/unfollow backfill or prune the followed
+# account's recent posts, and reading a page is one range scan.
+# Accounts with more followers than FEED_CELEBRITY_THRESHOLD are not fanned
+# out; their posts are merged in at read time instead.
+
+
+class MemoryTimelineStore:
+    def __init__(self, max_length):
+        self.max_length = max_length
+        self._timelines = {}
+        self._celebrities = set()
+        self._lock = threading.Lock()
+
+    def push(self, user_ids, post_ids):
+        with self._lock:
+            for user_id in user_ids:
+                timeline = self._timelines.setdefault(user_id, [])
+                for post_id in post_ids:
+                    index = bisect.bisect_left(timeline, post_id)
+                    if index == len(timeline) or timeline[index] != post_id:
+                        timeline.insert(index, post_id)
+                if len(timeline) > self.max_length:
+                    del timeline[:len(timeline) - self.max_length]
+
+    def remove(self, user_id, post_ids):
+        with self._lock:
+            timeline = self._timelines.get(user_id)
+            if timeline:
+                drop = set(post_ids)
+                timeline[:] = [post_id for post_id in timeline if post_id not in drop]
+
+    # Newest-first post ids strictly below max_id (or from the top)
+    def range(self, user_id, max_id, limit):
+        with self._lock:
+            timeline = self._timelines.get(user_id, [])
+            end = len(timeline) if max_id is None else bisect.bisect_left(timeline, max_id)
+            return timeline[max(0, end - limit):end][::-1]
+
+    def mark_celebrity(self, user_id):
+        with self._lock:
+            self._celebrities.add(user_id)
+
+    def is_celebrity(self, user_id):
+        return user_id in self._celebrities
+
+    def celebrities(self):
+        with self._lock:
+            return set(self._celebrities)
+
+
+class RedisTimelineStore:
+    def __init__(self, client, max_length, prefix='timeline'):
+        self.client = client
+        self.max_length = max_length
+        self.prefix = prefix
+
+    def _key(self, user_id):
+        return f"{self.prefix}:{user_id}"
+
+    def push(self, user_ids, post_ids):
+        mapping = {post_id: post_id for post_id in post_ids}
+        pipe = self.client.pipeline(transaction=False)
+        for user_id in user_ids:
+            key = self._key(user_id)
+            pipe.zadd(key, mapping)
+            pipe.zremrangebyrank(key, 0, -(self.max_length + 1))
+        pipe.execute()
+
+    def remove(self, user_id, post_ids):
+        if post_ids:
+            self.client.zrem(self._key(user_id), *post_ids)
+
+    def range(self, user_id, max_id, limit):
+        upper = '+inf' if max_id is None else f"({max_id}"
+        members = self.client.zrevrangebyscore(self._key(user_id), upper, '-inf', start=0, num=limit)
+        return [int(member) for member in members]
+
+    def mark_celebrity(self, user_id):
+        self.client.sadd(f"{self.prefix}:celebrities", user_id)
+
+    def is_celebrity(self, user_id):
+        return bool(self.client.sismember(f"{self.prefix}:celebrities", user_id))
+
+    def celebrities(self):
+        return {int(member) for member in self.client.smembers(f"{self.prefix}:celebrities")}
+
+
+def create_timeline_store(config):
+    max_length = config.get('FEED_MAX_LENGTH', 800)
+    backend = config.get('FEED_BACKEND', 'memory')
+    if backend == 'memory':
+        return MemoryTimelineStore(max_length)
+    if backend == 'redis':
+        import redis  # Only needed when the redis backend is configured
+        client = redis.Redis.from_url(config['FEED_REDIS_URL'])
+        return RedisTimelineStore(client, max_length)
+    raise ValueError(f"Unknown FEED_BACKEND: {backend}")
+
+
+_store_lock = threading.Lock()
+
+
+# The store is created lazily per app so routes work with or without create_app
+def get_timeline_store():
+    app = current_app._get_current_object()
+    store = app.extensions.get('timeline')
+    if store is None:
+        with _store_lock:
+            store = app.extensions.get('timeline')
+            if store is None:
+                store = app.extensions['timeline'] = create_timeline_store(app.config)
+    return store
+
+
+def _celebrity_threshold():
+    return current_app.config.get('FEED_CELEBRITY_THRESHOLD', 10000)
+
+
+# Whether the author has more followers than FEED_CELEBRITY_THRESHOLD,
+# reading at most threshold + 1 follower rows; celebrities are remembered
+# in the store
+def detect_celebrity(author_id):
+    threshold = _celebrity_threshold()
+    followers = db.session.query(Friendship.follower_id).filter(Friendship.followed_id == author_id)
+    celebrity = followers.limit(threshold + 1).count() > threshold
+    if celebrity:
+        get_timeline_store().mark_celebrity(author_id)
+    return celebrity
+
+
+def _recent_post_ids(author_id):
+    return [row.id for row in db.session.query(Post.id)
+            .filter(Post.user_id == author_id)
+            .order_by(Post.id.desc())
+            .limit(get_timeline_store().max_length)]
+
+
+def backfill_timeline(follower_id, followed_id):
+    backfill_timelines(follower_id, [followed_id])
+
+
+# After following several accounts at once: the timeline only keeps the
+# newest max_length ids, so one query across all of them is enough
+def backfill_timelines(follower_id, followed_ids):
+    store = get_timeline_store()
+    if len(followed_ids) == 1:
+        authors = [followed_id for followed_id in followed_ids if not store.is_celebrity(followed_id)]
+    else:
+        celebrities = store.celebrities()
+        authors = [followed_id for followed_id in followed_ids if followed_id not in celebrities]
+    if not authors:
+        return
+    if len(authors) == 1:
+        post_ids = _recent_post_ids(authors[0])
+    else:
+        post_ids = [row.id for row in db.session.query(Post.id)
+                    .filter(Post.user_id.in_(authors))
+                    .order_by(Post.id.desc())
+                    .limit(store.max_length)]
+    store.push([follower_id], post_ids)
+
+
+# Celebrities are pruned too: posts fanned out before they crossed the threshold
+def prune_timeline(follower_id, followed_id):
+    get_timeline_store().remove(follower_id, _recent_post_ids(followed_id))
+
+
+# Newest-first page of post rows (with author) from the user's home timeline
+def read_timeline(user_id, max_id, limit):
+    store = get_timeline_store()
+    post_ids = store.range(user_id, max_id, limit)
+
+    # Merge in recent posts from followed celebrity accounts
+    celebrities = store.celebrities()
+    if celebrities:
+        followed_celebrities = [row.followed_id for row in db.session.query(Friendship.followed_id)
+                                .filter(Friendship.follower_id == user_id,
+                                        Friendship.followed_id.in_(celebrities))]
+        if followed_celebrities:
+            query = db.session.query(Post.id).filter(Post.user_id.in_(followed_celebrities))
+            if max_id is not None:
+                query = query.filter(Post.id < max_id)
+            celebrity_ids = [row.id for row in query.order_by(Post.id.desc()).limit(limit)]
+            post_ids = sorted(set(post_ids) | set(celebrity_ids), reverse=True)[:limit]
+
+    if not post_ids:
+        return []
+
+    rows = db.session.query(
+        Post.id,
+        Post.title,
+        Post.content,
+        Post.created_at,
+        User.id.label("author_id"),
+        User.username.label("author_username")
+    ).join(User, User.id == Post.user_id).filter(Post.id.in_(post_ids)).all()
+    return sorted(rows, key=lambda row: row.id, reverse=True)
@@ -0,0 +1,500 @@
+import hashlib
+import math
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import jwt as pyjwt
+from flask import current_app, session
+from flask.sessions import SecureCookieSessionInterface, SessionMixin
+from flask_jwt_extended import JWTManager, create_access_token, create_refresh_token, decode_token
+from flask_jwt_extended.exceptions import JWTExtendedException
+
+# Opt-in stateless token auth (TOKEN_AUTH_ENABLED).
+#
+# POST /token trades a username and password for a short-lived access token
+# and a refresh token. An access token sent as `Authorization: Bearer ...`
+# becomes a request-only session holding its user id, so every route's
+# session['user_id'] check works unchanged and no cookie is set. The token
+# also carries the username and avatar, which /check_session answers from
+# without touching the database.
+#
+# Refresh tokens rotate: POST /token/refresh marks the presented token used and
+# issues a new pair in the same family. Presenting an already-rotated
+# refresh token revokes the whole family, logging out whoever holds the
+# newest one too.
+#
+# Decoding a JWT costs more than the rest of the check, so each process
+# keeps the claims of recently verified tokens (TOKEN_CLAIMS_CACHE_SIZE)
+# until they expire; a token can't change once signed, so only the
+# revocation check runs on every request.
+#
+# Revoked access token and family ids (logouts, detected refresh reuse) go
+# to a denylist: in memory, or in Redis shared by all processes. A bloom
+# filter of everything on it sits in front, and answers the common "never
+# revoked" case without a lookup. The filter is sized from the live count for
+# TOKEN_DENYLIST_BLOOM_ERROR_RATE. With the Redis backend each process pulls
+# only the ids added since its last sync, every TOKEN_DENYLIST_SYNC_INTERVAL
+# seconds, so a revocation made elsewhere takes at most that long to apply.
+# The filter is rebuilt from scratch every TOKEN_DENYLIST_REBUILD_INTERVAL
+# seconds to forget expired ids, or sooner if it outgrows its size.
+#
+# Rotated refresh token ids are kept apart, in a store only /token/refresh
+# reads. There is one per refresh, so they would swamp the denylist and its
+# filter.
+
+# Smallest number of ids a bloom filter is sized for
+BLOOM_MIN_CAPACITY = 1024
+
+
+class BloomFilter:
+    def __init__(self, bits, hashes):
+        self.bits = bits
+        self.hashes = hashes
+        self._array = bytearray((bits + 7) // 8)
+
+    # Sized to hold `capacity` ids at about `error_rate` false positives
+    @classmethod
+    def for_capacity(cls, capacity, error_rate):
+        bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        return cls(bits, max(1, round(bits / capacity * math.log(2))))
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        # Double hashing: k positions from two 64-bit halves of one digest
+        h1, h2 = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self._array[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        array = self._array
+        return all(array[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class MemoryDenylistStore:
+    def __init__(self):
+        self._entries = {}
+        # Ids in the order they were added since the last snapshot
+        self._log = []
+        self._log_start = 0
+        self._lock = threading.Lock()
+
+    # False when token_id was already revoked
+    def add(self, token_id, expires_at):
+        with self._lock:
+            current = self._entries.get(token_id)
+            if current is not None and current > time.time():
+                return False
+            self._entries[token_id] = expires_at
+            self._log.append(token_id)
+            return True
+
+    def contains(self, token_id):
+        expires_at = self._entries.get(token_id)
+        return expires_at is not None and expires_at > time.time()
+
+    # (ids added after cursor, new cursor)
+    def changes_since(self, cursor):
+        with self._lock:
+            return self._log[max(0, cursor - self._log_start):], self._log_start + len(self._log)
+
+    # Drops expired entries; returns (live ids, cursor to sync from)
+    def snapshot(self):
+        now = time.time()
+        with self._lock:
+            self._entries = {token_id: expires_at for token_id, expires_at in self._entries.items()
+                             if expires_at > now}
+            self._log_start += len(self._log)
+            self._log = []
+            return list(self._entries), self._log_start
+
+
+# Numbers each new id from a counter in the same script, so every id below
+# a cursor is visible to whoever read it
+ADD_SCRIPT = """
+if not redis.call('SET', KEYS[1], 1, 'EX', ARGV[2], 'NX') then
+    return 0
+end
+redis.call('ZADD', KEYS[2], ARGV[3], ARGV[1])
+redis.call('ZADD', KEYS[3], redis.call('INCR', KEYS[4]), ARGV[1])
+return 1
+"""
+
+SNAPSHOT_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+for i = 1, #expired, 1000 do
+    local batch = {unpack(expired, i, math.min(i + 999, #expired))}
+    redis.call('ZREM', KEYS[1], unpack(batch))
+    redis.call('ZREM', KEYS[2], unpack(batch))
+end
+return {redis.call('GET', KEYS[3]) or '0', redis.call('ZRANGE', KEYS[1], 0, -1)}
+"""
+
+
+class RedisDenylistStore:
+    def __init__(self, client, prefix='denylist'):
+        self.client = client
+        self.prefix = prefix
+        # Live ids scored by expiry, and by the order they were added
+        self._expiry_key = f"{prefix}:expiry"
+        self._added_key = f"{prefix}:added"
+        self._seq_key = f"{prefix}:seq"
+        self._add = client.register_script(ADD_SCRIPT)
+        self._snapshot = client.register_script(SNAPSHOT_SCRIPT)
+
+    def _key(self, token_id):
+        return f"{self.prefix}:{token_id}"
+
+    def add(self, token_id, expires_at):
+        ttl = max(1, int(expires_at - time.time()))
+        return bool(self._add(keys=[self._key(token_id), self._expiry_key, self._added_key, self._seq_key],
+                              args=[token_id, ttl, expires_at]))
+
+    def contains(self, token_id):
+        return bool(self.client.exists(self._key(token_id)))
+
+    def changes_since(self, cursor):
+        rows = self.client.zrangebyscore(self._added_key, f"({cursor}", '+inf', withscores=True)
+        if not rows:
+            return [], cursor
+        return [member.decode() for member, _ in rows], int(rows[-1][1])
+
+    def snapshot(self):
+        seq, ids = self._snapshot(keys=[self._expiry_key, self._added_key, self._seq_key], args=[time.time()])
+        return [member.decode() for member in ids], int(seq)
+
+
+class TokenDenylist:
+    def __init__(self, store, error_rate=0.01, sync_interval=1, rebuild_interval=300):
+        self.store = store
+        self.error_rate = error_rate
+        self.sync_interval = sync_interval
+        self.rebuild_interval = rebuild_interval
+        self.bloom = BloomFilter.for_capacity(BLOOM_MIN_CAPACITY, error_rate)
+        self.capacity = BLOOM_MIN_CAPACITY
+        # Ids added to the current filter, counting repeats
+        self.size = 0
+        self.lookups = 0
+        self._cursor = 0
+        self._synced_at = None
+        self._rebuilt_at = None
+        # Revoked since the current rebuild started; re-added after the swap
+        self._recent = []
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+    def _note(self, token_id):
+        with self._lock:
+            self.bloom.add(token_id)
+            self.size += 1
+            self._recent.append(token_id)
+
+    def revoke(self, token_id, expires_at):
+        self.store.add(token_id, expires_at)
+        self._note(token_id)
+
+    def is_revoked(self, token_id):
+        self._maybe_sync()
+        if token_id not in self.bloom:
+            return False
+        self.lookups += 1
+        return self.store.contains(token_id)
+
+    # Pull other processes' revocations into the filter, or rebuild it when
+    # it is due or full; one thread does it, the rest carry on with the
+    # current filter
+    def _maybe_sync(self):
+        now = time.monotonic()
+        rebuild = (self._rebuilt_at is None or now - self._rebuilt_at >= self.rebuild_interval
+                   or self.size > self.capacity)
+        if not rebuild and now - self._synced_at < self.sync_interval:
+            return
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            if rebuild:
+                self._rebuild()
+            else:
+                token_ids, self._cursor = self.store.changes_since(self._cursor)
+                with self._lock:
+                    for token_id in token_ids:
+                        self.bloom.add(token_id)
+                    self.size += len(token_ids)
+            self._synced_at = time.monotonic()
+        finally:
+            self._sync_lock.release()
+
+    # A new filter with room for twice the live ids, dropping expired ones
+    def _rebuild(self):
+        with self._lock:
+            self._recent = []
+        token_ids, cursor = self.store.snapshot()
+        capacity = max(BLOOM_MIN_CAPACITY, 2 * len(token_ids))
+        bloom = BloomFilter.for_capacity(capacity, self.error_rate)
+        for token_id in token_ids:
+            bloom.add(token_id)
+        with self._lock:
+            for token_id in self._recent:
+                bloom.add(token_id)
+            self.bloom = bloom
+            self.capacity = capacity
+            self.size = len(token_ids) + len(self._recent)
+            self._recent = []
+            self._cursor = cursor
+        self._rebuilt_at = time.monotonic()
+
+
+class MemoryUsedTokenStore:
+    def __init__(self):
+        self._entries = {}
+        self._pruned_size = 0
+        self._lock = threading.Lock()
+
+    # False when token_id was already used
+    def add(self, token_id, expires_at):
+        now = time.time()
+        with self._lock:
+            current = self._entries.get(token_id)
+            if current is not None and current > now:
+                return False
+            self._entries[token_id] = expires_at
+            # Drop expired entries whenever the store has doubled
+            if len(self._entries) > 2 * self._pruned_size:
+                self._entries = {used_id: used_expiry for used_id, used_expiry in self._entries.items()
+                                 if used_expiry > now}
+                self._pruned_size = len(self._entries)
+            return True
+
+
+class RedisUsedTokenStore:
+    def __init__(self, client, prefix='refresh_used'):
+        self.client = client
+        self.prefix = prefix
+
+    def add(self, token_id, expires_at):
+        ttl = max(1, int(expires_at - time.time()))
+        return bool(self.client.set(f"{self.prefix}:{token_id}", 1, ex=ttl, nx=True))
+
+
+def _redis_client(config):
+    import redis  # Only needed when the redis backend is configured
+    return redis.Redis.from_url(config['TOKEN_DENYLIST_REDIS_URL'])
+
+
+def create_denylist(config):
+    backend = config.get('TOKEN_DENYLIST_BACKEND', 'memory')
+    if backend == 'memory':
+        store = MemoryDenylistStore()
+    elif backend == 'redis':
+        store = RedisDenylistStore(_redis_client(config))
+    else:
+        raise ValueError(f"Unknown TOKEN_DENYLIST_BACKEND: {backend}")
+    return TokenDenylist(
+        store,
+        config.get('TOKEN_DENYLIST_BLOOM_ERROR_RATE', 0.01),
+        sync_interval=config.get('TOKEN_DENYLIST_SYNC_INTERVAL', 1),
+        rebuild_interval=config.get('TOKEN_DENYLIST_REBUILD_INTERVAL', 300)
+    )
+
+
+def create_used_token_store(config):
+    backend = config.get('TOKEN_DENYLIST_BACKEND', 'memory')
+    if backend == 'memory':
+        return MemoryUsedTokenStore()
+    if backend == 'redis':
+        return RedisUsedTokenStore(_redis_client(config))
+    raise ValueError(f"Unknown TOKEN_DENYLIST_BACKEND: {backend}")
+
+
+# Encoded token -> verified claims, least recently used first
+class ClaimsCache:
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, encoded):
+        with self._lock:
+            claims = self._entries.get(encoded)
+            if claims is None:
+                return None
+            if claims['exp'] <= time.time():
+                del self._entries[encoded]
+                return None
+            self._entries.move_to_end(encoded)
+            return claims
+
+    def put(self, encoded, claims):
+        with self._lock:
+            self._entries[encoded] = claims
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+_extension_lock = threading.Lock()
+
+
+def _get_extension(name, create):
+    app = current_app._get_current_object()
+    extension = app.extensions.get(name)
+    if extension is None:
+        with _extension_lock:
+            extension = app.extensions.get(name)
+            if extension is None:
+                extension = app.extensions[name] = create(app.config)
+    return extension
+
+
+def get_denylist():
+    return _get_extension('token_denylist', create_denylist)
+
+
+def get_used_refresh_tokens():
+    return _get_extension('token_used_refresh', create_used_token_store)
+
+
+def get_claims_cache():
+    return _get_extension('token_claims', lambda config: ClaimsCache(config.get('TOKEN_CLAIMS_CACHE_SIZE', 10000)))
+
+
+def token_auth_enabled():
+    return current_app.config.get('TOKEN_AUTH_ENABLED', False)
+
+
+class InvalidToken(Exception):
+    pass
+
+
+def _decode(encoded, token_type):
+    cache = get_claims_cache()
+    claims = cache.get(encoded)
+    if claims is None:
+        try:
+            claims = decode_token(encoded)
+        except (pyjwt.PyJWTError, JWTExtendedException) as e:
+            raise InvalidToken(str(e))
+        cache.put(encoded, claims)
+    if claims.get('type') != token_type:
+        raise InvalidToken(f"Expected an {token_type} token")
+    return claims
+
+
+# Verified, unrevoked claims of an access token, or raises InvalidToken
+def verify_token(encoded):
+    claims = _decode(encoded, 'access')
+    denylist = get_denylist()
+    if denylist.is_revoked(claims['jti']) or denylist.is_revoked(claims['fam']):
+        raise InvalidToken("Token has been revoked")
+    return claims
+
+
+def bearer_token(request):
+    header = request.headers.get('Authorization', '')
+    scheme, _, token = header.partition(' ')
+    return token.strip() if scheme.lower() == 'bearer' and token.strip() else None
+
+
+# A fresh access/refresh pair; rotation passes the family along
+def issue_tokens(user, family=None):
+    family = family or uuid.uuid4().hex
+    access_token = create_access_token(
+        identity=str(user.id),
+        additional_claims={"username": user.username, "image_url": user.image_url, "fam": family}
+    )
+    refresh_token = create_refresh_token(identity=str(user.id), additional_claims={"fam": family})
+    return {
+        "access_token": access_token,
+        "refresh_token": refresh_token,
+        "token_type": "Bearer",
+        "expires_in": int(current_app.config['JWT_ACCESS_TOKEN_EXPIRES'].total_seconds())
+    }
+
+
+# Any token issued in the family has expired by then
+def _family_expiry():
+    return time.time() + current_app.config['JWT_REFRESH_TOKEN_EXPIRES'].total_seconds()
+
+
+def revoke_family(family):
+    get_denylist().revoke(family, _family_expiry())
+
+
+# Rotate a refresh token; returns its claims, or raises InvalidToken
+def rotate_refresh_token(encoded):
+    claims = _decode(encoded, 'refresh')
+    denylist = get_denylist()
+    if denylist.is_revoked(claims['fam']):
+        raise InvalidToken("Token has been revoked")
+    if not get_used_refresh_tokens().add(claims['jti'], claims['exp']):
+        # Already rotated once: someone else holds a copy of it
+        revoke_family(claims['fam'])
+        raise InvalidToken("Refresh token reuse detected")
+    return claims
+
+
+class TokenSession(dict, SessionMixin):
+    def __init__(self, claims=None, error=None):
+        super().__init__()
+        self.claims = claims
+        self.error = error
+        if claims is not None:
+            self['user_id'] = int(claims['sub'])
+
+
+# Bearer requests get a TokenSession that is never saved; everything else
+# keeps the signed cookie session
+class TokenSessionInterface(SecureCookieSessionInterface):
+    def open_session(self, app, request):
+        token = bearer_token(request)
+        if token is None:
+            return super().open_session(app, request)
+        try:
+            return TokenSession(verify_token(token))
+        except InvalidToken as e:
+            return TokenSession(error=str(e))
+
+    def save_session(self, app, session_, response):
+        if isinstance(session_, TokenSession):
+            return
+        super().save_session(app, session_, response)
+
+
+def is_token_session():
+    return isinstance(session._get_current_object(), TokenSession)
+
+
+# {"id", "username", "image_url"} from this request's access token, or None
+def token_identity():
+    session_ = session._get_current_object()
+    if not isinstance(session_, TokenSession) or session_.claims is None:
+        return None
+    claims = session_.claims
+    return {"id": int(claims['sub']), "username": claims['username'], "image_url": claims['image_url']}
+
+
+# Log out a token session: the access token and its refresh family
+def revoke_current_token():
+    claims = session._get_current_object().claims
+    get_denylist().revoke(claims['jti'], claims['exp'])
+    revoke_family(claims['fam'])
+
+
+def _challenge(response):
+    # Tell token clients why they got a 401, so they know to refresh
+    if response.status_code == 401 and is_token_session():
+        error = session._get_current_object().error
+        response.headers['WWW-Authenticate'] = 'Bearer error="invalid_token"' if error else 'Bearer'
+    return response
+
+
+def init_token_auth(app):
+    if not app.config.get('TOKEN_AUTH_ENABLED'):
+        return
+    if 'flask-jwt-extended' not in app.extensions:
+        JWTManager(app)
+    app.session_interface = TokenSessionInterface()
+    app.after_request(_challenge)
@@ -0,0 +1,8 @@
+import os
+
+from app import create_app
+
+# WSGI entry point for gunicorn (wsgi:app, see the Procfile) and the flask
+# CLI. Built at import so gunicorn's preloading master holds it before
+# forking; importing app.py itself builds nothing.
+app = create_app(os.environ.get('APP_CONFIG_FILE'))